@@ -0,0 +1,54 @@
+"""Inputs shared by the micro-benchmarks of the hot paths.
+
+The benchmarks sweep image resolutions, greyscale against colour and, for the functions that take
+an array, C-contiguous against strided inputs. They are kept out of `tests/` as the large sizes take
+a few minutes; run them with `pytest benchmarks/`, see the README for saving and comparing baselines.
+"""
+import functools
+
+import numpy as np
+import pytest
+
+from image_manipulation import image_utils
+
+
+RESOLUTIONS = {
+    "vga": (480, 640),
+    "1080p": (1080, 1920),
+    "4k": (2160, 3840),
+    "8k": (4320, 7680),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _make_image(resolution: str, color: bool, strided: bool) -> np.ndarray:
+    """A random image, strided images being every other column of an image twice as wide."""
+    height, width = RESOLUTIONS[resolution]
+    shape = (height, 2 * width if strided else width) + ((3,) if color else ())
+    image = np.random.RandomState(0).randint(0, 256, shape).astype(np.uint8)
+    return image[:, ::2] if strided else image
+
+
+@pytest.fixture(params=list(RESOLUTIONS))
+def resolution(request):
+    return request.param
+
+
+@pytest.fixture(params=[False, True], ids=["grey", "color"])
+def color(request):
+    return request.param
+
+
+@pytest.fixture(params=[False, True], ids=["contiguous", "strided"])
+def strided(request):
+    return request.param
+
+
+@pytest.fixture
+def image(resolution, color, strided):
+    return _make_image(resolution, color, strided)
+
+
+@pytest.fixture
+def image_pb(resolution, color):
+    return image_utils.convert_image_to_proto(_make_image(resolution, color, False))
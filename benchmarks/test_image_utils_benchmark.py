@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from image_manipulation import image_utils
+
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture(autouse=True)
+def _warm_up_kernels():
+    image_utils.warm_up_kernels()
+
+
+def test_get_mean_image(benchmark, image, resolution):
+    benchmark.group = f"get_mean_image {resolution}"
+    benchmark(image_utils.get_mean_image, image)
+
+
+def test_get_rotated_image(benchmark, image, resolution):
+    benchmark.group = f"get_rotated_image {resolution}"
+    # The rotation is a view, the copy is where the time goes when it is sent back.
+    benchmark(lambda: np.ascontiguousarray(image_utils.get_rotated_image(image, 90)))
+
+
+def test_convert_image_to_proto(benchmark, image, resolution):
+    benchmark.group = f"convert_image_to_proto {resolution}"
+    benchmark(image_utils.convert_image_to_proto, image)
+
+
+def test_convert_proto_to_image(benchmark, image_pb, resolution):
+    benchmark.group = f"convert_proto_to_image {resolution}"
+    benchmark(image_utils.convert_proto_to_image, image_pb)
@@ -0,0 +1,34 @@
+from mock import Mock
+import pytest
+
+from image_manipulation import image_utils
+from image_manipulation.communication_utils import ImageService, get_pipeline_operations
+from image_manipulation.image_pb2 import NLImagePipelineRequest, NLImageRotateRequest
+
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture(scope="module")
+def service():
+    image_utils.warm_up_kernels()
+    return ImageService()
+
+
+def test_mean_filter(benchmark, service, image_pb, resolution):
+    benchmark.group = f"ImageService {resolution}"
+    benchmark(service.MeanFilter, image_pb, Mock())
+
+
+def test_rotate_image(benchmark, service, image_pb, resolution):
+    benchmark.group = f"ImageService {resolution}"
+    request = NLImageRotateRequest(rotation=NLImageRotateRequest.NINETY_DEG, image=image_pb)
+    benchmark(service.RotateImage, request, Mock())
+
+
+def test_process_mean_and_rotate(benchmark, service, image_pb, resolution):
+    benchmark.group = f"ImageService {resolution}"
+    request = NLImagePipelineRequest(
+        operations=get_pipeline_operations(mean=True, rotate=90), image=image_pb
+    )
+    benchmark(service.Process, request, Mock())
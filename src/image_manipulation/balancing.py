@@ -0,0 +1,210 @@
+"""Balance the calls of a client over several servers, leaving out the failing and the slow ones.
+
+The balancer picks the server of each call from the calls it has in flight to each:
+    round_robin: Every server in turn.
+    least_outstanding: The server with the fewest calls in flight.
+    power_of_two: The one with fewer calls in flight of two servers picked at random. It is
+        nearly as good as least_outstanding, and doesn't send all the calls of a burst to the
+        same idle server while the counts catch up.
+
+A server is ejected, i.e. gets no calls for a while, after a few failed calls in a row, or when its
+latency gets several times the median of the others. It comes back after `ejection_seconds`, for
+longer each time it is ejected again. The gRPC health checks of the client leave out the servers that
+don't answer SERVING until they do. At most half the servers are ejected at a time, and when none is
+left the calls go to all of them rather than failing.
+"""
+import logging
+import random
+import statistics
+import threading
+import time
+from typing import Callable, List, Sequence
+
+import grpc
+
+
+LOG = logging.getLogger(__name__)
+
+BALANCING_POLICIES = ["round_robin", "least_outstanding", "power_of_two"]
+# The status codes of the calls that count against their server: it is down, overloaded or too slow.
+FAILURE_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.INTERNAL,
+    grpc.StatusCode.UNKNOWN,
+}
+# Failed calls in a row that eject a server.
+FAILURES_TO_EJECT = 3
+# A server whose latency is over this many times the median of the others is ejected.
+LATENCY_FACTOR_TO_EJECT = 3.0
+# Calls a server must have completed since it came back before its latency is judged.
+MINIMUM_CALLS_TO_JUDGE_LATENCY = 10
+# Weight of the latest call in the moving average of the latency of a server.
+LATENCY_SMOOTHING = 0.2
+# The longest ejection, in multiples of `ejection_seconds`.
+MAXIMUM_EJECTION_MULTIPLIER = 10
+
+
+def parse_endpoints(endpoints: str or Sequence[str]) -> List[str]:
+    """The servers of a comma-separated list of host:port, or of a list of them."""
+    if isinstance(endpoints, str):
+        endpoints = endpoints.split(",")
+    return [endpoint.strip() for endpoint in endpoints if endpoint.strip()]
+
+
+def read_endpoints_file(path: str) -> List[str]:
+    """Read the servers of a static resolver file, one host:port per line.
+
+    Blank lines and everything after a # are left out.
+    """
+    with open(path) as endpoints_file:
+        return parse_endpoints([line.split("#")[0] for line in endpoints_file])
+
+
+class _Endpoint:
+    """What the balancer knows of a server."""
+
+    def __init__(self, target: str):
+        self.target = target
+        self.outstanding = 0
+        # Moving average of the seconds of the calls, None until one completes.
+        self.latency = None
+        self.calls = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.serving = True
+
+
+class EndpointBalancer:
+    """Pick the server of each call, see the module's documentation.
+
+    It is thread-safe.
+
+    Args:
+        targets: The host and port of each server.
+        policy: How the server of a call is picked, in `BALANCING_POLICIES`.
+        ejection_seconds: How long a server is ejected for the first time.
+        clock: Returns the current time in seconds.
+
+    Raises:
+        ValueError: If there is no target or the policy is unknown.
+    """
+
+    def __init__(
+        self,
+        targets: Sequence[str],
+        policy: str = "power_of_two",
+        ejection_seconds: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not targets:
+            raise ValueError("No server to balance the calls over")
+        if policy not in BALANCING_POLICIES:
+            raise ValueError(f"The balancing policy must be in {BALANCING_POLICIES} and not {policy}")
+        self.policy = policy
+        self.ejection_seconds = ejection_seconds
+        self._clock = clock
+        self._endpoints = [_Endpoint(target) for target in targets]
+        self._lock = threading.Lock()
+        self._turn = 0
+
+    def _get_candidates(self) -> List[int]:
+        """The servers that can take calls. Call it holding the lock."""
+        now = self._clock()
+        serving = [index for index, endpoint in enumerate(self._endpoints) if endpoint.serving]
+        available = [index for index in serving if self._endpoints[index].ejected_until <= now]
+        # Trying a server that may be down beats failing the call.
+        return available or serving or list(range(len(self._endpoints)))
+
+    def pick(self) -> int:
+        """The index of the server of a new call, whose `finish` must be called once it completes."""
+        with self._lock:
+            candidates = self._get_candidates()
+            self._turn += 1
+            if self.policy == "round_robin":
+                index = candidates[self._turn % len(candidates)]
+            elif self.policy == "least_outstanding":
+                # Starting at a different server each time, so the ties go to each in turn.
+                start = self._turn % len(candidates)
+                index = min(
+                    candidates[start:] + candidates[:start],
+                    key=lambda index: self._endpoints[index].outstanding,
+                )
+            else:
+                index = min(
+                    random.sample(candidates, min(2, len(candidates))),
+                    key=lambda index: (self._endpoints[index].outstanding, self._endpoints[index].latency or 0.0),
+                )
+            self._endpoints[index].outstanding += 1
+            return index
+
+    def finish(self, index: int, seconds: float, code: grpc.StatusCode) -> None:
+        """Record that a call to server `index` completed with `code` after `seconds`."""
+        with self._lock:
+            endpoint = self._endpoints[index]
+            endpoint.outstanding -= 1
+            if code in FAILURE_CODES:
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= FAILURES_TO_EJECT:
+                    self._eject(endpoint, f"{endpoint.consecutive_failures} failed calls in a row, the last {code.name}")
+                return
+            endpoint.consecutive_failures = 0
+            endpoint.calls += 1
+            if endpoint.latency is None:
+                endpoint.latency = seconds
+            else:
+                endpoint.latency += LATENCY_SMOOTHING * (seconds - endpoint.latency)
+            if endpoint.calls < MINIMUM_CALLS_TO_JUDGE_LATENCY:
+                return
+            now = self._clock()
+            other_latencies = [
+                other.latency for other in self._endpoints
+                if other is not endpoint and other.latency is not None and other.ejected_until <= now
+            ]
+            if other_latencies and endpoint.latency > LATENCY_FACTOR_TO_EJECT * statistics.median(other_latencies):
+                self._eject(
+                    endpoint,
+                    f"a latency of {1000 * endpoint.latency:.1f} ms, over {LATENCY_FACTOR_TO_EJECT} times the others'",
+                )
+
+    def _eject(self, endpoint: _Endpoint, reason: str) -> None:
+        """Give a server no calls for a while, if few enough are. Call it holding the lock."""
+        now = self._clock()
+        if endpoint.ejected_until > now:
+            return
+        ejected = sum(other.ejected_until > now for other in self._endpoints)
+        if ejected + 1 > len(self._endpoints) // 2:
+            return
+        endpoint.ejections += 1
+        seconds = self.ejection_seconds * min(endpoint.ejections, MAXIMUM_EJECTION_MULTIPLIER)
+        endpoint.ejected_until = now + seconds
+        # It starts afresh when it comes back.
+        endpoint.consecutive_failures = 0
+        endpoint.calls = 0
+        endpoint.latency = None
+        LOG.warning(f"Ejected {endpoint.target} for {seconds:.0f} seconds after {reason}")
+
+    def set_serving(self, index: int, serving: bool) -> None:
+        """Record the result of a health check of server `index`."""
+        with self._lock:
+            endpoint = self._endpoints[index]
+            if endpoint.serving != serving:
+                LOG.warning(f"{endpoint.target} is {'back' if serving else 'not serving'}")
+            endpoint.serving = serving
+
+    def stats(self) -> List[dict]:
+        """The state of each server."""
+        with self._lock:
+            now = self._clock()
+            return [
+                {
+                    "target": endpoint.target,
+                    "outstanding": endpoint.outstanding,
+                    "latency": endpoint.latency,
+                    "serving": endpoint.serving,
+                    "ejected": endpoint.ejected_until > now,
+                }
+                for endpoint in self._endpoints
+            ]
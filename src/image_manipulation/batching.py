@@ -0,0 +1,97 @@
+"""Run the requests that arrive together as one batch.
+
+A call that finds no open batch for its key opens one and becomes its leader: it waits for the
+batch window, or until the batch is full, then runs the whole batch and hands every other call
+its result. The batches of different keys run on their own leaders' threads, so they don't wait
+on each other. The window is the most a request waits for others, so it bounds the latency
+batching adds.
+"""
+import threading
+import time
+from typing import Any, Callable, Hashable, List
+
+
+class _Batch:
+    """The requests of one batch and, once it ran, their results."""
+
+    def __init__(self):
+        self.items = []
+        self.closed = False
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Collect the requests of concurrent calls with the same key and run them together.
+
+    Args:
+        run_batch: Called with a key and the list of the requests of a batch, it returns the list
+            of their results in the same order.
+        window: Seconds the first request of a batch waits for more.
+        max_batch_size: A batch runs as soon as it has this many requests.
+
+    Raises:
+        ValueError: If the window is negative or the batch size below one.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[Hashable, List[Any]], List[Any]],
+        window: float = 0.002,
+        max_batch_size: int = 32,
+    ):
+        if window < 0:
+            raise ValueError(f"The batch window can't be negative, got {window}")
+        if max_batch_size < 1:
+            raise ValueError(f"The batch size must be at least 1 and not {max_batch_size}")
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._condition = threading.Condition()
+        self._open_batches = {}
+
+    def run(self, key: Hashable, item: Any) -> Any:
+        """Run `item` in a batch with the other requests of `key`, and return its result.
+
+        Raises:
+            Exception: Whatever `run_batch` raised, for every request of the batch.
+        """
+        with self._condition:
+            batch = self._open_batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._open_batches[key] = batch
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_batch_size:
+                self._close(key, batch)
+
+            if leader:
+                deadline = time.monotonic() + self.window
+                while not batch.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._close(key, batch)
+                        break
+                    self._condition.wait(remaining)
+
+        if leader:
+            try:
+                batch.results = self.run_batch(key, batch.items)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+    def _close(self, key: Hashable, batch: _Batch) -> None:
+        """Stop adding to `batch`, and wake its leader up. Call it holding the condition."""
+        batch.closed = True
+        del self._open_batches[key]
+        self._condition.notify_all()
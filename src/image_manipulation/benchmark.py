@@ -0,0 +1,307 @@
+"""Measure the latency and throughput of a server under a configurable load.
+
+A scenario describes the load: the mix of operations, the image sizes, how many of them are in
+colour, how many requests are in flight and for how long. Each client thread sends one Process
+request at a time and times it, so the concurrency is the number of threads. The threads are spread
+over a few processes so the client itself doesn't become the bottleneck.
+
+Scenarios are read from a json file holding one scenario or a list of them; missing keys take the
+values of `DEFAULT_SCENARIO`. Running the same scenarios against differently configured servers, with
+a different label each time, and appending to the same csv report lines the results up side by side.
+"""
+import csv
+import json
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from typing import List
+
+import grpc
+import numpy as np
+
+from image_manipulation.image_pb2 import NLImagePipelineRequest
+from image_manipulation.image_pb2_grpc import NLImageServiceStub
+from image_manipulation.image_utils import convert_image_to_proto
+from image_manipulation.communication_utils import create_channel, get_pipeline_operations
+
+
+LOG = logging.getLogger(__name__)
+
+
+DEFAULT_SCENARIO = {
+    "name": "default",
+    # Each request picks one of these at random.
+    "operations": ["mean", "rotate", "mean+rotate"],
+    # Each request picks one of these sizes, as WIDTHxHEIGHT, at random.
+    "image_sizes": ["640x480", "1920x1080"],
+    # The fraction of the requests with a colour image, the others are greyscale.
+    "color_ratio": 0.5,
+    # Number of requests in flight at any time.
+    "concurrency": 8,
+    # Number of client processes the concurrency is spread over.
+    "processes": 2,
+    # How long to measure for, in seconds. Ignored if `requests` is set.
+    "duration": 10.0,
+    # Number of requests to measure, 0 to measure for `duration` instead.
+    "requests": 0,
+    # Seconds of load before measuring, left out of the results.
+    "warmup": 2.0,
+    # The deadline of each request in seconds, 0 for none. The requests past it count as errors.
+    "timeout": 0.0,
+    "seed": 0,
+}
+LATENCY_PERCENTILES = [50, 90, 99, 99.9]
+# Distinct images of each size and colour every client process cycles through.
+_IMAGES_PER_KIND = 4
+# Seconds a thread waits before its next request when the server sheds one.
+_SHED_BACKOFF = 0.01
+
+
+def load_scenarios(path: str) -> List[dict]:
+    """Read the scenarios of a json file, filling in the defaults.
+
+    Raises:
+        ValueError: If a scenario has a key that isn't in `DEFAULT_SCENARIO`.
+    """
+    with open(path) as scenario_file:
+        scenarios = json.load(scenario_file)
+    if isinstance(scenarios, dict):
+        scenarios = [scenarios]
+    return [make_scenario(**scenario) for scenario in scenarios]
+
+
+def make_scenario(**overrides) -> dict:
+    """A scenario with the default values, overridden by `overrides`.
+
+    Raises:
+        ValueError: If a key isn't in `DEFAULT_SCENARIO`.
+    """
+    unknown_keys = set(overrides) - set(DEFAULT_SCENARIO)
+    if unknown_keys:
+        raise ValueError(f"Unknown scenario keys {sorted(unknown_keys)}, expected {sorted(DEFAULT_SCENARIO)}")
+    scenario = dict(DEFAULT_SCENARIO)
+    scenario.update(overrides)
+    return scenario
+
+
+def _parse_image_size(image_size: str) -> tuple:
+    """The (height, width) of a "WIDTHxHEIGHT" size."""
+    width, height = image_size.lower().split("x")
+    return int(height), int(width)
+
+
+def _make_requests(scenario: dict, random_state: np.random.RandomState) -> List[tuple]:
+    """The requests a client process picks from, with their size in bytes."""
+    operations = {}
+    for operation in scenario["operations"]:
+        steps = operation.split("+")
+        unknown_steps = set(steps) - {"mean", "rotate"}
+        if unknown_steps:
+            raise ValueError(f"Unknown operations {sorted(unknown_steps)} in {operation}")
+        operations[operation] = get_pipeline_operations(mean="mean" in steps, rotate=90 if "rotate" in steps else 0)
+
+    requests = []
+    for image_size in scenario["image_sizes"]:
+        height, width = _parse_image_size(image_size)
+        for color in [False, True]:
+            shape = (height, width, 3) if color else (height, width)
+            for _ in range(_IMAGES_PER_KIND):
+                image_pb = convert_image_to_proto(random_state.randint(0, 256, shape).astype(np.uint8))
+                for operation, pipeline in operations.items():
+                    request = NLImagePipelineRequest(operations=pipeline, image=image_pb)
+                    requests.append((operation, color, request, request.ByteSize()))
+    return requests
+
+
+def _run_benchmark_thread(
+    stub: NLImageServiceStub,
+    requests: List[tuple],
+    scenario: dict,
+    random_state: np.random.RandomState,
+    warmup_end: float,
+    number_of_requests: int,
+    records: list,
+) -> None:
+    """Send one request after another, recording those that start after `warmup_end`."""
+    color_requests = [request for request in requests if request[1]]
+    greyscale_requests = [request for request in requests if not request[1]]
+    measure_end = warmup_end + scenario["duration"]
+    while True:
+        now = time.time()
+        measuring = now >= warmup_end
+        if measuring and (len(records) >= number_of_requests if number_of_requests else now >= measure_end):
+            return
+        pool = color_requests if random_state.random_sample() < scenario["color_ratio"] else greyscale_requests
+        _, _, request, request_bytes = pool[random_state.randint(len(pool))]
+        start = time.perf_counter()
+        shed = False
+        try:
+            response = stub.Process(request, timeout=scenario["timeout"] or None)
+            succeeded = response.width != 0
+            response_bytes = response.ByteSize()
+        except grpc.RpcError as error:
+            succeeded = False
+            response_bytes = 0
+            shed = error.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+        latency = time.perf_counter() - start
+        if measuring:
+            records.append((now, now + latency, latency, request_bytes + response_bytes, succeeded))
+        if not succeeded and shed:
+            # Back off like a client would, rather than spin on the rejections.
+            time.sleep(_SHED_BACKOFF)
+
+
+def _run_benchmark_process(
+    target: str,
+    scenario: dict,
+    compression: str,
+    process_index: int,
+    threads: int,
+    ready,
+    results,
+) -> None:
+    """One client process: run `threads` closed loops and put their records on `results`."""
+    records = []
+    try:
+        random_state = np.random.RandomState(scenario["seed"] + process_index)
+        requests = _make_requests(scenario, random_state)
+        channel = create_channel(target, compression=compression)
+        stub = NLImageServiceStub(channel)
+        # Start the load together with the other processes, once all of them made their images.
+        ready.wait()
+        warmup_end = time.time() + scenario["warmup"]
+        number_of_requests = 0
+        if scenario["requests"]:
+            number_of_requests = math.ceil(scenario["requests"] / scenario["concurrency"])
+        thread_records = [[] for _ in range(threads)]
+        benchmark_threads = [
+            threading.Thread(
+                target=_run_benchmark_thread,
+                args=(
+                    stub, requests, scenario,
+                    np.random.RandomState(scenario["seed"] * 1000 + process_index * scenario["concurrency"] + index),
+                    warmup_end, number_of_requests, thread_records[index],
+                ),
+            )
+            for index in range(threads)
+        ]
+        for benchmark_thread in benchmark_threads:
+            benchmark_thread.start()
+        for benchmark_thread in benchmark_threads:
+            benchmark_thread.join()
+        channel.close()
+        for thread_record in thread_records:
+            records.extend(thread_record)
+    except Exception as e:
+        LOG.error(f"A benchmark process stopped: {format(e)}")
+        # Don't leave the other processes waiting for this one.
+        ready.abort()
+    finally:
+        results.put(records)
+
+
+def summarise(records: List[tuple], scenario: dict, label: str = "") -> dict:
+    """Summarise the records of a benchmark run.
+
+    Args:
+        records: (start, end, latency, bytes, succeeded) of every measured request.
+        scenario: The scenario that was run.
+        label: A name for the server configuration, to tell the results apart.
+
+    Returns:
+        The summary, with the latencies in milliseconds.
+
+    """
+    succeeded = [record for record in records if record[4]]
+    latencies = np.array([record[2] for record in succeeded]) * 1000.0
+    elapsed = max(record[1] for record in records) - min(record[0] for record in records) if records else 0.0
+    summary = {
+        "label": label,
+        "scenario": scenario["name"],
+        "concurrency": scenario["concurrency"],
+        "processes": scenario["processes"],
+        "requests": len(succeeded),
+        "errors": len(records) - len(succeeded),
+        "elapsed_s": elapsed,
+        "requests_per_s": len(succeeded) / elapsed if elapsed else 0.0,
+        "megabytes_per_s": sum(record[3] for record in succeeded) / elapsed / 1e6 if elapsed else 0.0,
+    }
+    for percentile in LATENCY_PERCENTILES:
+        value = float(np.percentile(latencies, percentile)) if len(latencies) else float("nan")
+        summary[f"latency_p{percentile}_ms"] = value
+    summary["latency_mean_ms"] = float(latencies.mean()) if len(latencies) else float("nan")
+    summary["latency_max_ms"] = float(latencies.max()) if len(latencies) else float("nan")
+    return summary
+
+
+def run_benchmark(target: str, scenario: dict, compression: str = "gzip", label: str = "") -> dict:
+    """Run one scenario against the server at `target`.
+
+    Args:
+        target: The host and port of the server.
+        scenario: The scenario, see `DEFAULT_SCENARIO`.
+        compression: The compression policy of the requests.
+        label: A name for the server configuration, to tell the results apart.
+
+    Returns:
+        The summary of the run, see `summarise`.
+
+    """
+    scenario = make_scenario(**scenario)
+    processes = max(1, min(scenario["processes"], scenario["concurrency"]))
+    scenario["processes"] = processes
+    # The threads left over go to the first processes, so that `concurrency` of them run in all.
+    threads, extra_threads = divmod(scenario["concurrency"], processes)
+    # Spawn rather than fork, gRPC doesn't support forking once it has been used.
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(processes)
+    results = context.Queue()
+    benchmark_processes = [
+        context.Process(
+            target=_run_benchmark_process,
+            args=(
+                target, scenario, compression, process_index,
+                threads + (process_index < extra_threads), ready, results,
+            ),
+        )
+        for process_index in range(processes)
+    ]
+    for benchmark_process in benchmark_processes:
+        benchmark_process.start()
+    records = []
+    for _ in benchmark_processes:
+        records.extend(results.get())
+    for benchmark_process in benchmark_processes:
+        benchmark_process.join()
+    return summarise(records, scenario, label=label)
+
+
+def format_summary(summary: dict) -> str:
+    """A human readable version of a summary."""
+    percentiles = ", ".join(
+        f"p{percentile} {summary[f'latency_p{percentile}_ms']:.2f}" for percentile in LATENCY_PERCENTILES
+    )
+    return (
+        f"[{summary['label'] or 'benchmark'}] {summary['scenario']}: {summary['requests']} requests, "
+        f"{summary['errors']} errors in {summary['elapsed_s']:.2f}s at concurrency {summary['concurrency']}\n"
+        f"    {summary['requests_per_s']:.1f} requests/s, {summary['megabytes_per_s']:.1f} MB/s\n"
+        f"    latency (ms): {percentiles}, mean {summary['latency_mean_ms']:.2f}, "
+        f"max {summary['latency_max_ms']:.2f}"
+    )
+
+
+def write_report(summaries: List[dict], path: str) -> None:
+    """Write the summaries to a json file, or append them to a csv file, based on the extension."""
+    if os.path.splitext(path)[-1].lower() == ".csv":
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, "a", newline="") as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=list(summaries[0]))
+            if new_file:
+                writer.writeheader()
+            writer.writerows(summaries)
+    else:
+        with open(path, "w") as report_file:
+            json.dump(summaries, report_file, indent=4)
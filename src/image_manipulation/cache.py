@@ -0,0 +1,318 @@
+"""Cache the responses of the server or the client, keyed by the content of the requests.
+
+The key of a request is a hash of the image bytes, its dimensions and encodings, and what is done
+to it, so the same frame sent again gets the same key whichever call it comes in. The hash is
+xxhash or blake3 when one of them is installed, blake2b from the standard library otherwise.
+
+Responses are kept in memory up to a byte budget, the least recently used going first. With a
+directory, the evicted responses are written there, up to a budget of their own, and read back on
+a hit. The files are named by their key, so several processes can read a directory, and the
+files outlive the process for the next run over the same frames. Each cache trims all the files of
+its directory to its own budget though, so give the processes that write at the same time a
+directory each, or let one of them `trim` a shared one once they are done.
+"""
+import collections
+from concurrent import futures
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Hashable
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+import numpy as np
+
+from image_manipulation.image_pb2 import NLImage
+
+
+LOG = logging.getLogger(__name__)
+
+# Extension of the files of spilled responses.
+CACHE_FILE_EXTENSION = ".nlimage"
+
+
+def _new_hash():
+    """A new hash object of the fastest available hash."""
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    if blake3 is not None:
+        return blake3.blake3()
+    return hashlib.blake2b(digest_size=16)
+
+
+def make_data_cache_key(data, *parameters) -> str:
+    """The key of the result of doing what `parameters` describe to `data`.
+
+    Args:
+        data: The bytes, or any contiguous buffer, the result is computed from.
+        parameters: Everything else the result depends on, with a stable repr.
+
+    Returns:
+        The key, as a hex string.
+
+    """
+    content_hash = _new_hash()
+    content_hash.update(repr(parameters).encode("utf-8"))
+    content_hash.update(data)
+    return content_hash.hexdigest()
+
+
+def make_cache_key(image_pb: NLImage, mean_filters: int, rotation: int) -> str:
+    """The key of the result of running mean filters then a rotation on `image_pb`.
+
+    Args:
+        image_pb: The image of the request.
+        mean_filters: The number of mean filters.
+        rotation: The anticlockwise rotation in degrees, after the mean filters.
+
+    Returns:
+        The key, as a hex string.
+
+    """
+    return make_data_cache_key(
+        image_pb.data,
+        image_pb.width,
+        image_pb.height,
+        bool(image_pb.color),
+        image_pb.encoding,
+        image_pb.response_encoding,
+        mean_filters,
+        rotation % 360,
+    )
+
+
+def make_image_cache_key(image, mean_filters: int, rotation: int) -> str:
+    """The key `make_cache_key` gives the raw message of the numpy `image`, without making it."""
+    height, width = image.shape[:2]
+    return make_data_cache_key(
+        np.ascontiguousarray(image),
+        width,
+        height,
+        len(image.shape) > 2,
+        NLImage.RAW,
+        NLImage.RAW,
+        mean_filters,
+        rotation % 360,
+    )
+
+
+class SingleFlight:
+    """Run a function once for all the concurrent callers with the same key.
+
+    The callers that come while the function runs for their key wait for it and get its result,
+    or its exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def run(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """The result of `function`, run by the first of the concurrent callers of `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = futures.Future()
+                self._calls[key] = call
+        if not leader:
+            return call.result()
+        try:
+            result = function()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class ResultCache:
+    """A byte-bounded LRU cache of serialised responses, optionally spilling to a directory.
+
+    It is thread-safe.
+
+    Args:
+        max_bytes: The budget of the responses kept in memory.
+        directory: Optional directory to write the responses evicted from memory to.
+        max_directory_bytes: The budget of all the responses in `directory`, which is trimmed
+            to it straight away, and by `trim`.
+    """
+
+    def __init__(self, max_bytes: int, directory: str or None = None, max_directory_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_directory_bytes = max_directory_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._files = collections.OrderedDict()
+        self._directory_bytes = 0
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0}
+        self._single_flight = SingleFlight()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.trim()
+
+    def trim(self) -> None:
+        """Trim the directory to its budget, counting the files other processes or runs left there.
+
+        The files are ranked by their modification time, the oldest going first.
+        """
+        if self.directory is None:
+            return
+        with self._lock:
+            self._index_directory()
+
+    def _index_directory(self) -> None:
+        """Pick up the files of the directory and trim it. Call it holding the lock."""
+        files = []
+        for filename in os.listdir(self.directory):
+            key, extension = os.path.splitext(filename)
+            if extension != CACHE_FILE_EXTENSION:
+                continue
+            try:
+                status = os.stat(os.path.join(self.directory, filename))
+            except OSError:
+                # Another process sharing the directory deleted it since.
+                continue
+            files.append((status.st_mtime, key, status.st_size))
+        self._files.clear()
+        self._directory_bytes = 0
+        for _, key, size in sorted(files):
+            self._files[key] = size
+            self._directory_bytes += size
+        self._trim_directory()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_FILE_EXTENSION)
+
+    def get(self, key: str) -> bytes or None:
+        """The response cached for `key`, None if there is none."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return value
+        value = self._read_file(key)
+        with self._lock:
+            if value is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+        # Hits are likely to come again, keep it in memory.
+        self.put(key, value)
+        return value
+
+    def _read_file(self, key: str) -> bytes or None:
+        """Read a spilled response, also one another process spilled."""
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as cache_file:
+                value = cache_file.read()
+        except OSError:
+            return None
+        with self._lock:
+            if key not in self._files:
+                self._files[key] = len(value)
+                self._directory_bytes += len(value)
+            self._files.move_to_end(key)
+        return value
+
+    def get_or_run(self, key: str, run: Callable[[], bytes]) -> bytes:
+        """The response cached for `key`, or the one `run` returns, which is cached.
+
+        Concurrent calls for the same key run it once, the others wait for its response.
+        Nothing is cached if `run` raises.
+        """
+        def _get_or_run() -> bytes:
+            value = self.get(key)
+            if value is None:
+                value = run()
+                self.put(key, value)
+            return value
+
+        return self._single_flight.run(key, _get_or_run)
+
+    def put(self, key: str, value: bytes) -> None:
+        """Cache the response `value` for `key`, evicting the least recently used ones if needed.
+
+        A response larger than the memory budget goes to the directory straight away.
+        """
+        if len(value) > self.max_bytes:
+            self._write_file(key, value)
+            return
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = value
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                evicted_key, evicted_value = self._entries.popitem(last=False)
+                self._bytes -= len(evicted_value)
+                self.counters["evictions"] += 1
+                evicted.append((evicted_key, evicted_value))
+        for evicted_key, evicted_value in evicted:
+            self._write_file(evicted_key, evicted_value)
+
+    def _write_file(self, key: str, value: bytes) -> None:
+        """Spill an evicted response to the directory, if there is one and it fits."""
+        if self.directory is None or len(value) > self.max_directory_bytes:
+            return
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+                return
+        try:
+            # Written aside and moved in, so no reader ever sees half a file.
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(file_descriptor, "wb") as cache_file:
+                cache_file.write(value)
+            os.replace(temporary_path, self._path(key))
+        except OSError as e:
+            LOG.error(f"Couldn't spill a cached response to {self.directory}: {format(e)}")
+            return
+        with self._lock:
+            self._files[key] = len(value)
+            self._directory_bytes += len(value)
+            self._trim_directory()
+
+    def _trim_directory(self) -> None:
+        """Delete the least recently used files over the budget. Call it holding the lock."""
+        while self._directory_bytes > self.max_directory_bytes and self._files:
+            key, size = self._files.popitem(last=False)
+            self._directory_bytes -= size
+            self.counters["disk_evictions"] += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                # Another process sharing the directory deleted it already.
+                pass
+
+    def stats(self) -> dict:
+        """The counters, and the number and size of the responses in memory and on disk."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(
+                entries=len(self._entries),
+                bytes=self._bytes,
+                files=len(self._files),
+                directory_bytes=self._directory_bytes,
+            )
+        return stats
@@ -1,20 +1,34 @@
 import os
 import logging
 import time
-import multiprocessing
 
 import cv2
 from fire import Fire
-import grpc
-import numpy as np
 
 from image_manipulation import image_pb2_grpc, image_pb2
+from image_manipulation.balancing import BALANCING_POLICIES, parse_endpoints, read_endpoints_file
+from image_manipulation.cache import ResultCache
 from image_manipulation.image_utils import (
     convert_proto_to_image, 
     convert_image_to_proto,
+    get_encoding_from_path,
     NLGRPCException
 )
-from image_manipulation.communication_utils import run_one_request_on_channel
+from image_manipulation.communication_utils import (
+    create_channel,
+    run_one_request_on_channel,
+    run_one_proto_request_on_channel,
+)
+from image_manipulation.compression import COMPRESSION_POLICIES
+from image_manipulation.image_client import ImageClient
+from image_manipulation.load_engine import get_output_path, list_image_files, run_load
+from image_manipulation.benchmark import (
+    format_summary,
+    load_scenarios,
+    make_scenario,
+    run_benchmark,
+    write_report,
+)
 
 
 LOG = logging.getLogger(__name__)
@@ -22,19 +36,20 @@ LOG = logging.getLogger(__name__)
 
 ALLOWED_ROTATIONS = ["none", "ninety_deg", "one_eighty_deg", "two_seventy_deg"]
 SUPPORTED_IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg"]
+MEGABYTE = 1024 * 1024
 
 
 def check_and_print_if_valid_inputs(
     output: str,
     input: str, 
     mean: bool, 
-    rotate: float, 
+    rotate: str, 
 ):
     """Check if the inputs provided by the user are supported
 
     Args:
         mean: Set to true if a mean filter needs to be applied on the input image.
-        rotate: Anticlockwise rotation in degrees to rotate the image.
+        rotate: The text form of the rotation enum, e.g. NINETY_DEG.
         input: Path to the input image
         output: Path to the output image.
     
@@ -42,14 +57,14 @@ def check_and_print_if_valid_inputs(
         valid: True if all the inputs are valid.
 
     """
-    if not mean and np.isclose(rotate, 0.0):
-        print("No action input provided, either send mean as True or a rotation that is valid.")
-        return False
-
     rotate = rotate.lower()
     if rotate not in ALLOWED_ROTATIONS:
         print(f"Rotation request must be in {ALLOWED_ROTATIONS}")
         return False
+
+    if not mean and rotate == "none":
+        print("No action input provided, either send mean as True or a rotation that is valid.")
+        return False
     
     if not os.path.exists(input):
         print(f"{input} doesn't exist. Please provide a valid image path.")
@@ -71,6 +86,106 @@ def check_and_print_if_valid_inputs(
     return True
 
 
+def run_encoded_request(
+    mean: bool,
+    rotate: int,
+    channel,
+    input_path: str,
+    output_path: str,
+    compression: str or None = None,
+    cache: ResultCache or None = None,
+) -> None:
+    """Send an image file as is and write the server's response straight to `output_path`.
+
+    Nothing is decoded on the client, the server decodes the input and encodes the output in the
+    format of the output file's extension.
+
+    Args:
+        mean: Set to true if a mean filter needs to be applied on the input image.
+        rotate: Anticlockwise rotation in degrees to rotate the image.
+        channel: the channel on which the the server is listening to.
+        input_path: Path to the input image.
+        output_path: Path to the output image.
+        compression: Optional compression policy of the requests, overriding the channel's.
+        cache: Optional cache of the responses.
+
+    """
+    with open(input_path, "rb") as input_file:
+        image_pb = image_pb2.NLImage(
+            data=input_file.read(),
+            encoding=get_encoding_from_path(input_path),
+            response_encoding=get_encoding_from_path(output_path),
+        )
+    response = run_one_proto_request_on_channel(
+        mean=mean,
+        rotate=rotate,
+        channel=channel,
+        image_pb=image_pb,
+        compression=compression,
+        cache=cache,
+    )
+    with open(output_path, "wb") as output_file:
+        output_file.write(response.data)
+
+
+def run_balanced_load(
+    input_directory: str,
+    output_directory: str,
+    targets: list,
+    mean: bool,
+    rotate: int,
+    channels_per_target: int = 4,
+    max_in_flight: int = 64,
+    encoded: bool = False,
+    compression: str = "gzip",
+    policy: str = "power_of_two",
+) -> dict:
+    """Process every image of `input_directory` on several servers and write the results.
+
+    The calls are balanced over the servers, leaving out the failing, slow and unhealthy ones.
+
+    Args:
+        input_directory: The folder of images.
+        output_directory: The folder to write the results to, as manipulated_<name of the input>.
+        targets: The host and port of each server.
+        mean: Set to true if a mean filter needs to be applied on the images.
+        rotate: Anticlockwise rotation in degrees to rotate the images.
+        channels_per_target: The channels opened to each server.
+        max_in_flight: The most images sent without a response yet, to all the servers.
+        encoded: Set to true to send the image files as they are and get the same format back.
+        compression: The compression policy of the requests.
+        policy: How the server of each image is picked, see `balancing.BALANCING_POLICIES`.
+
+    Returns:
+        The number of images "written" and "failed".
+
+    """
+    input_paths = [
+        os.path.join(input_directory, filename)
+        for filename in list_image_files(input_directory, SUPPORTED_IMAGE_EXTENSIONS)
+    ]
+    output_paths = [get_output_path(output_directory, input_path) for input_path in input_paths]
+    counts = {"written": 0, "failed": 0}
+    with ImageClient(
+        targets,
+        max_in_flight=max_in_flight,
+        compression=compression,
+        channels_per_target=channels_per_target,
+        policy=policy,
+    ) as client:
+        for input_path, error in client.process_files(
+            input_paths, output_paths, mean=mean, rotate=rotate, encoded=encoded
+        ):
+            if error is None:
+                counts["written"] += 1
+            else:
+                LOG.error(f"Couldn't process {input_path}: {format(error)}")
+                counts["failed"] += 1
+        for stats in client.balancer.stats():
+            LOG.info(f"Server {stats['target']}: {stats}")
+    return counts
+
+
 def run_client(
     mean:bool = False, 
     rotate: str = "NINETY_DEG", 
@@ -80,6 +195,18 @@ def run_client(
     input: str = "/home/saurabh/image.jpg", 
     output: str = "/home/saurabh/WabaLabaDubDub.jpeg",
     timeit: bool = False,
+    compression: str = "gzip",
+    encoded: bool = False,
+    window: int = 16,
+    workers: int = 4,
+    benchmark: str or bool = False,
+    report: str or None = None,
+    label: str = "",
+    cache_directory: str or None = None,
+    cache_directory_megabytes: int = 1024,
+    endpoints: str or list or None = None,
+    endpoints_file: str or None = None,
+    balancing_policy: str = "power_of_two",
 ) -> None:
     """
     Args:
@@ -90,15 +217,52 @@ def run_client(
         input: The directory of the input image.
         output: The directory of the output image.
         timeit: Set to true if the response time over a folder `input` of images need to be saved.
+        compression: How requests are compressed: none, gzip, deflate or auto (decided per image).
+            Compression rarely pays off on loopback or a fast LAN.
+        encoded: Set to true to send the image files as they are on disk and have the server
+            return the output in the format of the output extension, instead of raw pixels.
+        window: With timeit, the maximum number of images each worker sends to the server without
+            a response yet.
+        workers: With timeit, the number of client processes, each with its own channel.
+        benchmark: Path to a json file of benchmark scenarios to run against the server, or true
+            to run the default scenario. See `benchmark.DEFAULT_SCENARIO` for the options.
+        report: With benchmark, a .json file to write the results to, or a .csv file to append them to.
+        label: With benchmark, a name for the server configuration under test, e.g. "4x8 gzip".
+        cache_directory: Optional directory to keep the responses in, so that running again over
+            images that didn't change doesn't send them. With timeit, the images that are the
+            same as others of the folder are also sent once.
+        cache_directory_megabytes: The size the cache directory is trimmed to.
+        endpoints: With timeit, the servers to balance the images over instead of host and port,
+            as a comma-separated list of host:port. It doesn't go with cache_directory.
+        endpoints_file: With timeit, a file listing the servers to balance the images over, one
+            host:port per line.
+        balancing_policy: How the server of each image is picked, in `balancing.BALANCING_POLICIES`.
 
     """
+    compression = str(compression).lower()
+    if compression not in COMPRESSION_POLICIES:
+        print(f"Compression must be in {COMPRESSION_POLICIES}")
+        return
+    if balancing_policy not in BALANCING_POLICIES:
+        print(f"The balancing policy must be in {BALANCING_POLICIES}")
+        return
+    if timeit and cache_directory and (endpoints or endpoints_file):
+        print("The cache directory can't be used with endpoints yet, only with a single server")
+        return
+
+    if benchmark:
+        scenarios = [make_scenario()] if benchmark is True else load_scenarios(benchmark)
+        summaries = []
+        for scenario in scenarios:
+            summary = run_benchmark(
+                target=f"{host}:{port}", scenario=scenario, compression=compression, label=label
+            )
+            print(format_summary(summary))
+            summaries.append(summary)
+        if report:
+            write_report(summaries, report)
+        return
 
-    # We want an option to run both. Hence we'll do it sequentially if the user requests for it. 
-    channel = grpc.insecure_channel(f"{host}:{port}", compression=grpc.Compression.Gzip, options=[
-            ('grpc.max_send_message_length', 1024 * 1024 * 50),
-            ('grpc.max_receive_message_length', 1024 * 1024 * 50),
-        ]
-    )
     if not timeit: # The original mode of the client as per the assignment.
         if not check_and_print_if_valid_inputs(
             mean=mean,
@@ -107,6 +271,30 @@ def run_client(
             output=output,
         ):
             return
+        # Convert the rotation command passed to lower as it is easier for us to assess.
+        rotate = rotate.lower()
+
+        # We want an option to run both. Hence we'll do it sequentially if the user requests for it. 
+        channel = create_channel(f"{host}:{port}", compression=compression)
+        cache = None
+        if cache_directory:
+            # A single response, nothing to keep in memory.
+            cache = ResultCache(
+                max_bytes=0,
+                directory=cache_directory,
+                max_directory_bytes=cache_directory_megabytes * MEGABYTE,
+            )
+        if encoded:
+            run_encoded_request(
+                mean=mean,
+                rotate=ALLOWED_ROTATIONS.index(rotate) * 90,
+                channel=channel,
+                input_path=input,
+                output_path=output,
+                compression=compression,
+                cache=cache,
+            )
+            return
         try:
             input_image = cv2.imread(input)
         except:
@@ -115,58 +303,55 @@ def run_client(
         if input_image is None:
             LOG.error(f"Something went wrong while reading the input image: {input}")
             return
-        
-        # Convert the rotation command passed to lower as it is easier for us to assess.
-        rotate = rotate.lower()
 
         output_image = run_one_request_on_channel(
             mean=mean, 
-            rotate=rotate * 90, 
+            rotate=ALLOWED_ROTATIONS.index(rotate) * 90, 
             channel=channel,
             input_image=input_image,
+            compression=compression,
+            cache=cache,
         ) 
         # Hooray, we now write the image to the user's preferred location.  
         cv2.imwrite(img=output_image, filename=output) 
     else:
-        # Run the scaling testing mode with multiple client requests to send to the server.
+        # Run the scaling testing mode from a pool of client processes, each streaming to the server.
         rotate = rotate.lower()
-
-        def _image_manipulation_thread(image_extension_option, filename):
-            if filename.endswith(image_extension_option):
-                image_file_path = os.path.join(input, filename)
-                try:
-                    input_image = cv2.imread(image_file_path)
-                except:
-                    LOG.error(f"something went wrong while reading the input image: {image_file_path}")
-                    return
-                if input_image is None:
-                    LOG.error(f"something went wrong while reading the input image: {image_file_path}")
-                    return
-
-                output_image = run_one_request_on_channel(
-                    mean=mean, 
-                    rotate=ALLOWED_ROTATIONS.index(rotate) * 90, 
-                    channel=channel,
-                    input_image=input_image,
-                )
-    
-                # Hooray, we now write the image to the user's preferred location.
-                output_image_file_path = os.path.join(output, f"manipulated_{filename}")
-                cv2.imwrite(img=output_image, filename=output_image_file_path)
-
-        workers = []
         start_time = time.time()
-        for filename in os.listdir(input):
-            for image_extension_option in SUPPORTED_IMAGE_EXTENSIONS:
-                worker = multiprocessing.Process(
-                    target=_image_manipulation_thread, args=(image_extension_option, filename)
+        if endpoints or endpoints_file:
+            # Balanced over the servers from this process, with a channel per worker to each.
+            counts = run_balanced_load(
+                input_directory=input,
+                output_directory=output,
+                targets=read_endpoints_file(endpoints_file) if endpoints_file else parse_endpoints(endpoints),
+                mean=mean,
+                rotate=ALLOWED_ROTATIONS.index(rotate) * 90,
+                channels_per_target=workers,
+                max_in_flight=workers * window,
+                encoded=encoded,
+                compression=compression,
+                policy=balancing_policy,
+            )
+        else:
+            try:
+                counts = run_load(
+                    input_directory=input,
+                    output_directory=output,
+                    target=f"{host}:{port}",
+                    mean=mean,
+                    rotate=ALLOWED_ROTATIONS.index(rotate) * 90,
+                    extensions=SUPPORTED_IMAGE_EXTENSIONS,
+                    workers=workers,
+                    window=window,
+                    encoded=encoded,
+                    compression=compression,
+                    cache_directory=cache_directory,
+                    cache_directory_megabytes=cache_directory_megabytes,
                 )
-                worker.start()
-                workers.append(worker)
-
-        for worker in workers:
-            worker.join()
-
+            except TimeoutError as e:
+                print(format(e))
+                return
+        print(f"Processed {counts['written']} images, {counts['failed']} failed.")
         print(f"Response time: {time.time() - start_time}")
 
 
@@ -1,4 +1,6 @@
 """All the server and client API is written here."""
+import asyncio
+import collections
 import sys
 import time
 import contextlib
@@ -7,7 +9,21 @@ from concurrent import futures
 import socket
 import logging
 import multiprocessing
+import multiprocessing.connection
+import multiprocessing.synchronize
+import os
+import queue
+import signal
+import threading
+import weakref
+from typing import AsyncIterator, Callable, Iterable, Iterator, Tuple
 import grpc
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python 3.7 only has the threaded server.
+    shared_memory = None
 
 import numpy as np
 import cv2
@@ -15,13 +31,40 @@ import cv2
 from image_manipulation.image_pb2 import (
     NLImageRotateRequest, 
     NLImage, 
+    NLImageOperation,
+    NLImagePipelineRequest,
+    NLImageStreamRequest,
+    NLImageStreamResponse,
+    NLImageStrip,
+    NLMeanFilterOperation,
 )
 from image_manipulation.image_pb2_grpc import add_NLImageServiceServicer_to_server, NLImageServiceServicer, NLImageServiceStub
+from image_manipulation.batching import MicroBatcher
+from image_manipulation.cache import ResultCache, make_cache_key, make_image_cache_key
+from image_manipulation.metrics import (
+    ERRORS,
+    QUEUE_DEPTH,
+    STAGE_SECONDS,
+    AsyncMetricsInterceptor,
+    MetricsInterceptor,
+    collect_from,
+    get_executor_queue_depth,
+    start_metrics_server,
+)
+from image_manipulation.profiling import PROFILE_SIGNAL, install_profile_signal_handler
+from image_manipulation.compression import (
+    check_compression_policy,
+    choose_message_compression,
+    get_default_compression,
+)
 from image_manipulation.image_utils import (
     get_mean_image, 
+    get_mean_image_batch,
     convert_proto_to_image, 
     convert_image_to_proto, 
     get_rotated_image, 
+    warm_up_kernels,
+    StripMeanFilter,
     NullImageProto, 
     NLGRPCException
 )
@@ -29,11 +72,187 @@ from image_manipulation.image_utils import (
 
 LOG = logging.getLogger(__name__)
 
+# The largest message the client and server send or accept.
+MAX_MESSAGE_LENGTH = 1024 * 1024 * 50
+# Images larger than this are sent in strips of about this size when only mean filters are asked for.
+STRIP_BYTES = 1024 * 1024 * 4
+# The shared memory each asyncio server passes the frames to its compute processes through. It
+# holds the input and output of the jobs in flight, i.e. of at least two of the largest messages.
+SHARED_MEMORY_BYTES = 4 * MAX_MESSAGE_LENGTH
+# Seconds between the pings the clients send on idle connections, to keep them open through NATs
+# and load balancers and find the dead ones before a call does.
+KEEPALIVE_SECONDS = 30.0
+# Seconds a ping waits for its answer before the connection is taken as dead.
+KEEPALIVE_TIMEOUT_SECONDS = 10.0
+SERVER_OPTIONS = (
+    ('grpc.max_send_message_length', MAX_MESSAGE_LENGTH),
+    ('grpc.max_receive_message_length', MAX_MESSAGE_LENGTH),
+    # Let the clients ping idle connections every KEEPALIVE_SECONDS, rather than sending them
+    # away for pinging more often than the default of every 5 minutes.
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.min_ping_interval_without_data_ms', int(1000 * KEEPALIVE_SECONDS / 2)),
+)
+# The services the health service of the servers reports on: the server as a whole and the image service.
+HEALTH_SERVICE_NAMES = ("", "NLImageService")
+# Seconds the calls in flight get to complete when a server is stopped.
+SHUTDOWN_GRACE_SECONDS = 5.0
+# Seconds a stopping server keeps serving once it reports NOT_SERVING, so that the clients and load
+# balancers see it and go elsewhere before the listener closes. Over the 5 seconds between the
+# health checks of an `ImageClient`.
+SHUTDOWN_DRAIN_SECONDS = 6.0
+# Seconds a new server process gets to start serving in a rolling restart.
+WORKER_START_TIMEOUT_SECONDS = 120.0
+# A server process exiting sooner after it started is respawned after a delay, doubling up to
+# MAXIMUM_RESPAWN_DELAY_SECONDS while it keeps doing so, rather than respawned in a tight loop.
+MINIMUM_WORKER_UPTIME_SECONDS = 10.0
+MAXIMUM_RESPAWN_DELAY_SECONDS = 30.0
+# Seconds between two checks of the supervisor for exited server processes.
+_SUPERVISOR_POLL_SECONDS = 0.5
+
+
+def _count_pipeline_operations(operations: Iterable[NLImageOperation]) -> Tuple[int, int]:
+    """The number of mean filters of a pipeline and its total rotation in degrees.
+
+    The mean filter commutes with rotations by multiples of 90 degrees, so a pipeline is run as
+    all its mean filters on the image as it was sent, followed by all its rotations as one.
+
+    Raises:
+        ValueError: If an operation is unknown.
+    """
+    mean_filters = 0
+    rotation = 0
+    for operation in operations:
+        operation_type = operation.WhichOneof("operation")
+        if operation_type == "mean_filter":
+            mean_filters += 1
+        elif operation_type == "rotation":
+            rotation += operation.rotation * 90
+        else:
+            raise ValueError(f"Unknown operation in the pipeline: {operation_type}")
+    return mean_filters, rotation % 360
+
+
+def _run_pipeline_request(request: NLImagePipelineRequest) -> NLImage:
+    """Run the operations of a pipeline request and serialise the result.
+
+    The rotations are applied at the end as one view, nothing in between is copied or serialised.
+
+    Raises:
+        ValueError: If the image or an operation is invalid.
+    """
+    mean_filters, rotation = _count_pipeline_operations(request.operations)
+    with STAGE_SECONDS.time(stage="decode"):
+        image = convert_proto_to_image(request.image)
+    with STAGE_SECONDS.time(stage="compute"):
+        for _ in range(mean_filters):
+            image = get_mean_image(image)
+        image = get_rotated_image(input_image=image, rotation_request=rotation)
+    LOG.debug(f"Completed a pipeline of {len(request.operations)} operations")
+    with STAGE_SECONDS.time(stage="encode"):
+        return convert_image_to_proto(image, encoding=request.image.response_encoding)
+
 
 class ImageService(NLImageServiceServicer):
     """An implementation of a GRPC request to either get the mean or rotation of an image. 
+
+    The image of a request is decoded as a read-only view of the request bytes. Each op reads it
+    and writes to at most one new output array (rotations are views and allocate nothing), which
+    is copied once more into the response message.
+
+    Args:
+        compression: The compression policy of the responses, see `compression.COMPRESSION_POLICIES`.
+        stream_workers: Number of threads processing the requests of the streaming calls.
+            Each stream reads at most twice as many requests ahead.
+        batch_window: Seconds a MeanFilter call waits for concurrent calls with an image of the
+            same shape, to filter them all in one kernel call. 0 filters every image on its own.
+        max_batch_size: Maximum number of images filtered together.
+        cache: Optional cache of the responses, in front of every call but ProcessStrips.
     """
 
+    def __init__(
+        self,
+        compression: str = "gzip",
+        stream_workers: int = 4,
+        batch_window: float = 0.0,
+        max_batch_size: int = 32,
+        cache: ResultCache or None = None,
+    ):
+        self.compression = check_compression_policy(compression)
+        self._cache = cache
+        self.stream_window = 2 * stream_workers
+        self._stream_executor = futures.ThreadPoolExecutor(max_workers=stream_workers)
+        self._mean_batcher = None
+        if batch_window > 0:
+            self._mean_batcher = MicroBatcher(
+                self._run_mean_batch, window=batch_window, max_batch_size=max_batch_size
+            )
+
+    def _set_response_compression(self, context, response: NLImage) -> None:
+        """Pick the compression of `response` when it is decided per message."""
+        if self.compression == "auto":
+            context.set_compression(
+                choose_message_compression(response.data, self.compression)
+            )
+
+    def _run_cached(
+        self, image_pb: NLImage, mean_filters: int, rotation: int, run: Callable[[], NLImage]
+    ) -> NLImage:
+        """The cached response to mean filters and a rotation of `image_pb`, or the one `run` returns.
+
+        Only the responses `run` returns are cached, not its errors.
+        """
+        if self._cache is None:
+            return run()
+        key = make_cache_key(image_pb, mean_filters, rotation)
+        cached_response = self._cache.get(key)
+        if cached_response is not None:
+            LOG.debug(f"Answered from the cache")
+            return NLImage.FromString(cached_response)
+        response = run()
+        self._cache.put(key, response.SerializeToString())
+        return response
+
+    def _run_pipeline(self, request: NLImagePipelineRequest) -> NLImage:
+        """Run a pipeline request, or answer it from the cache."""
+        mean_filters, rotation = _count_pipeline_operations(request.operations)
+        return self._run_cached(
+            request.image, mean_filters, rotation, lambda: _run_pipeline_request(request)
+        )
+
+    def _run_mean_filter(self, request: NLImage) -> NLImage:
+        """Run the mean filter of a MeanFilter call and serialise the result."""
+        with STAGE_SECONDS.time(stage="decode"):
+            user_image_pb = convert_proto_to_image(request)
+        # With batching, this includes the wait for the other images of the batch.
+        with STAGE_SECONDS.time(stage="compute"):
+            if self._mean_batcher is None:
+                mean_image_matrix = get_mean_image(user_image_pb)
+            else:
+                mean_image_matrix = self._mean_batcher.run(user_image_pb.shape, user_image_pb)
+        LOG.debug(f"Completed an image mean")
+        with STAGE_SECONDS.time(stage="encode"):
+            return convert_image_to_proto(mean_image_matrix, encoding=request.response_encoding)
+
+    def _run_rotation(self, request: NLImageRotateRequest) -> NLImage:
+        """Run the rotation of a RotateImage call and serialise the result."""
+        with STAGE_SECONDS.time(stage="decode"):
+            user_image_pb = convert_proto_to_image(request.image)
+        with STAGE_SECONDS.time(stage="compute"):
+            rotated_image_matrix = get_rotated_image(
+                input_image=user_image_pb, 
+                rotation_request=request.rotation * 90
+            )
+        LOG.debug(f"Completed an image rotation")
+        with STAGE_SECONDS.time(stage="encode"):
+            return convert_image_to_proto(rotated_image_matrix, encoding=request.image.response_encoding)
+
+    def _run_mean_batch(self, shape: tuple, images: list) -> list:
+        """Filter a batch of images of the same `shape` with a single kernel call."""
+        if len(images) == 1:
+            return [get_mean_image(images[0])]
+        LOG.debug(f"Filtering a batch of {len(images)} images of {shape}")
+        return list(get_mean_image_batch(np.stack(images)))
+
     def MeanFilter(self, request: NLImage, context) -> NLImage:
         """Run the mean filter on the protobuf `request`.
 
@@ -45,13 +264,13 @@ class ImageService(NLImageServiceServicer):
 
         """
         try:
-            user_image_pb = convert_proto_to_image(request)
-            mean_image_matrix = get_mean_image(user_image_pb)
-            LOG.debug(f"Completed an image mean")
-            return convert_image_to_proto(mean_image_matrix)
+            response = self._run_cached(request, 1, 0, lambda: self._run_mean_filter(request))
+            self._set_response_compression(context, response)
+            return response
         except:
             e = sys.exc_info()[0]
             LOG.debug(f"Faced an exception during convolution.")
+            ERRORS.inc(method="MeanFilter", type=e.__name__)
             # Handling all types of exception as we don't have an exact control over the input.
             return NullImageProto(
                 msg=bytes(
@@ -70,24 +289,762 @@ class ImageService(NLImageServiceServicer):
 
         """
         try:
-            user_image_pb = convert_proto_to_image(request.image)
-            rotated_image_matrix = get_rotated_image(
-                input_image=user_image_pb, 
-                rotation_request=request.rotation * 90
+            response = self._run_cached(
+                request.image, 0, request.rotation * 90, lambda: self._run_rotation(request)
+            )
+            self._set_response_compression(context, response)
+            return response
+        except Exception as e:
+            # Handling all types of exception as we don't have an exact control over the input.
+            LOG.debug(f"Faced an exception while rotation.")
+            ERRORS.inc(method="RotateImage", type=type(e).__name__)
+            return NullImageProto(msg=format(e))
+
+    def Process(self, request: NLImagePipelineRequest, context) -> NLImage:
+        """Run the operations of the protobuf `request` in order, on the server.
+
+        Args:
+            request: The request containing the image and the operations to run on it.
+
+        Returns:
+            The protobuf containing the processed image.
+
+        """
+        try:
+            response = self._run_pipeline(request)
+            self._set_response_compression(context, response)
+            return response
+        except Exception as e:
+            # Handling all types of exception as we don't have an exact control over the input.
+            LOG.debug(f"Faced an exception while running a pipeline.")
+            ERRORS.inc(method="Process", type=type(e).__name__)
+            return NullImageProto(msg=format(e))
+
+    def StreamProcess(
+        self, request_iterator: Iterator[NLImageStreamRequest], context
+    ) -> Iterator[NLImageStreamResponse]:
+        """Run a stream of pipelines, yielding each result as soon as it is done.
+
+        A reader thread hands the requests to the stream workers, at most `stream_window` at a
+        time, so a fast client is held back by gRPC flow control rather than piling up images here.
+
+        Args:
+            request_iterator: The requests of the stream, each with an id chosen by the client.
+
+        Yields:
+            The response to each request, in the order they complete.
+
+        """
+        results = queue.Queue()
+        window = threading.BoundedSemaphore(self.stream_window)
+
+        def _process(stream_request: NLImageStreamRequest) -> None:
+            if not context.is_active():
+                # Past its deadline or cancelled while the request waited, nobody reads the result.
+                ERRORS.inc(method="StreamProcess", type="Inactive")
+                results.put(NLImageStreamResponse(request_id=stream_request.request_id))
+                return
+            try:
+                image = self._run_pipeline(stream_request.request)
+            except Exception as e:
+                LOG.debug(f"Faced an exception while running a pipeline of a stream.")
+                ERRORS.inc(method="StreamProcess", type=type(e).__name__)
+                image = NullImageProto(msg=format(e))
+            results.put(NLImageStreamResponse(request_id=stream_request.request_id, image=image))
+
+        def _read_requests() -> None:
+            number_of_requests = 0
+            try:
+                for stream_request in request_iterator:
+                    while not window.acquire(timeout=1.0):
+                        if not context.is_active():
+                            return
+                    self._stream_executor.submit(_process, stream_request)
+                    number_of_requests += 1
+            except Exception:
+                # The stream was cancelled or broken by the client, there is nobody left to answer.
+                LOG.debug(f"Stopped reading a stream after {number_of_requests} requests.")
+            finally:
+                results.put(number_of_requests)
+
+        threading.Thread(target=_read_requests, daemon=True).start()
+        if self.compression == "auto":
+            # Compress by default, and skip the responses that aren't worth it.
+            context.set_compression(grpc.Compression.Gzip)
+        number_of_requests = None
+        number_of_responses = 0
+        while number_of_requests is None or number_of_responses < number_of_requests:
+            result = results.get()
+            if isinstance(result, int):
+                number_of_requests = result
+                continue
+            window.release()
+            number_of_responses += 1
+            if self.compression == "auto" and choose_message_compression(
+                result.image.data, self.compression
+            ) == grpc.Compression.NoCompression:
+                context.disable_next_message_compression()
+            yield result
+        LOG.debug(f"Completed a stream of {number_of_responses} pipelines")
+
+    def ProcessStrips(self, request_iterator: Iterator[NLImageStrip], context) -> Iterator[NLImageStrip]:
+        """Run the mean filters of a strip stream, streaming the output strips as they are final.
+
+        Only the strip being filtered and a halo of rows around it are held in memory.
+
+        Args:
+            request_iterator: The strips of the image, from the top.
+
+        Yields:
+            The strips of the output image.
+
+        """
+        try:
+            strip_filters = None
+            rows_received = 0
+            for strip in request_iterator:
+                if strip_filters is None:
+                    for operation in strip.operations:
+                        if operation.WhichOneof("operation") != "mean_filter":
+                            raise ValueError("Only mean filters can run on an image sent in strips")
+                    strip_filters = [StripMeanFilter() for _ in strip.operations]
+                    row_shape = [strip.width, 3] if strip.color else [strip.width]
+                    if strip.width <= 0 or strip.height <= 0:
+                        raise ValueError(f"Invalid image size {strip.width}x{strip.height}")
+
+                rows = np.frombuffer(strip.data, dtype=np.uint8).reshape([-1] + row_shape)
+                rows_received += len(rows)
+                if rows_received > strip.height:
+                    raise ValueError(f"Received more than the {strip.height} rows of the image")
+                for strip_filter in strip_filters:
+                    rows = strip_filter.push(rows, last=rows_received == strip.height)
+                if len(rows):
+                    yield NLImageStrip(
+                        color=strip.color, data=rows.tobytes(), width=strip.width, height=strip.height
+                    )
+
+            if strip_filters is not None and rows_received != strip.height:
+                raise ValueError(f"Received {rows_received} of the {strip.height} rows of the image")
+            LOG.debug(f"Completed an image in strips")
+        except Exception as e:
+            # Handling all types of exception as we don't have an exact control over the input.
+            LOG.debug(f"Faced an exception while filtering strips.")
+            ERRORS.inc(method="ProcessStrips", type=type(e).__name__)
+            yield NLImageStrip(width=0, height=0, data=bytes(format(e), "utf-8"))
+
+
+class _SharedMemoryRing:
+    """A shared memory block the frames of an asyncio server pass through, used as a ring buffer.
+
+    Each job takes the range after the one taken before it, wrapping around to the start of the
+    block. The ranges can be released in any order, the space is reused once the ranges taken
+    before are released too. The compute processes attach the block once when they start, so a job
+    only sends them offsets. Only the event loop uses the ring, so it isn't locked.
+
+    Args:
+        nbytes: The size of the block.
+    """
+
+    # Ranges start on a cache line.
+    ALIGNMENT = 64
+
+    def __init__(self, nbytes: int = SHARED_MEMORY_BYTES):
+        self.block = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.size = nbytes
+        # [offset, size, released] of the ranges in use, in the order they were taken.
+        self._ranges = collections.deque()
+        self._head = 0
+        # Created in the event loop on the first wait.
+        self._space_released = None
+
+    @property
+    def name(self) -> str:
+        return self.block.name
+
+    def _find_space(self, nbytes: int) -> int or None:
+        """The offset of a free range of `nbytes` bytes, None if there isn't one yet."""
+        if not self._ranges:
+            return 0
+        tail = self._ranges[0][0]
+        if self._head >= tail:
+            if self._head + nbytes <= self.size:
+                return self._head
+            # Strictly less, so that the head only meets the tail when the ring is empty.
+            return 0 if nbytes < tail else None
+        return self._head if self._head + nbytes < tail else None
+
+    async def take(self, nbytes: int) -> list:
+        """Take a range of at least `nbytes` bytes, waiting for the space to be released.
+
+        Returns:
+            The range, whose first item is its offset. Give it to `release` once it is done with.
+
+        Raises:
+            ValueError: If the range can't fit in the ring.
+        """
+        nbytes = -(-max(nbytes, 1) // self.ALIGNMENT) * self.ALIGNMENT
+        if nbytes > self.size:
+            raise ValueError(f"A frame of {nbytes} bytes doesn't fit in {self.size} bytes of shared memory")
+        offset = self._find_space(nbytes)
+        while offset is None:
+            if self._space_released is None:
+                self._space_released = asyncio.Event()
+            self._space_released.clear()
+            await self._space_released.wait()
+            offset = self._find_space(nbytes)
+        shared_range = [offset, nbytes, False]
+        self._ranges.append(shared_range)
+        self._head = offset + nbytes
+        return shared_range
+
+    def release(self, shared_range: list) -> None:
+        """Give back a range once nothing reads or writes it any more."""
+        shared_range[2] = True
+        while self._ranges and self._ranges[0][2]:
+            self._ranges.popleft()
+        if self._space_released is not None:
+            self._space_released.set()
+
+    def close(self) -> None:
+        """Free the block, once the server is stopped."""
+        self.block.close()
+        self.block.unlink()
+
+
+# The ring of the server, in a compute process.
+_COMPUTE_RING = None
+
+
+def _init_compute_process(ring_name: str, profile_settings: dict or None = None) -> None:
+    """Prepare a compute process, which its server stops rather than a keyboard interrupt."""
+    global _COMPUTE_RING
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if profile_settings is not None:
+        install_profile_signal_handler(**profile_settings)
+    _COMPUTE_RING = shared_memory.SharedMemory(name=ring_name)
+    warm_up_kernels()
+
+
+def _get_pipeline_output_shape(shape: tuple, rotation: int) -> tuple:
+    """The shape of an image of `shape` once rotated by `rotation` degrees."""
+    if rotation in [90, 270]:
+        return (shape[1], shape[0]) + tuple(shape[2:])
+    return tuple(shape)
+
+
+def _run_shared_memory_pipeline(
+    input_offset: int, output_offset: int, shape: tuple, mean_filters: int, rotation: int
+) -> None:
+    """Run a pipeline in a compute process, from and to the ring of the server.
+
+    Only the offsets and the shape of the image are sent to the compute process, the pixels are
+    read from the ring and the result written straight back into it.
+    """
+    image = np.ndarray(shape, dtype=np.uint8, buffer=_COMPUTE_RING.buf, offset=input_offset)
+    output_image = np.ndarray(
+        _get_pipeline_output_shape(shape, rotation),
+        dtype=np.uint8,
+        buffer=_COMPUTE_RING.buf,
+        offset=output_offset,
+    )
+    if mean_filters and rotation == 0:
+        for _ in range(mean_filters - 1):
+            image = get_mean_image(image)
+        get_mean_image(image, out=output_image)
+    else:
+        for _ in range(mean_filters):
+            image = get_mean_image(image)
+        np.copyto(output_image, get_rotated_image(input_image=image, rotation_request=rotation))
+
+
+def _run_serialised_pipeline(request_bytes: bytes) -> bytes:
+    """Run a pipeline request on encoded images in a compute process, which decodes and encodes too."""
+    return _run_pipeline_request(NLImagePipelineRequest.FromString(request_bytes)).SerializeToString()
+
+
+class AsyncImageService(ImageService):
+    """The ImageService for a `grpc.aio` server, which runs the image operations in compute processes.
+
+    The event loop only receives, parses and sends the messages, so it can hold many more calls
+    than there are threads. The pixels of raw images are copied once into the shared memory ring,
+    the compute process writes the result next to them, which is copied once into the response.
+    Encoded images are sent to the compute processes whole since decoding them is work too.
+    ProcessStrips is the threaded implementation, run on the server's migration thread pool.
+
+    The compute processes take the jobs from one queue as they become free, so the load is balanced
+    per request, however the calls are spread over the connections.
+
+    Create it in the event loop of the server.
+
+    Args:
+        compute_executor: The pool of processes running the operations, see `_create_compute_pool`.
+        shared_memory_ring: The ring the compute processes attached.
+        compression: The compression policy of the responses, see `compression.COMPRESSION_POLICIES`.
+        stream_workers: Each stream reads at most twice as many requests ahead.
+        max_pending_jobs: Maximum number of requests in or waiting for the compute processes, over
+            all calls.
+        cache: Optional cache of the responses, in front of every call but ProcessStrips. With a
+            single front end it is shared by all the compute processes.
+    """
+
+    def __init__(
+        self,
+        compute_executor: futures.Executor,
+        shared_memory_ring: _SharedMemoryRing,
+        compression: str = "gzip",
+        stream_workers: int = 4,
+        max_pending_jobs: int = 16,
+        cache: ResultCache or None = None,
+    ):
+        super().__init__(compression=compression, stream_workers=stream_workers, cache=cache)
+        self._compute_executor = compute_executor
+        self._pending_jobs = asyncio.Semaphore(max_pending_jobs)
+        self._shared_memory_ring = shared_memory_ring
+
+    async def MeanFilter(self, request: NLImage, context) -> NLImage:
+        """Run the mean filter on the protobuf `request`, see `ImageService.MeanFilter`."""
+        try:
+            response = await self._run_pipeline_async(
+                request, [NLImageOperation(mean_filter=NLMeanFilterOperation())], context
             )
-            LOG.debug(f"Completed an image rotation")
-            return convert_image_to_proto(rotated_image_matrix)
+            self._set_response_compression(context, response)
+            return response
+        except Exception as e:
+            # Handling all types of exception as we don't have an exact control over the input.
+            LOG.debug(f"Faced an exception during convolution.")
+            ERRORS.inc(method="MeanFilter", type=type(e).__name__)
+            return NullImageProto(msg=f"Microservice code for mean-filter threw an exception: {format(e)}")
+
+    async def RotateImage(self, request: NLImageRotateRequest, context) -> NLImage:
+        """Rotate the image of the protobuf `request`, see `ImageService.RotateImage`."""
+        try:
+            response = await self._run_pipeline_async(
+                request.image, [NLImageOperation(rotation=request.rotation)], context
+            )
+            self._set_response_compression(context, response)
+            return response
         except Exception as e:
             # Handling all types of exception as we don't have an exact control over the input.
             LOG.debug(f"Faced an exception while rotation.")
+            ERRORS.inc(method="RotateImage", type=type(e).__name__)
+            return NullImageProto(msg=format(e))
+
+    async def Process(self, request: NLImagePipelineRequest, context) -> NLImage:
+        """Run the operations of the protobuf `request` in order, see `ImageService.Process`."""
+        try:
+            response = await self._run_pipeline_async(request.image, request.operations, context)
+            self._set_response_compression(context, response)
+            return response
+        except Exception as e:
+            # Handling all types of exception as we don't have an exact control over the input.
+            LOG.debug(f"Faced an exception while running a pipeline.")
+            ERRORS.inc(method="Process", type=type(e).__name__)
             return NullImageProto(msg=format(e))
 
+    async def StreamProcess(
+        self, request_iterator: AsyncIterator[NLImageStreamRequest], context
+    ) -> AsyncIterator[NLImageStreamResponse]:
+        """Run a stream of pipelines, yielding each result as soon as it is done.
+
+        See `ImageService.StreamProcess`, the reader and the requests are tasks of the event loop.
+        """
+        results = asyncio.Queue()
+        window = asyncio.Semaphore(self.stream_window)
+        tasks = set()
+
+        async def _process(stream_request: NLImageStreamRequest) -> None:
+            try:
+                image = await self._run_pipeline_async(
+                    stream_request.request.image, stream_request.request.operations, context
+                )
+            except Exception as e:
+                LOG.debug(f"Faced an exception while running a pipeline of a stream.")
+                ERRORS.inc(method="StreamProcess", type=type(e).__name__)
+                image = NullImageProto(msg=format(e))
+            results.put_nowait(NLImageStreamResponse(request_id=stream_request.request_id, image=image))
+
+        async def _read_requests() -> None:
+            number_of_requests = 0
+            try:
+                async for stream_request in request_iterator:
+                    await window.acquire()
+                    task = asyncio.ensure_future(_process(stream_request))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    number_of_requests += 1
+            except Exception:
+                # The stream was cancelled or broken by the client, there is nobody left to answer.
+                LOG.debug(f"Stopped reading a stream after {number_of_requests} requests.")
+            finally:
+                results.put_nowait(number_of_requests)
+
+        reader = asyncio.ensure_future(_read_requests())
+        if self.compression == "auto":
+            # Compress by default, and skip the responses that aren't worth it.
+            context.set_compression(grpc.Compression.Gzip)
+        number_of_requests = None
+        number_of_responses = 0
+        try:
+            while number_of_requests is None or number_of_responses < number_of_requests:
+                result = await results.get()
+                if isinstance(result, int):
+                    number_of_requests = result
+                    continue
+                window.release()
+                number_of_responses += 1
+                if self.compression == "auto" and choose_message_compression(
+                    result.image.data, self.compression
+                ) == grpc.Compression.NoCompression:
+                    context.disable_next_message_compression()
+                yield result
+        finally:
+            reader.cancel()
+            for task in list(tasks):
+                task.cancel()
+        LOG.debug(f"Completed a stream of {number_of_responses} pipelines")
+
+    async def _run_pipeline_async(
+        self, image_pb: NLImage, operations: Iterable[NLImageOperation], context=None
+    ) -> NLImage:
+        """Run a pipeline on a compute process, or answer it from the cache.
+
+        Raises:
+            ValueError: If the image or an operation is invalid.
+            TimeoutError: If the deadline of the call of `context` passed before a compute
+                process was free.
+        """
+        if self._cache is None:
+            return await self._compute_pipeline_async(image_pb, operations, context)
+        key = make_cache_key(image_pb, *_count_pipeline_operations(operations))
+        cached_response = self._cache.get(key)
+        if cached_response is not None:
+            LOG.debug(f"Answered from the cache")
+            return NLImage.FromString(cached_response)
+        response = await self._compute_pipeline_async(image_pb, operations, context)
+        self._cache.put(key, response.SerializeToString())
+        return response
+
+    async def _compute_pipeline_async(
+        self, image_pb: NLImage, operations: Iterable[NLImageOperation], context=None
+    ) -> NLImage:
+        """Run a pipeline on a compute process and serialise the result.
+
+        Raises:
+            ValueError: If the image or an operation is invalid.
+            TimeoutError: If the deadline of the call of `context` passed before a compute
+                process was free.
+        """
+        mean_filters, rotation = _count_pipeline_operations(operations)
+        loop = asyncio.get_event_loop()
+        await self._pending_jobs.acquire()
+        time_remaining = None if context is None else context.time_remaining()
+        if time_remaining is not None and time_remaining <= 0:
+            # Once started, a job runs to the end even if the call is cancelled, nobody would read it.
+            self._pending_jobs.release()
+            raise TimeoutError("The deadline of the call passed while it waited for a compute process")
+        if image_pb.encoding != NLImage.RAW or image_pb.response_encoding != NLImage.RAW:
+            try:
+                request_bytes = NLImagePipelineRequest(
+                    operations=operations, image=image_pb
+                ).SerializeToString()
+                # The compute process decodes and encodes the images too.
+                with STAGE_SECONDS.time(stage="compute"):
+                    response_bytes = await loop.run_in_executor(
+                        self._compute_executor, _run_serialised_pipeline, request_bytes
+                    )
+            finally:
+                self._pending_jobs.release()
+            return NLImage.FromString(response_bytes)
+
+        ring = self._shared_memory_ring
+        shared_range = None
+        job = None
+
+        def _release(_=None) -> None:
+            if shared_range is not None:
+                ring.release(shared_range)
+            self._pending_jobs.release()
+
+        try:
+            image = convert_proto_to_image(image_pb)
+            # The output goes right after the input, which is padded to keep it aligned.
+            output_start = -(-image.nbytes // ring.ALIGNMENT) * ring.ALIGNMENT
+            shared_range = await ring.take(output_start + image.nbytes)
+            input_offset = shared_range[0]
+            output_offset = input_offset + output_start
+            with STAGE_SECONDS.time(stage="decode"):
+                np.ndarray(image.shape, dtype=np.uint8, buffer=ring.block.buf, offset=input_offset)[...] = image
+            job = loop.run_in_executor(
+                self._compute_executor,
+                _run_shared_memory_pipeline,
+                input_offset, output_offset, image.shape, mean_filters, rotation,
+            )
+            # Including the wait for a free compute process.
+            with STAGE_SECONDS.time(stage="compute"):
+                # Shielded so that a cancelled call doesn't reuse the range while the job still runs.
+                await asyncio.shield(job)
+            output_image = np.ndarray(
+                _get_pipeline_output_shape(image.shape, rotation),
+                dtype=np.uint8,
+                buffer=ring.block.buf,
+                offset=output_offset,
+            )
+            with STAGE_SECONDS.time(stage="encode"):
+                response = convert_image_to_proto(output_image)
+            del output_image
+        finally:
+            if job is None or job.done():
+                _release()
+            else:
+                job.add_done_callback(_release)
+        LOG.debug(f"Completed a pipeline of {mean_filters} mean filters and a {rotation} degrees rotation")
+        return response
+
+
+def get_channel_options(
+    keepalive_seconds: float or None = None,
+    window_bytes: int or None = None,
+    local_subchannel_pool: bool = False,
+) -> list:
+    """The options of the channels to the server.
+
+    Args:
+        keepalive_seconds: Seconds between the pings on an idle connection, e.g.
+            KEEPALIVE_SECONDS, None for no pings. The servers must allow them: those started
+            with SERVER_OPTIONS do, others close the connection after a few idle pings.
+        window_bytes: The initial HTTP/2 flow-control window of each call, i.e. the bytes the
+            server can send before the client reads them, which gRPC's bandwidth probing grows
+            on fast links. None for gRPC's default of 64KB. A window the size of the responses
+            saves the round trips of growing it on links with a high latency.
+        local_subchannel_pool: Set to true to give the channel a connection of its own. Otherwise
+            the channels of a process with the same target and options share one.
+
+    Returns:
+        The (name, value) pairs of the options.
+
+    """
+    options = [
+        ('grpc.max_send_message_length', MAX_MESSAGE_LENGTH),
+        ('grpc.max_receive_message_length', MAX_MESSAGE_LENGTH),
+    ]
+    if keepalive_seconds is not None:
+        options.extend([
+            ('grpc.keepalive_time_ms', int(1000 * keepalive_seconds)),
+            ('grpc.keepalive_timeout_ms', int(1000 * KEEPALIVE_TIMEOUT_SECONDS)),
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0),
+        ])
+    if window_bytes is not None:
+        options.append(('grpc.http2.lookahead_bytes', window_bytes))
+    if local_subchannel_pool:
+        options.append(('grpc.use_local_subchannel_pool', 1))
+    return options
+
+
+def create_channel(target: str, compression: str = "gzip", **options) -> grpc.Channel:
+    """Open an insecure channel to the server at `target`, e.g. "localhost:50051".
+
+    Channels don't survive a fork, so open them in the process that uses them.
+
+    Args:
+        target: The host and port of the server.
+        compression: The default compression policy of the requests.
+        options: The keyword arguments of `get_channel_options`.
+
+    Returns:
+        The channel.
+
+    """
+    return grpc.insecure_channel(
+        target, compression=get_default_compression(compression), options=get_channel_options(**options)
+    )
+
+
+def create_async_channel(target: str, compression: str = "gzip", **options) -> grpc.aio.Channel:
+    """Open an insecure `grpc.aio` channel to the server at `target`, see `create_channel`.
+
+    Open it in the event loop that uses it.
+    """
+    return grpc.aio.insecure_channel(
+        target, compression=get_default_compression(compression), options=get_channel_options(**options)
+    )
+
+
+_stubs = weakref.WeakKeyDictionary()
+_stubs_lock = threading.Lock()
+
+
+def get_stub(channel) -> NLImageServiceStub:
+    """The stub of `channel`, made on the first call and kept as long as the channel."""
+    with _stubs_lock:
+        stub = _stubs.get(channel)
+        if stub is None:
+            stub = _stubs[channel] = NLImageServiceStub(channel)
+    return stub
+
+
+def get_pipeline_operations(mean: bool, rotate: int) -> list:
+    """The pipeline operations for a mean filter and/or a rotation, the mean first.
+
+    Args:
+        mean: Set to true if a mean filter needs to be applied on the input image.
+        rotate: Anticlockwise rotation in degrees to rotate the image.
+
+    Returns:
+        The list of NLImageOperation to send in an NLImagePipelineRequest.
+
+    """
+    operations = []
+    if mean:
+        operations.append(NLImageOperation(mean_filter=NLMeanFilterOperation()))
+    if rotate % 360:
+        operations.append(NLImageOperation(rotation=(rotate % 360) // 90))
+    return operations
+
+
+def stream_requests_on_channel(
+    requests: Iterable[Tuple[int, NLImagePipelineRequest]],
+    channel,
+    window: int = 16,
+    compression: str or None = None,
+) -> Iterator[Tuple[int, NLImage]]:
+    """Send pipeline requests over one StreamProcess call and yield the responses as they arrive.
+
+    Args:
+        requests: Pairs of a request id and the request. It is read lazily, so it can read the
+            images from disk as they are needed.
+        channel: the channel on which the the server is listening to.
+        window: Maximum number of requests sent without a response yet.
+        compression: Optional compression policy of the requests, overriding the channel's.
+            Only none and auto can skip the compression of single messages of a stream.
+
+    Yields:
+        Pairs of a request id and the image of its response, in the order the server completes them.
+        Failed requests have a null image with the error in its data.
+
+    """
+    in_flight = threading.BoundedSemaphore(window)
+
+    def _stream_requests() -> Iterator[NLImageStreamRequest]:
+        for request_id, request in requests:
+            in_flight.acquire()
+            yield NLImageStreamRequest(request_id=request_id, request=request)
+
+    stub = get_stub(channel)
+    call_options = {}
+    if compression is not None:
+        call_options["compression"] = get_default_compression(compression)
+    for response in stub.StreamProcess(_stream_requests(), **call_options):
+        in_flight.release()
+        yield response.request_id, response.image
+
+
+def stream_strips_on_channel(
+    strips: Iterable[np.ndarray],
+    width: int,
+    height: int,
+    color: bool,
+    operations: list,
+    channel,
+    compression: str or None = None,
+) -> Iterator[np.ndarray]:
+    """Process an image sent in strips over one ProcessStrips call, yielding the output strips.
+
+    Neither the input nor the output is ever held whole, so the image can be larger than the
+    message limit or the memory of either side.
+
+    Args:
+        strips: The strips of whole rows of the image, from the top. It is read lazily.
+        width: The width of the image.
+        height: The height of the image.
+        color: Set to true if the image has 3 channels.
+        operations: The operations to run, which can only be mean filters.
+        channel: the channel on which the the server is listening to.
+        compression: Optional compression policy of the requests, overriding the channel's.
+
+    Yields:
+        The strips of the output image, from the top.
+
+    Raises:
+        NLGRPCException: If the data passed to the server is invalid or some error occured at the server side.
+
+    """
+    def _strip_messages() -> Iterator[NLImageStrip]:
+        for index, strip in enumerate(strips):
+            strip_pb = NLImageStrip(
+                color=color,
+                data=strip.astype(np.uint8, copy=False).tobytes(),
+                width=width,
+                height=height,
+            )
+            if index == 0:
+                strip_pb.operations.extend(operations)
+            yield strip_pb
+
+    stub = get_stub(channel)
+    call_options = {}
+    if compression is not None:
+        call_options["compression"] = get_default_compression(compression)
+    row_shape = [width, 3] if color else [width]
+    for response in stub.ProcessStrips(_strip_messages(), **call_options):
+        # If the image was invalid or so, the server returns a Null strip with exception in the message.
+        if response.width == 0:
+            raise NLGRPCException(response.data.decode("utf-8"))
+        yield np.frombuffer(response.data, dtype=np.uint8).reshape([-1] + row_shape)
+
+
+def run_strip_request_on_channel(
+    mean: bool,
+    channel,
+    input_image: np.ndarray,
+    strip_bytes: int = STRIP_BYTES,
+    compression: str or None = None,
+) -> np.ndarray:
+    """Run a mean filter on an image in memory by sending it in strips.
+
+    Args:
+        mean: Set to true if a mean filter needs to be applied on the input image.
+        channel: the channel on which the the server is listening to.
+        input_image: The user's image that needs to be manipulated.
+        strip_bytes: Approximate size of each strip.
+        compression: Optional compression policy of the requests, overriding the channel's.
+
+    Returns:
+        The output image.
+
+    Raises:
+        NLGRPCException: If the server failed on the image, or didn't send back as many rows.
+
+    """
+    height, width = input_image.shape[:2]
+    strip_rows = max(1, strip_bytes // max(1, input_image[:1].nbytes))
+    output_image = np.empty(input_image.shape, dtype=np.uint8)
+    output_row = 0
+    for output_strip in stream_strips_on_channel(
+        strips=(input_image[start:start + strip_rows] for start in range(0, height, strip_rows)),
+        width=width,
+        height=height,
+        color=len(input_image.shape) > 2,
+        operations=get_pipeline_operations(mean=mean, rotate=0),
+        channel=channel,
+        compression=compression,
+    ):
+        if output_row + len(output_strip) > height:
+            raise NLGRPCException(f"The server sent more than the {height} rows of the image")
+        output_image[output_row:output_row + len(output_strip)] = output_strip
+        output_row += len(output_strip)
+    if output_row != height:
+        raise NLGRPCException(f"The server sent {output_row} of the {height} rows of the image")
+    return output_image
+
 
 def run_one_request_on_channel(
     mean: bool, 
     rotate: int, 
     channel, 
-    input_image: np.ndarray
+    input_image: np.ndarray,
+    compression: str or None = None,
+    cache: ResultCache or None = None,
 ) -> np.ndarray or None:
     """Run one request on an already opened channel
     
@@ -96,6 +1053,11 @@ def run_one_request_on_channel(
         rotate: Anticlockwise rotation in degrees to rotate the image.
         channel: the channel on which the the server is listening to.
         input_image: The user's image that needs to be manipulated. 
+            Images over `STRIP_BYTES` that only need a mean filter are sent in strips.
+        compression: Optional compression policy of the requests, overriding the channel's.
+            See `compression.COMPRESSION_POLICIES`. 
+        cache: Optional cache of the responses, shared by the calls of all the threads. An image
+            that is in it isn't sent, and concurrent calls for the same image send it once.
 
     Returns:
         output_image: The output image that is requested by the user.
@@ -104,44 +1066,188 @@ def run_one_request_on_channel(
         NLGRPCException: If the data passed to the server is invalid or some error occured at the server side. 
         
     """
+    input_image = input_image.astype(np.uint8, copy=False)
+    if mean and rotate % 360 == 0 and input_image.nbytes > STRIP_BYTES:
+        # Large images are streamed in strips, which also lifts the message size limit.
+        if cache is None:
+            return run_strip_request_on_channel(
+                mean=mean, channel=channel, input_image=input_image, compression=compression
+            )
+        # Cached like the response to the whole image, which it is the same as.
+        response = NLImage.FromString(
+            cache.get_or_run(
+                make_image_cache_key(input_image, 1, 0),
+                lambda: convert_image_to_proto(
+                    run_strip_request_on_channel(
+                        mean=mean, channel=channel, input_image=input_image, compression=compression
+                    )
+                ).SerializeToString(),
+            )
+        )
+        return convert_proto_to_image(response)
+    response = run_one_proto_request_on_channel(
+        mean=mean,
+        rotate=rotate,
+        channel=channel,
+        image_pb=convert_image_to_proto(input_image),
+        compression=compression,
+        cache=cache,
+    )
+    return None if response is None else convert_proto_to_image(response)
+
+
+def run_one_proto_request_on_channel(
+    mean: bool, 
+    rotate: int, 
+    channel, 
+    image_pb: NLImage,
+    compression: str or None = None,
+    cache: ResultCache or None = None,
+) -> NLImage or None:
+    """Run one request for an image that is already in a protobuf message.
+
+    This lets the image travel in an encoded format, e.g. the bytes of a png file, and the result
+    come back in the `response_encoding` of `image_pb`. When both a mean and a rotation are
+    requested they run in a single Process call, or one after the other on older servers.
+
+    Args:
+        mean: Set to true if a mean filter needs to be applied on the input image.
+        rotate: Anticlockwise rotation in degrees to rotate the image.
+        channel: the channel on which the the server is listening to.
+        image_pb: The user's image that needs to be manipulated.
+        compression: Optional compression policy of the requests, overriding the channel's.
+            See `compression.COMPRESSION_POLICIES`. 
+        cache: Optional cache of the responses, shared by the calls of all the threads. An image
+            that is in it isn't sent, and concurrent calls for the same image send it once.
+
+    Returns:
+        The protobuf message of the output image, None if no operation was requested.
+
+    Raises:
+        NLGRPCException: If the data passed to the server is invalid or some error occured at the server side. 
+
+    """
+    if cache is None or not (mean or rotate in [90, 180, 270]):
+        return _send_one_proto_request(mean, rotate, channel, image_pb, compression)
+    # Failed requests raise, so only the successful responses are cached.
+    response_bytes = cache.get_or_run(
+        make_cache_key(image_pb, int(mean), rotate),
+        lambda: _send_one_proto_request(mean, rotate, channel, image_pb, compression).SerializeToString(),
+    )
+    return NLImage.FromString(response_bytes)
+
+
+def _send_one_proto_request(
+    mean: bool, rotate: int, channel, image_pb: NLImage, compression: str or None
+) -> NLImage or None:
+    """Send the calls of `run_one_proto_request_on_channel` to the server."""
     ALLOWED_ROTATIONS = [0, 90, 180, 270]
-    output_image = None
-    input_image = input_image.astype(np.uint8)
+    response = None
+    stub = get_stub(channel)
+
+    def _call_options(image_pb: NLImage) -> dict:
+        if compression is None:
+            return {}
+        return {"compression": choose_message_compression(image_pb.data, compression)}
+
+    if mean and rotate in ALLOWED_ROTATIONS[1:]:
+        # Run both on the server in one go rather than sending the image back and forth.
+        try:
+            response = stub.Process(
+                NLImagePipelineRequest(
+                    operations=get_pipeline_operations(mean, rotate), image=image_pb
+                ),
+                **_call_options(image_pb)
+            )
+        except grpc.RpcError as error:
+            # Servers from before the pipeline was added only have the separate calls.
+            if error.code() != grpc.StatusCode.UNIMPLEMENTED:
+                raise
+            LOG.debug(f"The server can't run pipelines, running the operations one by one.")
+        else:
+            # If the image was invalid or so, the server returns a Null image with exception in the message.
+            if response.width == 0:
+                raise NLGRPCException(response.data.decode("utf-8"))
+            return response
+
     if mean: 
-        stub = NLImageServiceStub(channel)
-        response = stub.MeanFilter(convert_image_to_proto(input_image))
+        mean_request = image_pb
+        if rotate in ALLOWED_ROTATIONS[1:] and image_pb.response_encoding != NLImage.RAW:
+            # Keep the intermediate image exact and cheap to pass on to the rotation.
+            mean_request = NLImage()
+            mean_request.CopyFrom(image_pb)
+            mean_request.response_encoding = NLImage.RAW
+        response = stub.MeanFilter(mean_request, **_call_options(mean_request))
         # If the image was invalid or so, the server returns a Null image with exception in the message.
         if response.width == 0:
             raise NLGRPCException(response.data.decode("utf-8"))
-        output_image = convert_proto_to_image(response)
 
     if rotate in ALLOWED_ROTATIONS[1:]: # We don't check for zero rotations.
         # We'd like to apply the rotation on the averaged image if rotation is requested.
-        # Otherwise we'll read the image from the local directory.
-        input_image = input_image if output_image is None else output_image
-        stub = NLImageServiceStub(channel)
+        # Otherwise we'll send the user's image.
+        if response is not None:
+            response.response_encoding = image_pb.response_encoding
+        rotate_image_pb = image_pb if response is None else response
         response = stub.RotateImage(
             NLImageRotateRequest(
                 rotation=ALLOWED_ROTATIONS.index(rotate), 
-                image=convert_image_to_proto(input_image)
-            )
+                image=rotate_image_pb
+            ),
+            **_call_options(rotate_image_pb)
         )
 
         # If the image was invalid or so, the server returns a Null image with exception in the message.
         if response.width == 0:
             raise NLGRPCException(response.data.decode("utf-8"))
-        output_image = convert_proto_to_image(response)
 
-    return output_image
+    return response
+
+
+def _set_health(health_servicer: health.HealthServicer, status: int) -> None:
+    """Report `status` for all the `HEALTH_SERVICE_NAMES`."""
+    for service_name in HEALTH_SERVICE_NAMES:
+        health_servicer.set(service_name, status)
 
 
-def _wait_forever(server):
-    """Make a process running the server wait forever until a keyboard interrupt is passed."""
+def _wait_forever(
+    server,
+    health_servicer: health.HealthServicer or None = None,
+    shutdown_grace_seconds: float = SHUTDOWN_GRACE_SECONDS,
+    shutdown_drain_seconds: float = SHUTDOWN_DRAIN_SECONDS,
+):
+    """Make a process running the server wait forever until a keyboard interrupt or SIGTERM.
+
+    The server then reports NOT_SERVING and keeps serving for `shutdown_drain_seconds`, so that
+    health-checking clients go elsewhere, then gets `shutdown_grace_seconds` to complete the calls
+    in flight.
+    """
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
         while True:
             time.sleep(datetime.timedelta(days=1).total_seconds())
     except KeyboardInterrupt:
-        server.stop(None)
+        # A second signal, e.g. SIGINT to the whole group then SIGTERM from the supervisor,
+        # doesn't cut the drain short.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if health_servicer is not None:
+            health_servicer.enter_graceful_shutdown()
+            time.sleep(shutdown_drain_seconds)
+        server.stop(shutdown_grace_seconds).wait()
+
+
+def _serve_process_metrics(metrics_address: Tuple[str, int]) -> None:
+    """Serve the metrics of this process, once the process it replaces, if any, has freed the port."""
+
+    def _serve() -> None:
+        while True:
+            try:
+                start_metrics_server(*metrics_address)
+                return
+            except OSError:
+                time.sleep(_SUPERVISOR_POLL_SECONDS)
+
+    threading.Thread(target=_serve, name="metrics-server", daemon=True).start()
 
 
 @contextlib.contextmanager
@@ -160,64 +1266,621 @@ def _reserve_port():
 
 def _run_servers_one_process(
     bind_address: str,
-    max_workers_per_process: int
+    max_workers_per_process: int,
+    compression: str = "gzip",
+    stream_workers_per_process: int = 4,
+    batch_window: float = 0.0,
+    max_batch_size: int = 32,
+    cache_settings: dict or None = None,
+    metrics_address: Tuple[str, int] or None = None,
+    profile_settings: dict or None = None,
+    maximum_concurrent_rpcs: int or None = None,
+    shutdown_grace_seconds: float = SHUTDOWN_GRACE_SECONDS,
+    shutdown_drain_seconds: float = SHUTDOWN_DRAIN_SECONDS,
+    ready: multiprocessing.synchronize.Event or None = None,
 ) -> None:
     """Start a server on one python process.  
 
     Args:
         bind_address: The address at which the server listens to.
         max_workers_per_process: The number of process threads running on each process.
+        compression: The compression policy of the responses.
+        stream_workers_per_process: The number of threads processing the requests of streams.
+        batch_window: Seconds a mean filter waits for others to run with, 0 to not batch them.
+        max_batch_size: Maximum number of mean filters run together. No more than
+            max_workers_per_process calls run at once, so a larger batch would never fill.
+        cache_settings: The arguments of the `ResultCache` of the server, None to not cache.
+        metrics_address: The host and port to serve the metrics of the process at, None to not
+            serve them.
+        profile_settings: The arguments of `install_profile_signal_handler`, None to not profile
+            the process on a signal.
+        maximum_concurrent_rpcs: The most calls the server takes at a time, those that don't get a
+            thread wait in a queue. The calls over it fail with RESOURCE_EXHAUSTED. None for no limit.
+        shutdown_grace_seconds: Seconds the calls in flight get to complete once the process is
+            interrupted or gets SIGTERM.
+        shutdown_drain_seconds: Seconds the server keeps serving once it reports NOT_SERVING,
+            before it stops.
+        ready: Optional event to set once the server is serving.
 
     """
-    server = grpc.server(
-        futures.ThreadPoolExecutor(max_workers=max_workers_per_process), 
-        compression=grpc.Compression.Gzip,
-        options=(
-            ('grpc.max_send_message_length', 1024 * 1024 * 50),
-            ('grpc.max_receive_message_length', 1024 * 1024 * 50),
+    if profile_settings is not None:
+        install_profile_signal_handler(**profile_settings)
+    if batch_window > 0 and max_batch_size > max_workers_per_process:
+        LOG.warning(
+            f"Batching at most {max_workers_per_process} mean filters at a time rather than "
+            f"{max_batch_size}, the number of threads of the server"
         )
+        max_batch_size = max_workers_per_process
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers_per_process)
+    server = grpc.server(
+        executor, 
+        interceptors=(MetricsInterceptor(),),
+        maximum_concurrent_rpcs=maximum_concurrent_rpcs,
+        compression=get_default_compression(compression),
+        options=SERVER_OPTIONS,
     )
-    add_NLImageServiceServicer_to_server(ImageService(), server)
+    service = ImageService(
+        compression=compression,
+        stream_workers=stream_workers_per_process,
+        batch_window=batch_window,
+        max_batch_size=max_batch_size,
+        cache=None if cache_settings is None else ResultCache(**cache_settings),
+    )
+    add_NLImageServiceServicer_to_server(service, server)
+    health_servicer = health.HealthServicer()
+    _set_health(health_servicer, health_pb2.HealthCheckResponse.NOT_SERVING)
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    QUEUE_DEPTH.set_function(lambda: get_executor_queue_depth(executor), queue="grpc")
+    QUEUE_DEPTH.set_function(lambda: get_executor_queue_depth(service._stream_executor), queue="stream")
+    if metrics_address is not None:
+        _serve_process_metrics(metrics_address)
     server.add_insecure_port(bind_address)
     server.start()
-    _wait_forever(server)
+    # Compile the kernels before reporting SERVING, so the first requests of health-checking
+    # clients don't pay for it.
+    warm_up_kernels()
+    _set_health(health_servicer, health_pb2.HealthCheckResponse.SERVING)
+    LOG.info(f"Kernels are warmed up, serving")
+    if ready is not None:
+        ready.set()
+    _wait_forever(server, health_servicer, shutdown_grace_seconds, shutdown_drain_seconds)
+
+
+def _create_compute_pool(
+    compute_processes: int,
+    shared_memory_bytes: int = SHARED_MEMORY_BYTES,
+    profile_settings: dict or None = None,
+) -> Tuple[futures.ProcessPoolExecutor, _SharedMemoryRing]:
+    """Start the compute processes of an asyncio server, and the ring they share with it.
+
+    Shut the pool down before closing the ring. With `profile_settings`, the compute processes
+    profile themselves on a signal, see `install_profile_signal_handler`.
+    """
+    shared_memory_ring = _SharedMemoryRing(shared_memory_bytes)
+    # Spawn rather than fork, gRPC doesn't support forking once it has been used.
+    compute_executor = futures.ProcessPoolExecutor(
+        max_workers=compute_processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_compute_process,
+        initargs=(shared_memory_ring.name, profile_settings),
+    )
+    return compute_executor, shared_memory_ring
+
+
+async def _start_asyncio_server(
+    bind_address: str,
+    compute_executor: futures.Executor,
+    shared_memory_ring: _SharedMemoryRing,
+    compute_processes: int,
+    migration_workers: int = 8,
+    compression: str = "gzip",
+    stream_workers: int = 4,
+    cache: ResultCache or None = None,
+    maximum_concurrent_rpcs: int or None = None,
+) -> Tuple[grpc.aio.Server, int, health.aio.HealthServicer]:
+    """Start a `grpc.aio` server in the running event loop.
+
+    It reports NOT_SERVING on its health service until the kernels are compiled.
+
+    Args:
+        bind_address: The address at which the server listens to.
+        compute_executor: The pool of processes running the operations, see `_create_compute_pool`.
+        shared_memory_ring: The ring the compute processes attached.
+        compute_processes: The number of processes of `compute_executor`.
+        migration_workers: The number of threads running the calls that aren't asynchronous.
+        compression: The compression policy of the responses.
+        stream_workers: Each stream reads at most twice as many requests ahead.
+        cache: Optional cache of the responses.
+        maximum_concurrent_rpcs: The most calls the server takes at a time, the calls over it fail
+            with RESOURCE_EXHAUSTED. None for no limit.
+
+    Returns:
+        The server, its port and its health service.
+
+    """
+    migration_thread_pool = futures.ThreadPoolExecutor(max_workers=migration_workers)
+    server = grpc.aio.server(
+        migration_thread_pool=migration_thread_pool,
+        interceptors=(AsyncMetricsInterceptor(),),
+        maximum_concurrent_rpcs=maximum_concurrent_rpcs,
+        compression=get_default_compression(compression),
+        options=SERVER_OPTIONS,
+    )
+    # Keep every compute process busy, with one more request ready for each.
+    service = AsyncImageService(
+        compute_executor,
+        shared_memory_ring,
+        compression=compression,
+        stream_workers=stream_workers,
+        max_pending_jobs=2 * compute_processes,
+        cache=cache,
+    )
+    add_NLImageServiceServicer_to_server(service, server)
+    health_servicer = health.aio.HealthServicer()
+    for service_name in HEALTH_SERVICE_NAMES:
+        await health_servicer.set(service_name, health_pb2.HealthCheckResponse.NOT_SERVING)
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    QUEUE_DEPTH.set_function(lambda: get_executor_queue_depth(migration_thread_pool), queue="grpc")
+    QUEUE_DEPTH.set_function(lambda: get_executor_queue_depth(compute_executor), queue="compute")
+    port = server.add_insecure_port(bind_address)
+    await server.start()
+    # Compile the kernels before reporting SERVING, here for the strips and in the compute processes.
+    loop = asyncio.get_event_loop()
+    await asyncio.gather(
+        loop.run_in_executor(None, warm_up_kernels),
+        *[loop.run_in_executor(compute_executor, warm_up_kernels) for _ in range(compute_processes)],
+    )
+    for service_name in HEALTH_SERVICE_NAMES:
+        await health_servicer.set(service_name, health_pb2.HealthCheckResponse.SERVING)
+    LOG.info(f"Kernels are warmed up, serving")
+    return server, port, health_servicer
+
+
+async def _serve_asyncio(
+    bind_address: str,
+    compute_executor: futures.Executor,
+    shared_memory_ring: _SharedMemoryRing,
+    compute_processes: int,
+    migration_workers: int,
+    compression: str,
+    stream_workers: int,
+    cache_settings: dict or None,
+    maximum_concurrent_rpcs: int or None,
+    shutdown_grace_seconds: float,
+    shutdown_drain_seconds: float,
+    ready: multiprocessing.synchronize.Event or None,
+) -> None:
+    """Run a `grpc.aio` server until a keyboard interrupt or SIGTERM, then drain it like `_wait_forever`."""
+    server, _, health_servicer = await _start_asyncio_server(
+        bind_address,
+        compute_executor,
+        shared_memory_ring,
+        compute_processes,
+        migration_workers=migration_workers,
+        compression=compression,
+        stream_workers=stream_workers,
+        cache=None if cache_settings is None else ResultCache(**cache_settings),
+        maximum_concurrent_rpcs=maximum_concurrent_rpcs,
+    )
+    if ready is not None:
+        ready.set()
+    # Stop from the event loop, an interrupt raised in the middle of a callback could leave it broken.
+    interrupted = asyncio.Event()
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        asyncio.get_event_loop().add_signal_handler(signum, interrupted.set)
+    try:
+        await interrupted.wait()
+    finally:
+        await health_servicer.enter_graceful_shutdown()
+        await asyncio.sleep(shutdown_drain_seconds)
+        await server.stop(shutdown_grace_seconds)
+
+
+def _run_asyncio_server_one_process(
+    bind_address: str,
+    max_workers_per_process: int,
+    compression: str = "gzip",
+    stream_workers_per_process: int = 4,
+    compute_processes_per_process: int = 2,
+    cache_settings: dict or None = None,
+    metrics_address: Tuple[str, int] or None = None,
+    profile_settings: dict or None = None,
+    maximum_concurrent_rpcs: int or None = None,
+    shutdown_grace_seconds: float = SHUTDOWN_GRACE_SECONDS,
+    shutdown_drain_seconds: float = SHUTDOWN_DRAIN_SECONDS,
+    ready: multiprocessing.synchronize.Event or None = None,
+) -> None:
+    """Start an asyncio server on one python process, with its own pool of compute processes.
+
+    Args:
+        bind_address: The address at which the server listens to.
+        max_workers_per_process: The number of threads running the strip calls.
+        compression: The compression policy of the responses.
+        stream_workers_per_process: Each stream reads at most twice as many requests ahead.
+        compute_processes_per_process: The number of processes running the image operations.
+        cache_settings: The arguments of the `ResultCache` of the server, None to not cache.
+        metrics_address: The host and port to serve the metrics of the process at, None to not
+            serve them. The stages run in the compute processes are timed by this one.
+        profile_settings: The arguments of `install_profile_signal_handler`, None to not profile
+            the processes on a signal. The signal is passed on to the compute processes.
+        maximum_concurrent_rpcs: The most calls the server takes at a time, the calls over it fail
+            with RESOURCE_EXHAUSTED. None for no limit.
+        shutdown_grace_seconds: Seconds the calls in flight get to complete once the process is
+            interrupted or gets SIGTERM.
+        shutdown_drain_seconds: Seconds the server keeps serving once it reports NOT_SERVING,
+            before it stops.
+        ready: Optional event to set once the server is serving.
+
+    """
+    if metrics_address is not None:
+        _serve_process_metrics(metrics_address)
+    compute_executor, shared_memory_ring = _create_compute_pool(
+        compute_processes_per_process, profile_settings=profile_settings
+    )
+    if profile_settings is not None:
+        install_profile_signal_handler(
+            **profile_settings, child_process_ids=lambda: list(compute_executor._processes)
+        )
+    try:
+        asyncio.run(_serve_asyncio(
+            bind_address,
+            compute_executor,
+            shared_memory_ring,
+            compute_processes_per_process,
+            max_workers_per_process,
+            compression,
+            stream_workers_per_process,
+            cache_settings,
+            maximum_concurrent_rpcs,
+            shutdown_grace_seconds,
+            shutdown_drain_seconds,
+            ready,
+        ))
+    finally:
+        compute_executor.shutdown()
+        shared_memory_ring.close()
+
+
+def _set_up_logging() -> None:
+    """Log the messages of this module to stdout, with the pid of the process."""
+    if LOG.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    formatter = logging.Formatter("[PID %(process)d] %(message)s")
+    handler.setFormatter(formatter)
+    LOG.addHandler(handler)
+    LOG.setLevel(logging.DEBUG)
+
+
+def _stop_with_parent() -> None:
+    """Stop this process as SIGTERM does once the process that started it is gone.
+
+    Otherwise the server processes of a supervisor that was killed keep serving the port, next to
+    those of the supervisor started after it.
+    """
+    # Python 3.7 doesn't tell.
+    parent = getattr(multiprocessing, "parent_process", lambda: None)()
+    if parent is None:
+        return
+
+    def _wait_for_parent() -> None:
+        multiprocessing.connection.wait([parent.sentinel])
+        LOG.warning("The supervisor is gone, stopping")
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    threading.Thread(target=_wait_for_parent, name="parent-watch", daemon=True).start()
+
+
+def _run_worker(target: Callable, *args) -> None:
+    """Run `target` in a server process, with the logging and signal handling of a new process."""
+    _set_up_logging()
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    for signum in [signal.SIGTERM, signal.SIGHUP, PROFILE_SIGNAL]:
+        signal.signal(signum, signal.SIG_DFL)
+    _stop_with_parent()
+    target(*args)
+
+
+class _Supervisor:
+    """Keep a server process running in each of a number of slots.
+
+    It respawns the processes that exit, and on SIGHUP restarts them one at a time: the new process
+    of a slot starts and compiles its kernels while the old one keeps serving, then the old one
+    drains. On SIGTERM or SIGINT, all of them drain and the supervisor returns.
+
+    Args:
+        start_worker: Starts the process of a slot, given the slot number and an event the
+            process sets once it is serving.
+        number_of_workers: The number of slots.
+        shutdown_grace_seconds: Seconds a process gets to complete its calls before it is killed.
+        shutdown_drain_seconds: Seconds a process keeps serving once it reports NOT_SERVING.
+        context: The multiprocessing context `start_worker` starts the processes with, which
+            the events come from.
+    """
+
+    def __init__(
+        self,
+        start_worker: Callable[[int, multiprocessing.synchronize.Event], multiprocessing.Process],
+        number_of_workers: int,
+        shutdown_grace_seconds: float = SHUTDOWN_GRACE_SECONDS,
+        shutdown_drain_seconds: float = SHUTDOWN_DRAIN_SECONDS,
+        context: multiprocessing.context.BaseContext = multiprocessing.get_context("spawn"),
+    ):
+        self._start_worker = start_worker
+        self._context = context
+        self.shutdown_grace_seconds = shutdown_grace_seconds
+        self.shutdown_drain_seconds = shutdown_drain_seconds
+        self.workers = [None] * number_of_workers
+        self._started_at = [0.0] * number_of_workers
+        self._quick_exits = [0] * number_of_workers
+        self._respawn_at = [0.0] * number_of_workers
+        # Held on to while the processes start, a spawned process gets the event after start() returns.
+        self._ready_events = [None] * number_of_workers
+        # The signals received, handled in turn by the loop rather than in the handler.
+        self._signals = collections.deque()
+
+    def _start(self, slot: int, timeout: float or None = None) -> multiprocessing.Process or None:
+        """Start a process in `slot`, and with a timeout wait until it is serving.
+
+        Returns:
+            The process, None if it didn't get to serve in time or a stop signal came meanwhile.
+
+        """
+        ready = self._context.Event()
+        self._ready_events[slot] = ready
+        worker = self._start_worker(slot, ready)
+        LOG.info(f"Started process number {slot}: {worker.pid}")
+        if timeout is None:
+            return worker
+        deadline = time.monotonic() + timeout
+        while not ready.wait(_SUPERVISOR_POLL_SECONDS):
+            if not worker.is_alive() or time.monotonic() > deadline or self._stopping():
+                LOG.error(f"The new process number {slot} didn't start serving")
+                self._stop([worker])
+                return None
+        return worker
+
+    def _stop(self, workers: list) -> None:
+        """Let the processes drain, killing those still running after the grace period."""
+        workers = [worker for worker in workers if worker is not None and worker.is_alive()]
+        for worker in workers:
+            os.kill(worker.pid, signal.SIGTERM)
+        # A little longer than the servers take to stop, to let them exit on their own.
+        deadline = time.monotonic() + self.shutdown_drain_seconds + self.shutdown_grace_seconds + 5.0
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                LOG.warning(f"Killing process {worker.pid}, still running after the grace period")
+                worker.kill()
+                worker.join()
+
+    def _stopping(self) -> bool:
+        return any(signum != signal.SIGHUP for signum in self._signals)
+
+    def _respawn_exited_workers(self) -> None:
+        now = time.monotonic()
+        for slot, worker in enumerate(self.workers):
+            if worker is not None and not worker.is_alive():
+                worker.join()
+                if now - self._started_at[slot] < MINIMUM_WORKER_UPTIME_SECONDS:
+                    self._quick_exits[slot] += 1
+                else:
+                    self._quick_exits[slot] = 0
+                delay = 0.0
+                if self._quick_exits[slot]:
+                    delay = min(2.0 ** (self._quick_exits[slot] - 1), MAXIMUM_RESPAWN_DELAY_SECONDS)
+                LOG.warning(
+                    f"Process number {slot} ({worker.pid}) exited with code {worker.exitcode}, "
+                    f"respawning it in {delay:.0f} seconds"
+                )
+                self.workers[slot] = None
+                self._respawn_at[slot] = now + delay
+            if self.workers[slot] is None and self._respawn_at[slot] <= now:
+                self.workers[slot] = self._start(slot)
+                self._started_at[slot] = now
+
+    def _restart_workers(self) -> None:
+        """Replace every process by a new one, one slot at a time."""
+        LOG.info("Restarting the server processes one by one")
+        for slot, old_worker in enumerate(self.workers):
+            new_worker = self._start(slot, timeout=WORKER_START_TIMEOUT_SECONDS)
+            if new_worker is None:
+                # Keep the old process, and the rest of the old ones.
+                return
+            self.workers[slot] = new_worker
+            self._started_at[slot] = time.monotonic()
+            self._quick_exits[slot] = 0
+            self._stop([old_worker])
+        LOG.info("Restarted the server processes")
+
+    def _on_signal(self, signum, frame) -> None:
+        self._signals.append(signum)
+
+    def run(self) -> None:
+        """Run the processes until SIGTERM or SIGINT. Call it from the main thread."""
+        for signum in [signal.SIGTERM, signal.SIGINT, signal.SIGHUP]:
+            signal.signal(signum, self._on_signal)
+        for slot in range(len(self.workers)):
+            self.workers[slot] = self._start(slot)
+            self._started_at[slot] = time.monotonic()
+        while True:
+            while self._signals:
+                if self._signals.popleft() != signal.SIGHUP:
+                    LOG.info("Stopping the server processes")
+                    self._stop(self.workers)
+                    return
+                self._restart_workers()
+            self._respawn_exited_workers()
+            multiprocessing.connection.wait(
+                [worker.sentinel for worker in self.workers if worker is not None],
+                timeout=_SUPERVISOR_POLL_SECONDS,
+            )
 
 
 def spawn_server(
     port: int = 50051, 
     host: str = "localhost", 
     max_workers_per_process: int = 8, 
-    number_of_cores_to_use: int = 4
+    number_of_cores_to_use: int = 4,
+    compression: str = "gzip",
+    stream_workers_per_process: int = 4,
+    asyncio_server: bool = False,
+    compute_processes_per_process: int = 2,
+    single_front_end: bool = False,
+    batch_window_ms: float = 0.0,
+    max_batch_size: int = 32,
+    cache_megabytes: int = 0,
+    cache_directory: str or None = None,
+    cache_directory_megabytes: int = 1024,
+    metrics_port: int = 0,
+    profile_directory: str or None = None,
+    profile_seconds: float = 10.0,
+    maximum_concurrent_rpcs_per_process: int or None = None,
+    shutdown_grace_seconds: float = SHUTDOWN_GRACE_SECONDS,
+    shutdown_drain_seconds: float = SHUTDOWN_DRAIN_SECONDS,
 ) -> None:
     """Run one server request.
+
+    This process supervises the server processes: it respawns those that exit, restarts them one
+    at a time on SIGHUP, e.g. to deploy a new version without dropping requests, and drains them
+    on SIGTERM or SIGINT.
     
     Args:
         port: The port at which this server will run 
         host: The hostname of this server 
         max_workers_per_process: Maximum number of threads that will run on one process (one core of the processor).
         number_of_cores_use: Number of cores to be used.
+        compression: How responses are compressed: none, gzip, deflate or auto (decided per message).
+        stream_workers_per_process: Number of threads of each process working on the requests
+            of streaming calls.
+        asyncio_server: Set to true to run `grpc.aio` servers, which hold the calls on an event
+            loop and run the image operations on a pool of compute processes. The calls aren't
+            limited by the number of threads any more, only max_workers_per_process threads run
+            strip calls.
+        compute_processes_per_process: Number of compute processes of each asyncio server.
+        single_front_end: Set to true to run a single asyncio server with number_of_cores_to_use
+            compute processes, rather than a server per core. The requests are then balanced
+            over the cores one by one, rather than by connection as the kernel spreads them over
+            the servers sharing the port. It is the better choice for a few busy connections.
+        batch_window_ms: Milliseconds a MeanFilter call of the threaded servers waits for others
+            with an image of the same shape, to filter them together. Worth a couple of
+            milliseconds when many small images come in at once. 0 doesn't batch them.
+        max_batch_size: Maximum number of images filtered together, at most
+            max_workers_per_process as no more calls run at once.
+        cache_megabytes: Memory each server process keeps responses in, to answer the same
+            requests again without running them. 0 doesn't cache them.
+        cache_directory: Optional directory the servers write the responses evicted from memory
+            to, and keep across runs. Each server process has a subdirectory of its own.
+        cache_directory_megabytes: Disk space each server process uses in cache_directory.
+        metrics_port: Port to serve the metrics of all the server processes at, summed, over HTTP
+            at /metrics. Each process also serves its own on the ports that follow, the first
+            process on metrics_port + 1 and so on. 0 doesn't serve them.
+        profile_directory: Optional directory for the profiles of the server processes. Sending
+            SIGUSR2 to this process then samples the stacks of every server and compute process
+            for profile_seconds, each writing profile_<pid>_<time>.collapsed for a flame graph.
+            Signal a single process to profile only that one.
+        profile_seconds: How long each profile lasts.
+        maximum_concurrent_rpcs_per_process: The most calls each server process takes at a time.
+            With the threaded servers, those over max_workers_per_process wait for a thread, so it
+            bounds the queue. The calls over it fail with RESOURCE_EXHAUSTED right away rather than
+            waiting longer than their clients do. None doesn't limit them.
+        shutdown_grace_seconds: Seconds the calls in flight get to complete when a server process
+            is stopped, on SIGTERM, SIGINT or a restart. It is killed if still running a few
+            seconds later.
+        shutdown_drain_seconds: Seconds a stopping server process keeps serving once it reports
+            NOT_SERVING, before the grace period, so that the clients and load balancers checking
+            its health stop sending it calls first.
+
+    Raises:
+        RuntimeError: If the asyncio server is asked for on Python 3.7, which has no shared memory.
+        ValueError: If batching is asked for with the asyncio server, which doesn't batch.
 
     """
+    compression = check_compression_policy(compression)
+    if (asyncio_server or single_front_end) and shared_memory is None:
+        raise RuntimeError("The asyncio server needs Python 3.8 or later")
+    if (asyncio_server or single_front_end) and batch_window_ms > 0:
+        raise ValueError("Only the threaded servers batch the mean filters, drop batch_window_ms")
     # Set up some logging for debugging offline.
-    handler = logging.StreamHandler(sys.stdout)
-    formatter = logging.Formatter("[PID %(process)d] %(message)s")
-    handler.setFormatter(formatter)
-    LOG.addHandler(handler)
-    LOG.setLevel(logging.DEBUG)
-    
+    _set_up_logging()
+
+    cache_settings = None
+    if cache_megabytes > 0:
+        cache_settings = dict(
+            max_bytes=cache_megabytes * 1024 * 1024,
+            directory=cache_directory,
+            max_directory_bytes=cache_directory_megabytes * 1024 * 1024,
+        )
+    profile_settings = None
+    if profile_directory is not None:
+        profile_settings = dict(directory=profile_directory, seconds=profile_seconds)
     bind_address = f"{host}:{port}"
     LOG.info(f"Binding to {bind_address}")
     sys.stdout.flush()
-    workers = []
-    for process_number in range(number_of_cores_to_use):
-        worker = multiprocessing.Process(
-            target=_run_servers_one_process,
-            args=(bind_address, max_workers_per_process)
+    if single_front_end:
+        LOG.info(f"Starting a single front end with {number_of_cores_to_use} compute processes")
+        _run_asyncio_server_one_process(
+            bind_address, max_workers_per_process, compression, stream_workers_per_process,
+            number_of_cores_to_use, cache_settings, (host, metrics_port) if metrics_port else None,
+            profile_settings, maximum_concurrent_rpcs_per_process, shutdown_grace_seconds,
+            shutdown_drain_seconds,
+        )
+        return
+
+    def _get_metrics_address(process_number: int) -> Tuple[str, int] or None:
+        # The same for the processes that replace each other.
+        return (host, metrics_port + 1 + process_number) if metrics_port else None
+
+    def _get_cache_settings(process_number: int) -> dict or None:
+        if cache_settings is None or cache_settings["directory"] is None:
+            return cache_settings
+        # Each process trims its directory to its budget, the same one for the processes that
+        # replace each other.
+        return dict(
+            cache_settings, directory=os.path.join(cache_settings["directory"], f"process_{process_number}")
         )
-        LOG.info(f"Started process number: {process_number}")
+
+    def _start_worker(process_number: int, ready: multiprocessing.synchronize.Event) -> multiprocessing.Process:
+        if asyncio_server:
+            args = (
+                _run_asyncio_server_one_process,
+                bind_address, max_workers_per_process, compression, stream_workers_per_process,
+                compute_processes_per_process, _get_cache_settings(process_number),
+                _get_metrics_address(process_number), profile_settings,
+                maximum_concurrent_rpcs_per_process, shutdown_grace_seconds, shutdown_drain_seconds, ready,
+            )
+        else:
+            args = (
+                _run_servers_one_process,
+                bind_address, max_workers_per_process, compression, stream_workers_per_process,
+                batch_window_ms / 1000.0, max_batch_size, _get_cache_settings(process_number),
+                _get_metrics_address(process_number), profile_settings,
+                maximum_concurrent_rpcs_per_process, shutdown_grace_seconds, shutdown_drain_seconds, ready,
+            )
+        worker = context.Process(target=_run_worker, args=args)
         worker.start()
-        workers.append(worker)
-    for worker in workers:
-        worker.join()
+        return worker
+
+    # Spawned rather than forked from this long running process, so that the processes of a
+    # restart import the code and its dependencies afresh.
+    context = multiprocessing.get_context("spawn")
+    supervisor = _Supervisor(
+        _start_worker, number_of_cores_to_use, shutdown_grace_seconds, shutdown_drain_seconds, context
+    )
+    if metrics_port:
+        worker_metrics_urls = [
+            f"http://{host}:{_get_metrics_address(process_number)[1]}/metrics.json"
+            for process_number in range(number_of_cores_to_use)
+        ]
+        start_metrics_server(host, metrics_port, collect=lambda: collect_from(worker_metrics_urls))
+    if profile_settings is not None:
+        # Only pass the signal on, the workers reset the handler.
+        def _profile_workers(signum, frame):
+            for worker in supervisor.workers:
+                if worker is not None and worker.is_alive():
+                    os.kill(worker.pid, PROFILE_SIGNAL)
+
+        signal.signal(PROFILE_SIGNAL, _profile_workers)
+    supervisor.run()
 
 
@@ -0,0 +1,89 @@
+"""Choose how the image messages are compressed on the wire.
+
+Raw pixels often compress poorly, and on a fast link gzip costs more CPU than it saves in transfer
+time. A policy is one of:
+
+    none: Never compress.
+    gzip: Gzip every message.
+    deflate: Deflate every message.
+    auto: Decide per message from its size and how well a sample of it compresses.
+"""
+import zlib
+
+import grpc
+
+
+COMPRESSION_POLICIES = ["none", "gzip", "deflate", "auto"]
+
+# Messages smaller than this are sent as is by the auto policy, there is little to gain.
+AUTO_COMPRESSION_MINIMUM_BYTES = 64 * 1024
+# The auto policy estimates the compression ratio from this many bytes spread over the payload.
+AUTO_COMPRESSION_SAMPLE_BYTES = 64 * 1024
+AUTO_COMPRESSION_SAMPLE_CHUNKS = 4
+# The auto policy compresses a message only if the sample shrinks to this fraction or less.
+AUTO_COMPRESSION_MAXIMUM_RATIO = 0.75
+
+_FIXED_POLICIES = {
+    "none": grpc.Compression.NoCompression,
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+
+
+def check_compression_policy(policy: str) -> str:
+    """Normalise `policy` and check that it is supported.
+
+    Raises:
+        ValueError: If the policy isn't one of `COMPRESSION_POLICIES`.
+    """
+    policy = str(policy).lower()
+    if policy not in COMPRESSION_POLICIES:
+        raise ValueError(f"Compression policy must be in {COMPRESSION_POLICIES} and not {policy}")
+    return policy
+
+
+def get_default_compression(policy: str) -> grpc.Compression:
+    """The compression to configure on a channel or server for `policy`.
+
+    The auto policy doesn't compress by default, messages worth compressing are picked one by one.
+    """
+    policy = check_compression_policy(policy)
+    return _FIXED_POLICIES.get(policy, grpc.Compression.NoCompression)
+
+
+def estimate_compression_ratio(data: bytes) -> float:
+    """Estimate the size of `data` after compression as a fraction of its current size."""
+    if len(data) <= AUTO_COMPRESSION_SAMPLE_BYTES:
+        sample = data
+    else:
+        chunk_size = AUTO_COMPRESSION_SAMPLE_BYTES // AUTO_COMPRESSION_SAMPLE_CHUNKS
+        step = (len(data) - chunk_size) // (AUTO_COMPRESSION_SAMPLE_CHUNKS - 1)
+        sample = b"".join(
+            data[start:start + chunk_size]
+            for start in range(0, step * AUTO_COMPRESSION_SAMPLE_CHUNKS, step)
+        )
+    if not sample:
+        return 1.0
+    # The fastest level is enough to tell noise-like pixels from flat or repetitive ones.
+    return len(zlib.compress(sample, 1)) / len(sample)
+
+
+def choose_message_compression(data: bytes, policy: str) -> grpc.Compression:
+    """Pick the compression of one message carrying `data`.
+
+    Args:
+        data: The bulk of the message, i.e. the image bytes.
+        policy: The compression policy in `COMPRESSION_POLICIES`.
+
+    Returns:
+        The compression to send the message with.
+
+    """
+    policy = check_compression_policy(policy)
+    if policy != "auto":
+        return _FIXED_POLICIES[policy]
+    if len(data) < AUTO_COMPRESSION_MINIMUM_BYTES:
+        return grpc.Compression.NoCompression
+    if estimate_compression_ratio(data) > AUTO_COMPRESSION_MAXIMUM_RATIO:
+        return grpc.Compression.NoCompression
+    return grpc.Compression.Gzip
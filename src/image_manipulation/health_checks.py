@@ -0,0 +1,50 @@
+"""Check whether the servers are serving, with the standard gRPC health service they serve.
+
+The servers report NOT_SERVING while they compile their kernels and SERVING once they are ready, so
+waiting for SERVING keeps the first requests from running on cold kernels.
+"""
+import time
+
+import grpc
+from grpc_health.v1 import health_pb2, health_pb2_grpc
+
+
+HEALTH_CHECK_TIMEOUT_SECONDS = 1.0
+
+
+def check_health(channel: grpc.Channel, timeout: float = HEALTH_CHECK_TIMEOUT_SECONDS) -> bool:
+    """Whether the server of `channel` answers its gRPC health check with SERVING.
+
+    The servers without a health service are taken as serving.
+    """
+    try:
+        response = health_pb2_grpc.HealthStub(channel).Check(health_pb2.HealthCheckRequest(), timeout=timeout)
+    except grpc.RpcError as error:
+        return error.code() == grpc.StatusCode.UNIMPLEMENTED
+    return response.status == health_pb2.HealthCheckResponse.SERVING
+
+
+def wait_until_serving(target: str, timeout: float = 60.0) -> None:
+    """Wait until the server at `target` answers its health check with SERVING, e.g. once started.
+
+    Raises:
+        TimeoutError: If it doesn't within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        # A new connection each time, rather than waiting out the backoff of reconnecting.
+        with grpc.insecure_channel(target, options=[("grpc.use_local_subchannel_pool", 1)]) as channel:
+            if check_health(channel):
+                return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{target} isn't serving after {timeout} seconds")
+        time.sleep(0.1)
+
+
+async def check_health_async(channel: grpc.aio.Channel, timeout: float = HEALTH_CHECK_TIMEOUT_SECONDS) -> bool:
+    """`check_health` for a `grpc.aio` channel."""
+    try:
+        response = await health_pb2_grpc.HealthStub(channel).Check(health_pb2.HealthCheckRequest(), timeout=timeout)
+    except grpc.RpcError as error:
+        return error.code() == grpc.StatusCode.UNIMPLEMENTED
+    return response.status == health_pb2.HealthCheckResponse.SERVING
@@ -0,0 +1,567 @@
+"""Send images to the servers from your own code, keeping many requests in flight on a few channels.
+
+`ImageClient` returns a `concurrent.futures.Future` per image, `AsyncImageClient` is the same for
+asyncio code. Each image is one Process call, and up to `max_in_flight` of them travel at once.
+Submitting more waits for one of them to complete, which holds back whatever produces the images
+rather than piling them up.
+
+A client opens its channels once, starts connecting them straight away and keeps them open with
+keepalive pings, so create one and reuse it for all the calls rather than one per call. Given
+several servers, it balances the calls over them and leaves out those that fail, are slow or don't
+pass their health checks, see `balancing`.
+
+Both also process files as a pipeline of stages: reading and decoding the next images, sending
+them and waiting for the server, and writing the results. The stages are joined by bounded queues,
+so they all run at once and a slow stage holds back the ones before it. One process can keep a
+server busy this way, without the pool of processes of `load_engine`.
+
+For example:
+
+    with ImageClient(["server-1:50051", "server-2:50051"], max_in_flight=32) as client:
+        results = [client.submit(image, mean=True) for image in images]
+        filtered_images = [result.result() for result in results]
+"""
+import asyncio
+from concurrent import futures
+import itertools
+import queue
+import threading
+import time
+from typing import AsyncIterator, Callable, Iterable, Iterator, Sequence, Tuple
+
+import grpc
+import numpy as np
+
+from image_manipulation.balancing import EndpointBalancer
+from image_manipulation.communication_utils import (
+    KEEPALIVE_SECONDS,
+    create_async_channel,
+    create_channel,
+    get_pipeline_operations,
+)
+from image_manipulation.compression import check_compression_policy, choose_message_compression
+from image_manipulation.health_checks import check_health, check_health_async
+from image_manipulation.image_pb2 import NLImage, NLImagePipelineRequest
+from image_manipulation.image_pb2_grpc import NLImageServiceStub
+from image_manipulation.image_utils import (
+    convert_image_to_proto,
+    convert_proto_to_image,
+    NLGRPCException,
+)
+from image_manipulation.load_engine import read_image_proto, write_image_proto
+
+
+# Seconds between two checks of a stage waiting on a full or empty queue that the pipeline was stopped.
+_STAGE_POLL_INTERVAL = 0.1
+
+
+def _pair_paths(input_paths: Iterable[str], output_paths: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """The input and output path of each image.
+
+    Raises:
+        ValueError: If there are more input paths than output paths or the other way around, when
+            the lists are given or else once the shorter runs out.
+    """
+    if hasattr(input_paths, "__len__") and hasattr(output_paths, "__len__"):
+        if len(input_paths) != len(output_paths):
+            raise ValueError(f"{len(input_paths)} input paths and {len(output_paths)} output paths")
+    return _zip_paths(input_paths, output_paths)
+
+
+def _zip_paths(input_paths: Iterable[str], output_paths: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    missing = object()
+    for input_path, output_path in itertools.zip_longest(input_paths, output_paths, fillvalue=missing):
+        if input_path is missing or output_path is missing:
+            raise ValueError("There aren't as many output paths as input paths")
+        yield input_path, output_path
+
+
+def _get_stage_items(get: Callable[[], object]) -> Iterator[tuple]:
+    """The items of a pipeline queue until its end: a None, or the exception that stopped the stage."""
+    while True:
+        item = get()
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def _make_request(image: NLImage or np.ndarray, mean: bool, rotate: int) -> NLImagePipelineRequest:
+    """The Process request for an image.
+
+    Raises:
+        ValueError: If neither a mean filter nor a rotation is asked for.
+    """
+    operations = get_pipeline_operations(mean=mean, rotate=rotate)
+    if not operations:
+        raise ValueError("No operation requested, either set mean or a rotation that isn't a full turn")
+    image_pb = image if isinstance(image, NLImage) else convert_image_to_proto(image)
+    return NLImagePipelineRequest(operations=operations, image=image_pb)
+
+
+def _get_result(response: NLImage, as_proto: bool) -> NLImage or np.ndarray:
+    """The output image of a response, in the type the input was given in.
+
+    Raises:
+        NLGRPCException: If the server failed on the image.
+    """
+    # If the image was invalid or so, the server returns a Null image with exception in the message.
+    if response.width == 0:
+        raise NLGRPCException(response.data.decode("utf-8"))
+    return response if as_proto else convert_proto_to_image(response)
+
+
+class ChannelPool:
+    """Channels to one or more servers, each with its stub.
+
+    Each channel has a connection of its own. `spawn_server` gives every new connection to any of
+    its processes, and the calls of a connection all go to the same one, so a few channels to a
+    server spread the calls over its processes. They ping their idle connections every
+    KEEPALIVE_SECONDS unless told otherwise, which the servers must allow, see `SERVER_OPTIONS`.
+
+    Args:
+        targets: The host and port of each server, or of the only one.
+        channels_per_target: The channels opened to each server.
+        create: Opens a channel, `create_channel` or `create_async_channel`.
+        compression: The compression policy of the requests.
+        channel_options: The keyword arguments of `get_channel_options`, e.g. keepalive_seconds.
+
+    Raises:
+        ValueError: If there is no target, or channels_per_target is below one.
+    """
+
+    def __init__(
+        self,
+        targets: str or Sequence[str],
+        channels_per_target: int = 1,
+        create: Callable = create_channel,
+        compression: str = "gzip",
+        **channel_options,
+    ):
+        if isinstance(targets, str):
+            targets = [targets]
+        if not targets:
+            raise ValueError("No server to open channels to")
+        if channels_per_target < 1:
+            raise ValueError(f"At least one channel per server must be opened and not {channels_per_target}")
+        self.targets = list(targets)
+        channel_options.setdefault("keepalive_seconds", KEEPALIVE_SECONDS)
+        self.target_channels = [
+            [
+                create(target, compression=compression, local_subchannel_pool=True, **channel_options)
+                for _ in range(channels_per_target)
+            ]
+            for target in self.targets
+        ]
+        self.channels = [channel for channels in self.target_channels for channel in channels]
+        self._stubs = [[NLImageServiceStub(channel) for channel in channels] for channels in self.target_channels]
+        # Thread-safe, the count is incremented under the GIL.
+        self._calls = itertools.count()
+
+    def get_stub(self, target_index: int) -> NLImageServiceStub:
+        """The stub of the next channel to the server `target_index`, in turn."""
+        stubs = self._stubs[target_index]
+        return stubs[next(self._calls) % len(stubs)]
+
+
+class ImageClient:
+    """A client for threaded code, see the module's documentation.
+
+    It is thread-safe: the threads submitting images share the window of requests in flight.
+
+    Args:
+        targets: The host and port of each server, or of the only one.
+        max_in_flight: The most requests sent without a response yet, to all the servers.
+        compression: The compression policy of the requests, see `compression.COMPRESSION_POLICIES`.
+        channels_per_target: The channels opened to each server.
+        policy: How the server of each call is picked, see `balancing.BALANCING_POLICIES`.
+        health_check_seconds: Seconds between the health checks of the servers, None for none.
+        ejection_seconds: How long a failing or slow server is first left out.
+        channel_options: The keyword arguments of `get_channel_options`, e.g. keepalive_seconds
+            or window_bytes.
+
+    Raises:
+        ValueError: If max_in_flight or channels_per_target is below one, there is no target or
+            the policy is unknown.
+    """
+
+    def __init__(
+        self,
+        targets: str or Sequence[str],
+        max_in_flight: int = 16,
+        compression: str = "gzip",
+        channels_per_target: int = 1,
+        policy: str = "power_of_two",
+        health_check_seconds: float or None = 5.0,
+        ejection_seconds: float = 10.0,
+        **channel_options,
+    ):
+        if max_in_flight < 1:
+            raise ValueError(f"At least one request must be in flight and not {max_in_flight}")
+        self.compression = check_compression_policy(compression)
+        self.max_in_flight = max_in_flight
+        self._pool = ChannelPool(
+            targets, channels_per_target, create_channel, self.compression, **channel_options
+        )
+        self.balancer = EndpointBalancer(self._pool.targets, policy=policy, ejection_seconds=ejection_seconds)
+        # Connect now rather than on the first call.
+        self._ready = [grpc.channel_ready_future(channel) for channel in self._pool.channels]
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._closed = threading.Event()
+        self._health_checks = None
+        if health_check_seconds is not None:
+            self._health_checks = threading.Thread(
+                target=self._check_health, args=(health_check_seconds,), name="health-checks", daemon=True
+            )
+            self._health_checks.start()
+
+    def __enter__(self) -> "ImageClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def wait_until_ready(self, timeout: float or None = None) -> None:
+        """Wait until all the channels are connected.
+
+        Raises:
+            grpc.FutureTimeoutError: If they aren't within `timeout` seconds.
+        """
+        for ready in self._ready:
+            ready.result(timeout=timeout)
+
+    def _check_health(self, interval: float) -> None:
+        """Check the health of every server each `interval` seconds, until the client is closed."""
+        while True:
+            for target_index, channels in enumerate(self._pool.target_channels):
+                self.balancer.set_serving(target_index, check_health(channels[0]))
+            if self._closed.wait(interval):
+                return
+
+    def close(self) -> None:
+        """Close the channels, cancelling the requests still in flight."""
+        self._closed.set()
+        if self._health_checks is not None:
+            # Before the channels it checks are closed.
+            self._health_checks.join()
+        for ready in self._ready:
+            ready.cancel()
+        for channel in self._pool.channels:
+            channel.close()
+
+    def submit(self, image: NLImage or np.ndarray, mean: bool = False, rotate: int = 0) -> futures.Future:
+        """Send an image to the server, waiting first if `max_in_flight` requests already are.
+
+        Args:
+            image: The image, either as pixels or a message, e.g. of an encoded file.
+            mean: Set to true if a mean filter needs to be applied on the image.
+            rotate: Anticlockwise rotation in degrees to rotate the image.
+
+        Returns:
+            The future of the output image, pixels for pixels and a message for a message. It
+            raises NLGRPCException if the server failed on the image, or the grpc.RpcError of the call.
+
+        Raises:
+            ValueError: If neither a mean filter nor a rotation is asked for.
+
+        """
+        request = _make_request(image, mean, rotate)
+        result = futures.Future()
+        # Nothing to cancel on our side once the request is on its way.
+        result.set_running_or_notify_cancel()
+        call_options = {}
+        if self.compression == "auto":
+            call_options["compression"] = choose_message_compression(request.image.data, self.compression)
+        self._in_flight.acquire()
+        target_index = self.balancer.pick()
+        start_time = time.perf_counter()
+        try:
+            call = self._pool.get_stub(target_index).Process.future(request, **call_options)
+        except BaseException:
+            self.balancer.finish(target_index, 0.0, grpc.StatusCode.UNKNOWN)
+            self._in_flight.release()
+            raise
+        call.add_done_callback(
+            lambda call: self._complete(call, result, isinstance(image, NLImage), target_index, start_time)
+        )
+        return result
+
+    def _complete(
+        self, call: grpc.Future, result: futures.Future, as_proto: bool, target_index: int, start_time: float
+    ) -> None:
+        """Hand the response of a call over to its future, on the thread of gRPC completing it."""
+        self.balancer.finish(target_index, time.perf_counter() - start_time, call.code())
+        self._in_flight.release()
+        try:
+            result.set_result(_get_result(call.result(), as_proto))
+        except Exception as e:
+            result.set_exception(e)
+
+    def process_files(
+        self,
+        input_paths: Iterable[str],
+        output_paths: Iterable[str],
+        mean: bool = False,
+        rotate: int = 0,
+        encoded: bool = False,
+        read_ahead: int = 4,
+    ) -> Iterator[Tuple[str, Exception or None]]:
+        """Process image files, reading, sending and writing different images at the same time.
+
+        `read_ahead` threads read and decode the next images, up to `max_in_flight` of them wait for
+        the server, and the responses are written by the thread iterating, as the results are
+        yielded. Stopping the iteration stops the pipeline.
+
+        Args:
+            input_paths: The image files.
+            output_paths: Where to write the output of each, in the same order.
+            mean: Set to true if a mean filter needs to be applied on the images.
+            rotate: Anticlockwise rotation in degrees to rotate the images.
+            encoded: Set to true to send the files as they are and get the same format back.
+                Otherwise they are decoded and sent as raw pixels.
+            read_ahead: Number of images read ahead of the ones being sent.
+
+        Yields:
+            The input path of each image, in order, once its output is written, with None or the
+            exception it failed with.
+
+        Raises:
+            ValueError: If there aren't as many output paths as input paths.
+            Exception: What iterating over the paths raised, once the images before are yielded.
+
+        """
+        paths = _pair_paths(input_paths, output_paths)
+        reads = queue.Queue(maxsize=read_ahead)
+        sent = queue.Queue(maxsize=self.max_in_flight)
+        stopped = threading.Event()
+        read_executor = futures.ThreadPoolExecutor(max_workers=read_ahead)
+
+        def _put(stage_queue: queue.Queue, item) -> bool:
+            while not stopped.is_set():
+                try:
+                    stage_queue.put(item, timeout=_STAGE_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        # Each stage ends its queue with a None, or with the exception it stopped on, which the
+        # next stage passes on and the caller gets once the images before it are done.
+        def _read_images() -> None:
+            end = None
+            try:
+                for input_path, output_path in paths:
+                    read = read_executor.submit(read_image_proto, input_path, encoded)
+                    if not _put(reads, (input_path, output_path, read)):
+                        return
+            except Exception as e:
+                end = e
+            finally:
+                _put(reads, end)
+
+        def _send_images() -> None:
+            end = None
+            try:
+                for input_path, output_path, read in _get_stage_items(reads.get):
+                    try:
+                        image_pb = read.result()
+                        if image_pb is None:
+                            raise ValueError(f"Couldn't read the image {input_path}")
+                        response = self.submit(image_pb, mean=mean, rotate=rotate)
+                    except Exception as e:
+                        response = futures.Future()
+                        response.set_exception(e)
+                    if not _put(sent, (input_path, output_path, response)):
+                        return
+            except Exception as e:
+                end = e
+            finally:
+                _put(sent, end)
+
+        stages = [
+            threading.Thread(target=_read_images, daemon=True),
+            threading.Thread(target=_send_images, daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            for input_path, output_path, response in _get_stage_items(sent.get):
+                try:
+                    write_image_proto(response.result(), output_path)
+                except Exception as e:
+                    yield input_path, e
+                else:
+                    yield input_path, None
+        finally:
+            stopped.set()
+            # Let a stage blocked on an empty queue see it.
+            for stage_queue in [reads, sent]:
+                try:
+                    stage_queue.put_nowait(None)
+                except queue.Full:
+                    pass
+            read_executor.shutdown(wait=False)
+
+
+class AsyncImageClient:
+    """A client for asyncio code, see the module's documentation.
+
+    Create it in the event loop that uses it. The arguments are those of `ImageClient`.
+    """
+
+    def __init__(
+        self,
+        targets: str or Sequence[str],
+        max_in_flight: int = 16,
+        compression: str = "gzip",
+        channels_per_target: int = 1,
+        policy: str = "power_of_two",
+        health_check_seconds: float or None = 5.0,
+        ejection_seconds: float = 10.0,
+        **channel_options,
+    ):
+        if max_in_flight < 1:
+            raise ValueError(f"At least one request must be in flight and not {max_in_flight}")
+        self.compression = check_compression_policy(compression)
+        self.max_in_flight = max_in_flight
+        self._pool = ChannelPool(
+            targets, channels_per_target, create_async_channel, self.compression, **channel_options
+        )
+        self.balancer = EndpointBalancer(self._pool.targets, policy=policy, ejection_seconds=ejection_seconds)
+        # Connect now rather than on the first call.
+        for channel in self._pool.channels:
+            channel.get_state(try_to_connect=True)
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._health_checks = None
+        if health_check_seconds is not None:
+            self._health_checks = asyncio.ensure_future(self._check_health(health_check_seconds))
+
+    async def __aenter__(self) -> "AsyncImageClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def wait_until_ready(self, timeout: float or None = None) -> None:
+        """Wait until all the channels are connected.
+
+        Raises:
+            asyncio.TimeoutError: If they aren't within `timeout` seconds.
+        """
+        await asyncio.wait_for(
+            asyncio.gather(*[channel.channel_ready() for channel in self._pool.channels]), timeout
+        )
+
+    async def _check_health(self, interval: float) -> None:
+        """Check the health of every server each `interval` seconds, until the client is closed."""
+        while True:
+            for target_index, channels in enumerate(self._pool.target_channels):
+                self.balancer.set_serving(target_index, await check_health_async(channels[0]))
+            await asyncio.sleep(interval)
+
+    async def close(self) -> None:
+        """Close the channels, cancelling the requests still in flight."""
+        if self._health_checks is not None:
+            self._health_checks.cancel()
+            await asyncio.gather(self._health_checks, return_exceptions=True)
+        await asyncio.gather(*[channel.close() for channel in self._pool.channels])
+
+    async def process(
+        self, image: NLImage or np.ndarray, mean: bool = False, rotate: int = 0
+    ) -> NLImage or np.ndarray:
+        """Process an image on the server, waiting first if `max_in_flight` requests already are.
+
+        See `ImageClient.submit`, wrap it in a task to get a future.
+
+        Raises:
+            ValueError: If neither a mean filter nor a rotation is asked for.
+            NLGRPCException: If the server failed on the image.
+            grpc.RpcError: If the call failed.
+
+        """
+        request = _make_request(image, mean, rotate)
+        call_options = {}
+        if self.compression == "auto":
+            call_options["compression"] = choose_message_compression(request.image.data, self.compression)
+        async with self._in_flight:
+            target_index = self.balancer.pick()
+            start_time = time.perf_counter()
+            # Unless it completes, the call was cancelled.
+            code = grpc.StatusCode.CANCELLED
+            try:
+                response = await self._pool.get_stub(target_index).Process(request, **call_options)
+                code = grpc.StatusCode.OK
+            except grpc.RpcError as error:
+                code = error.code()
+                raise
+            finally:
+                self.balancer.finish(target_index, time.perf_counter() - start_time, code)
+        return _get_result(response, isinstance(image, NLImage))
+
+    async def process_files(
+        self,
+        input_paths: Iterable[str],
+        output_paths: Iterable[str],
+        mean: bool = False,
+        rotate: int = 0,
+        encoded: bool = False,
+        read_ahead: int = 4,
+    ) -> AsyncIterator[Tuple[str, Exception or None]]:
+        """Process image files, reading, sending and writing different images at the same time.
+
+        See `ImageClient.process_files`. The files are read and written on the default executor
+        of the event loop.
+        """
+        paths = _pair_paths(input_paths, output_paths)
+        loop = asyncio.get_event_loop()
+        reads = asyncio.Queue(maxsize=read_ahead)
+        sent = asyncio.Queue(maxsize=self.max_in_flight)
+
+        async def _read_images() -> None:
+            end = None
+            try:
+                for input_path, output_path in paths:
+                    read = loop.run_in_executor(None, read_image_proto, input_path, encoded)
+                    await reads.put((input_path, output_path, read))
+            except Exception as e:
+                end = e
+            await reads.put(end)
+
+        async def _process(input_path: str, read: asyncio.Future) -> NLImage:
+            image_pb = await read
+            if image_pb is None:
+                raise ValueError(f"Couldn't read the image {input_path}")
+            return await self.process(image_pb, mean=mean, rotate=rotate)
+
+        async def _send_images() -> None:
+            while True:
+                item = await reads.get()
+                if item is None or isinstance(item, Exception):
+                    break
+                input_path, output_path, read = item
+                await sent.put((input_path, output_path, asyncio.ensure_future(_process(input_path, read))))
+            await sent.put(item)
+
+        stages = [asyncio.ensure_future(_read_images()), asyncio.ensure_future(_send_images())]
+        try:
+            while True:
+                item = await sent.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                input_path, output_path, response = item
+                try:
+                    await loop.run_in_executor(None, write_image_proto, await response, output_path)
+                except Exception as e:
+                    yield input_path, e
+                else:
+                    yield input_path, None
+        finally:
+            for stage in stages:
+                stage.cancel()
+            while not sent.empty():
+                item = sent.get_nowait()
+                if isinstance(item, tuple):
+                    item[2].cancel()
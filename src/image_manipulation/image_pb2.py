@@ -19,11 +19,46 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   syntax='proto3',
   serialized_options=b'\n\032com.neuralink.interviewingP\001',
   create_key=_descriptor._internal_create_key,
-  serialized_pb=b'\n\x0bimage.proto\"E\n\x07NLImage\x12\r\n\x05\x63olor\x18\x01 \x01(\x08\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\x12\r\n\x05width\x18\x03 \x01(\x05\x12\x0e\n\x06height\x18\x04 \x01(\x05\"\xb0\x01\n\x14NLImageRotateRequest\x12\x30\n\x08rotation\x18\x01 \x01(\x0e\x32\x1e.NLImageRotateRequest.Rotation\x12\x17\n\x05image\x18\x02 \x01(\x0b\x32\x08.NLImage\"M\n\x08Rotation\x12\x08\n\x04NONE\x10\x00\x12\x0e\n\nNINETY_DEG\x10\x01\x12\x12\n\x0eONE_EIGHTY_DEG\x10\x02\x12\x13\n\x0fTWO_SEVENTY_DEG\x10\x03\x32\x62\n\x0eNLImageService\x12.\n\x0bRotateImage\x12\x15.NLImageRotateRequest\x1a\x08.NLImage\x12 \n\nMeanFilter\x12\x08.NLImage\x1a\x08.NLImageB\x1e\n\x1a\x63om.neuralink.interviewingP\x01\x62\x06proto3'
+  serialized_pb=b'\n\x0bimage.proto\"\xca\x01\n\x07NLImage\x12\r\n\x05\x63olor\x18\x01 \x01(\x08\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\x12\r\n\x05width\x18\x03 \x01(\x05\x12\x0e\n\x06height\x18\x04 \x01(\x05\x12#\n\x08\x65ncoding\x18\x05 \x01(\x0e\x32\x11.NLImage.Encoding\x12,\n\x11response_encoding\x18\x06 \x01(\x0e\x32\x11.NLImage.Encoding\"0\n\x08\x45ncoding\x12\x07\n\x03RAW\x10\x00\x12\x07\n\x03PNG\x10\x01\x12\x08\n\x04JPEG\x10\x02\x12\x08\n\x04WEBP\x10\x03\"\xb0\x01\n\x14NLImageRotateRequest\x12\x30\n\x08rotation\x18\x01 \x01(\x0e\x32\x1e.NLImageRotateRequest.Rotation\x12\x17\n\x05image\x18\x02 \x01(\x0b\x32\x08.NLImage\"M\n\x08Rotation\x12\x08\n\x04NONE\x10\x00\x12\x0e\n\nNINETY_DEG\x10\x01\x12\x12\n\x0eONE_EIGHTY_DEG\x10\x02\x12\x13\n\x0fTWO_SEVENTY_DEG\x10\x03\"\x17\n\x15NLMeanFilterOperation\"\x82\x01\n\x10NLImageOperation\x12-\n\x0bmean_filter\x18\x01 \x01(\x0b\x32\x16.NLMeanFilterOperationH\x00\x12\x32\n\x08rotation\x18\x02 \x01(\x0e\x32\x1e.NLImageRotateRequest.RotationH\x00\x42\x0b\n\toperation\"X\n\x16NLImagePipelineRequest\x12%\n\noperations\x18\x01 \x03(\x0b\x32\x11.NLImageOperation\x12\x17\n\x05image\x18\x02 \x01(\x0b\x32\x08.NLImage\"T\n\x14NLImageStreamRequest\x12\x12\n\nrequest_id\x18\x01 \x01(\x04\x12(\n\x07request\x18\x02 \x01(\x0b\x32\x17.NLImagePipelineRequest\"D\n\x15NLImageStreamResponse\x12\x12\n\nrequest_id\x18\x01 \x01(\x04\x12\x17\n\x05image\x18\x02 \x01(\x0b\x32\x08.NLImage\"q\n\x0cNLImageStrip\x12\r\n\x05\x63olor\x18\x01 \x01(\x08\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\x12\r\n\x05width\x18\x03 \x01(\x05\x12\x0e\n\x06height\x18\x04 \x01(\x05\x12%\n\noperations\x18\x05 \x03(\x0b\x32\x11.NLImageOperation2\x87\x02\n\x0eNLImageService\x12.\n\x0bRotateImage\x12\x15.NLImageRotateRequest\x1a\x08.NLImage\x12 \n\nMeanFilter\x12\x08.NLImage\x1a\x08.NLImage\x12,\n\x07Process\x12\x17.NLImagePipelineRequest\x1a\x08.NLImage\x12\x42\n\rStreamProcess\x12\x15.NLImageStreamRequest\x1a\x16.NLImageStreamResponse(\x01\x30\x01\x12\x31\n\rProcessStrips\x12\r.NLImageStrip\x1a\r.NLImageStrip(\x01\x30\x01\x42\x1e\n\x1a\x63om.neuralink.interviewingP\x01\x62\x06proto3'
 )
 
 
 
+_NLIMAGE_ENCODING = _descriptor.EnumDescriptor(
+  name='Encoding',
+  full_name='NLImage.Encoding',
+  filename=None,
+  file=DESCRIPTOR,
+  create_key=_descriptor._internal_create_key,
+  values=[
+    _descriptor.EnumValueDescriptor(
+      name='RAW', index=0, number=0,
+      serialized_options=None,
+      type=None,
+      create_key=_descriptor._internal_create_key),
+    _descriptor.EnumValueDescriptor(
+      name='PNG', index=1, number=1,
+      serialized_options=None,
+      type=None,
+      create_key=_descriptor._internal_create_key),
+    _descriptor.EnumValueDescriptor(
+      name='JPEG', index=2, number=2,
+      serialized_options=None,
+      type=None,
+      create_key=_descriptor._internal_create_key),
+    _descriptor.EnumValueDescriptor(
+      name='WEBP', index=3, number=3,
+      serialized_options=None,
+      type=None,
+      create_key=_descriptor._internal_create_key),
+  ],
+  containing_type=None,
+  serialized_options=None,
+  serialized_start=170,
+  serialized_end=218,
+)
+_sym_db.RegisterEnumDescriptor(_NLIMAGE_ENCODING)
+
 _NLIMAGEROTATEREQUEST_ROTATION = _descriptor.EnumDescriptor(
   name='Rotation',
   full_name='NLImageRotateRequest.Rotation',
@@ -54,8 +89,8 @@ _NLIMAGEROTATEREQUEST_ROTATION = _descriptor.EnumDescriptor(
   ],
   containing_type=None,
   serialized_options=None,
-  serialized_start=186,
-  serialized_end=263,
+  serialized_start=320,
+  serialized_end=397,
 )
 _sym_db.RegisterEnumDescriptor(_NLIMAGEROTATEREQUEST_ROTATION)
 
@@ -96,11 +131,26 @@ _NLIMAGE = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='encoding', full_name='NLImage.encoding', index=4,
+      number=5, type=14, cpp_type=8, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='response_encoding', full_name='NLImage.response_encoding', index=5,
+      number=6, type=14, cpp_type=8, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
   ],
   extensions=[
   ],
   nested_types=[],
   enum_types=[
+    _NLIMAGE_ENCODING,
   ],
   serialized_options=None,
   is_extendable=False,
@@ -108,8 +158,8 @@ _NLIMAGE = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=15,
-  serialized_end=84,
+  serialized_start=16,
+  serialized_end=218,
 )
 
 
@@ -148,15 +198,283 @@ _NLIMAGEROTATEREQUEST = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=87,
-  serialized_end=263,
+  serialized_start=221,
+  serialized_end=397,
+)
+
+
+_NLMEANFILTEROPERATION = _descriptor.Descriptor(
+  name='NLMeanFilterOperation',
+  full_name='NLMeanFilterOperation',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=399,
+  serialized_end=422,
+)
+
+
+_NLIMAGEOPERATION = _descriptor.Descriptor(
+  name='NLImageOperation',
+  full_name='NLImageOperation',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='mean_filter', full_name='NLImageOperation.mean_filter', index=0,
+      number=1, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='rotation', full_name='NLImageOperation.rotation', index=1,
+      number=2, type=14, cpp_type=8, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+    _descriptor.OneofDescriptor(
+      name='operation', full_name='NLImageOperation.operation',
+      index=0, containing_type=None,
+      create_key=_descriptor._internal_create_key,
+    fields=[]),
+  ],
+  serialized_start=425,
+  serialized_end=555,
 )
 
+
+_NLIMAGEPIPELINEREQUEST = _descriptor.Descriptor(
+  name='NLImagePipelineRequest',
+  full_name='NLImagePipelineRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='operations', full_name='NLImagePipelineRequest.operations', index=0,
+      number=1, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='image', full_name='NLImagePipelineRequest.image', index=1,
+      number=2, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=557,
+  serialized_end=645,
+)
+
+
+_NLIMAGESTREAMREQUEST = _descriptor.Descriptor(
+  name='NLImageStreamRequest',
+  full_name='NLImageStreamRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='request_id', full_name='NLImageStreamRequest.request_id', index=0,
+      number=1, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='request', full_name='NLImageStreamRequest.request', index=1,
+      number=2, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=647,
+  serialized_end=731,
+)
+
+
+_NLIMAGESTREAMRESPONSE = _descriptor.Descriptor(
+  name='NLImageStreamResponse',
+  full_name='NLImageStreamResponse',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='request_id', full_name='NLImageStreamResponse.request_id', index=0,
+      number=1, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='image', full_name='NLImageStreamResponse.image', index=1,
+      number=2, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=733,
+  serialized_end=801,
+)
+
+
+_NLIMAGESTRIP = _descriptor.Descriptor(
+  name='NLImageStrip',
+  full_name='NLImageStrip',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='color', full_name='NLImageStrip.color', index=0,
+      number=1, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='data', full_name='NLImageStrip.data', index=1,
+      number=2, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"",
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='width', full_name='NLImageStrip.width', index=2,
+      number=3, type=5, cpp_type=1, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='height', full_name='NLImageStrip.height', index=3,
+      number=4, type=5, cpp_type=1, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+    _descriptor.FieldDescriptor(
+      name='operations', full_name='NLImageStrip.operations', index=4,
+      number=5, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR,  create_key=_descriptor._internal_create_key),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=803,
+  serialized_end=916,
+)
+
+_NLIMAGE.fields_by_name['encoding'].enum_type = _NLIMAGE_ENCODING
+_NLIMAGE.fields_by_name['response_encoding'].enum_type = _NLIMAGE_ENCODING
+_NLIMAGE_ENCODING.containing_type = _NLIMAGE
 _NLIMAGEROTATEREQUEST.fields_by_name['rotation'].enum_type = _NLIMAGEROTATEREQUEST_ROTATION
 _NLIMAGEROTATEREQUEST.fields_by_name['image'].message_type = _NLIMAGE
 _NLIMAGEROTATEREQUEST_ROTATION.containing_type = _NLIMAGEROTATEREQUEST
+_NLIMAGEOPERATION.fields_by_name['mean_filter'].message_type = _NLMEANFILTEROPERATION
+_NLIMAGEOPERATION.fields_by_name['rotation'].enum_type = _NLIMAGEROTATEREQUEST_ROTATION
+_NLIMAGEOPERATION.oneofs_by_name['operation'].fields.append(
+  _NLIMAGEOPERATION.fields_by_name['mean_filter'])
+_NLIMAGEOPERATION.fields_by_name['mean_filter'].containing_oneof = _NLIMAGEOPERATION.oneofs_by_name['operation']
+_NLIMAGEOPERATION.oneofs_by_name['operation'].fields.append(
+  _NLIMAGEOPERATION.fields_by_name['rotation'])
+_NLIMAGEOPERATION.fields_by_name['rotation'].containing_oneof = _NLIMAGEOPERATION.oneofs_by_name['operation']
+_NLIMAGEPIPELINEREQUEST.fields_by_name['operations'].message_type = _NLIMAGEOPERATION
+_NLIMAGEPIPELINEREQUEST.fields_by_name['image'].message_type = _NLIMAGE
+_NLIMAGESTREAMREQUEST.fields_by_name['request'].message_type = _NLIMAGEPIPELINEREQUEST
+_NLIMAGESTREAMRESPONSE.fields_by_name['image'].message_type = _NLIMAGE
+_NLIMAGESTRIP.fields_by_name['operations'].message_type = _NLIMAGEOPERATION
 DESCRIPTOR.message_types_by_name['NLImage'] = _NLIMAGE
 DESCRIPTOR.message_types_by_name['NLImageRotateRequest'] = _NLIMAGEROTATEREQUEST
+DESCRIPTOR.message_types_by_name['NLMeanFilterOperation'] = _NLMEANFILTEROPERATION
+DESCRIPTOR.message_types_by_name['NLImageOperation'] = _NLIMAGEOPERATION
+DESCRIPTOR.message_types_by_name['NLImagePipelineRequest'] = _NLIMAGEPIPELINEREQUEST
+DESCRIPTOR.message_types_by_name['NLImageStreamRequest'] = _NLIMAGESTREAMREQUEST
+DESCRIPTOR.message_types_by_name['NLImageStreamResponse'] = _NLIMAGESTREAMRESPONSE
+DESCRIPTOR.message_types_by_name['NLImageStrip'] = _NLIMAGESTRIP
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
 NLImage = _reflection.GeneratedProtocolMessageType('NLImage', (_message.Message,), {
@@ -173,6 +491,48 @@ NLImageRotateRequest = _reflection.GeneratedProtocolMessageType('NLImageRotateRe
   })
 _sym_db.RegisterMessage(NLImageRotateRequest)
 
+NLMeanFilterOperation = _reflection.GeneratedProtocolMessageType('NLMeanFilterOperation', (_message.Message,), {
+  'DESCRIPTOR' : _NLMEANFILTEROPERATION,
+  '__module__' : 'image_pb2'
+  # @@protoc_insertion_point(class_scope:NLMeanFilterOperation)
+  })
+_sym_db.RegisterMessage(NLMeanFilterOperation)
+
+NLImageOperation = _reflection.GeneratedProtocolMessageType('NLImageOperation', (_message.Message,), {
+  'DESCRIPTOR' : _NLIMAGEOPERATION,
+  '__module__' : 'image_pb2'
+  # @@protoc_insertion_point(class_scope:NLImageOperation)
+  })
+_sym_db.RegisterMessage(NLImageOperation)
+
+NLImagePipelineRequest = _reflection.GeneratedProtocolMessageType('NLImagePipelineRequest', (_message.Message,), {
+  'DESCRIPTOR' : _NLIMAGEPIPELINEREQUEST,
+  '__module__' : 'image_pb2'
+  # @@protoc_insertion_point(class_scope:NLImagePipelineRequest)
+  })
+_sym_db.RegisterMessage(NLImagePipelineRequest)
+
+NLImageStreamRequest = _reflection.GeneratedProtocolMessageType('NLImageStreamRequest', (_message.Message,), {
+  'DESCRIPTOR' : _NLIMAGESTREAMREQUEST,
+  '__module__' : 'image_pb2'
+  # @@protoc_insertion_point(class_scope:NLImageStreamRequest)
+  })
+_sym_db.RegisterMessage(NLImageStreamRequest)
+
+NLImageStreamResponse = _reflection.GeneratedProtocolMessageType('NLImageStreamResponse', (_message.Message,), {
+  'DESCRIPTOR' : _NLIMAGESTREAMRESPONSE,
+  '__module__' : 'image_pb2'
+  # @@protoc_insertion_point(class_scope:NLImageStreamResponse)
+  })
+_sym_db.RegisterMessage(NLImageStreamResponse)
+
+NLImageStrip = _reflection.GeneratedProtocolMessageType('NLImageStrip', (_message.Message,), {
+  'DESCRIPTOR' : _NLIMAGESTRIP,
+  '__module__' : 'image_pb2'
+  # @@protoc_insertion_point(class_scope:NLImageStrip)
+  })
+_sym_db.RegisterMessage(NLImageStrip)
+
 
 DESCRIPTOR._options = None
 
@@ -183,8 +543,8 @@ _NLIMAGESERVICE = _descriptor.ServiceDescriptor(
   index=0,
   serialized_options=None,
   create_key=_descriptor._internal_create_key,
-  serialized_start=265,
-  serialized_end=363,
+  serialized_start=919,
+  serialized_end=1182,
   methods=[
   _descriptor.MethodDescriptor(
     name='RotateImage',
@@ -206,6 +566,36 @@ _NLIMAGESERVICE = _descriptor.ServiceDescriptor(
     serialized_options=None,
     create_key=_descriptor._internal_create_key,
   ),
+  _descriptor.MethodDescriptor(
+    name='Process',
+    full_name='NLImageService.Process',
+    index=2,
+    containing_service=None,
+    input_type=_NLIMAGEPIPELINEREQUEST,
+    output_type=_NLIMAGE,
+    serialized_options=None,
+    create_key=_descriptor._internal_create_key,
+  ),
+  _descriptor.MethodDescriptor(
+    name='StreamProcess',
+    full_name='NLImageService.StreamProcess',
+    index=3,
+    containing_service=None,
+    input_type=_NLIMAGESTREAMREQUEST,
+    output_type=_NLIMAGESTREAMRESPONSE,
+    serialized_options=None,
+    create_key=_descriptor._internal_create_key,
+  ),
+  _descriptor.MethodDescriptor(
+    name='ProcessStrips',
+    full_name='NLImageService.ProcessStrips',
+    index=4,
+    containing_service=None,
+    input_type=_NLIMAGESTRIP,
+    output_type=_NLIMAGESTRIP,
+    serialized_options=None,
+    create_key=_descriptor._internal_create_key,
+  ),
 ])
 _sym_db.RegisterServiceDescriptor(_NLIMAGESERVICE)
 
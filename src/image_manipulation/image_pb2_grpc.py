@@ -24,6 +24,21 @@ class NLImageServiceStub(object):
                 request_serializer=image__pb2.NLImage.SerializeToString,
                 response_deserializer=image__pb2.NLImage.FromString,
                 )
+        self.Process = channel.unary_unary(
+                '/NLImageService/Process',
+                request_serializer=image__pb2.NLImagePipelineRequest.SerializeToString,
+                response_deserializer=image__pb2.NLImage.FromString,
+                )
+        self.StreamProcess = channel.stream_stream(
+                '/NLImageService/StreamProcess',
+                request_serializer=image__pb2.NLImageStreamRequest.SerializeToString,
+                response_deserializer=image__pb2.NLImageStreamResponse.FromString,
+                )
+        self.ProcessStrips = channel.stream_stream(
+                '/NLImageService/ProcessStrips',
+                request_serializer=image__pb2.NLImageStrip.SerializeToString,
+                response_deserializer=image__pb2.NLImageStrip.FromString,
+                )
 
 
 class NLImageServiceServicer(object):
@@ -55,6 +70,34 @@ class NLImageServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def Process(self, request, context):
+        """Run the operations of the request one after the other on the
+        server, without sending the intermediate images back and forth.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def StreamProcess(self, request_iterator, context):
+        """Process a stream of pipelines over one call. The server works on
+        several requests at a time and streams each response back as
+        soon as it is ready.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ProcessStrips(self, request_iterator, context):
+        """Process one image sent as a stream of strips, from the top. The
+        server streams the output strips back while it is still
+        receiving, so neither side holds the whole image. Only mean
+        filters can run this way. Like the other calls, a failure is
+        returned as a strip with a width of 0 and the error in data.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_NLImageServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -68,6 +111,21 @@ def add_NLImageServiceServicer_to_server(servicer, server):
                     request_deserializer=image__pb2.NLImage.FromString,
                     response_serializer=image__pb2.NLImage.SerializeToString,
             ),
+            'Process': grpc.unary_unary_rpc_method_handler(
+                    servicer.Process,
+                    request_deserializer=image__pb2.NLImagePipelineRequest.FromString,
+                    response_serializer=image__pb2.NLImage.SerializeToString,
+            ),
+            'StreamProcess': grpc.stream_stream_rpc_method_handler(
+                    servicer.StreamProcess,
+                    request_deserializer=image__pb2.NLImageStreamRequest.FromString,
+                    response_serializer=image__pb2.NLImageStreamResponse.SerializeToString,
+            ),
+            'ProcessStrips': grpc.stream_stream_rpc_method_handler(
+                    servicer.ProcessStrips,
+                    request_deserializer=image__pb2.NLImageStrip.FromString,
+                    response_serializer=image__pb2.NLImageStrip.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'NLImageService', rpc_method_handlers)
@@ -111,3 +169,54 @@ class NLImageService(object):
             image__pb2.NLImage.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Process(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/NLImageService/Process',
+            image__pb2.NLImagePipelineRequest.SerializeToString,
+            image__pb2.NLImage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def StreamProcess(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/NLImageService/StreamProcess',
+            image__pb2.NLImageStreamRequest.SerializeToString,
+            image__pb2.NLImageStreamResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def ProcessStrips(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/NLImageService/ProcessStrips',
+            image__pb2.NLImageStrip.SerializeToString,
+            image__pb2.NLImageStrip.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
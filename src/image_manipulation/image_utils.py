@@ -1,10 +1,9 @@
-import time
-import threading
+import os
 
 import cv2
 import numpy as np
 from image_manipulation.image_pb2 import NLImage
-from numba import uint8, jit
+from numba import njit
 
 
 class NLGRPCException(Exception):
@@ -23,62 +22,241 @@ def NullImageProto(msg:str = ""):
         A null proto buf image representation.
 
     """
+    if isinstance(msg, str):
+        msg = msg.encode("utf-8")
     return NLImage(width=0, height=0, data=msg)
 
 
 AVERAGING_KERNEL = np.ones((3,3), np.float32) / 9
 
-# This function is not working the way it should be, hence sticking to the opencv version.
-def get_mean_image(input_image: np.ndarray) -> np.ndarray:
+# File extensions of the encodings an NLImage can carry, and how to write them.
+IMAGE_ENCODING_EXTENSIONS = {
+    NLImage.PNG: ".png",
+    NLImage.JPEG: ".jpg",
+    NLImage.WEBP: ".webp",
+}
+IMAGE_ENCODING_PARAMETERS = {
+    # Favour speed, the size hardly changes between levels for photos.
+    NLImage.PNG: [cv2.IMWRITE_PNG_COMPRESSION, 1],
+    NLImage.JPEG: [cv2.IMWRITE_JPEG_QUALITY, 95],
+    # A quality above 100 makes WebP lossless.
+    NLImage.WEBP: [cv2.IMWRITE_WEBP_QUALITY, 101],
+}
+
+
+def get_encoding_from_path(path: str) -> int:
+    """The NLImage encoding of an image file, based on its extension.
+
+    Raises:
+        ValueError: If the extension isn't one of a supported encoding.
+    """
+    extension = os.path.splitext(path)[-1].lower()
+    if extension == ".jpeg":
+        return NLImage.JPEG
+    for encoding, encoding_extension in IMAGE_ENCODING_EXTENSIONS.items():
+        if extension == encoding_extension:
+            return encoding
+    raise ValueError(f"No image encoding is supported for the extension {extension}")
+
+@njit(cache=True, nogil=True)
+def _box_mean(image, radius, result):
+    """Mean of every (2 * radius + 1) square window of an HxWxC image, clipped at the borders.
+
+    Pixels near a border are averaged over the part of the window that lies inside the image,
+    which is the edge normalisation described in image.proto. Column sums are kept in a
+    running buffer and slid along the rows, so the cost per pixel doesn't depend on `radius`.
+    The mean is written to `result`, a C-contiguous uint8 array the same size as `image`.
+    """
+    rows, columns, channels = image.shape
+    row_length = columns * channels
+    flat_image = image.reshape((rows, row_length))
+    result = result.reshape((rows, row_length))
+    # Away from the borders every window is full, so look the quotient up instead of dividing.
+    full_count = (2 * radius + 1) ** 2
+    full_window_mean = (np.arange(255 * full_count + 1) // full_count).astype(np.uint8)
+    # Sum of the current window of rows for every column and channel.
+    column_sums = np.zeros(row_length, dtype=np.int64)
+    # Running sum of `column_sums` along the row, offset by one pixel.
+    row_prefix = np.zeros(row_length + channels, dtype=np.int64)
+    for row_index in range(min(radius + 1, rows)):
+        for k in range(row_length):
+            column_sums[k] += flat_image[row_index, k]
+
+    for i in range(rows):
+        row_count = min(i + radius, rows - 1) - max(i - radius, 0) + 1
+        for k in range(row_length):
+            row_prefix[k + channels] = row_prefix[k] + column_sums[k]
+        for j in range(columns):
+            start = max(j - radius, 0)
+            stop = min(j + radius, columns - 1) + 1
+            count = row_count * (stop - start)
+            if count == full_count:
+                for depth in range(channels):
+                    total = row_prefix[stop * channels + depth] - row_prefix[start * channels + depth]
+                    result[i, j * channels + depth] = full_window_mean[total]
+            else:
+                for depth in range(channels):
+                    total = row_prefix[stop * channels + depth] - row_prefix[start * channels + depth]
+                    result[i, j * channels + depth] = total // count
+
+        # Move the window of rows down by one.
+        if i + radius + 1 < rows:
+            for k in range(row_length):
+                column_sums[k] += flat_image[i + radius + 1, k]
+        if i - radius >= 0:
+            for k in range(row_length):
+                column_sums[k] -= flat_image[i - radius, k]
+
+
+def get_mean_image(
+    input_image: np.ndarray,
+    kernel_size: int = 3,
+    out: np.ndarray or None = None
+) -> np.ndarray:
     """Run an averaging filter over `input_image`.
 
+    `input_image` is only read, so the read-only view from `convert_proto_to_image` can be
+    passed as is. It is copied only if it isn't a C-contiguous uint8 array.
+
     Args:
         input_image: The image provided by the user. Can be greyscale or RGB.
+        kernel_size: Width of the square averaging window, must be odd. The service uses 3.
+        out: Optional preallocated C-contiguous uint8 array of the same shape to write the
+            result to. A new one is allocated if not given.
 
     Returns:
-        The blurred image.
+        The blurred image, which is `out` if it was given.
+
+    Raises:
+        ValueError: If `kernel_size` isn't a positive odd number or `out` doesn't fit the image.
 
     """
-    input_image = input_image.astype(np.uint8)
-    @jit(uint8[:,:](uint8[:,:]))
-    def filter_2d(image):
-        M, N = image.shape
-        Mf, Nf = 3, 3
-        result = np.zeros_like(image, dtype=image.dtype)
-        for i in range(M):
-            for j in range(N):
-                num = 0.0
-                count = 0
-                for ii in range(Mf):
-                    for jj in range(Nf):
-                        row_index = i- 1 + ii
-                        column_index = j - 1 + jj
-                        if row_index < 0 or row_index >= M or column_index < 0 or column_index >= N:
-                            continue
-                        num += image[row_index, column_index]
-                        count += 1
-                result[i, j] = num / count
-        return result
-
-    # If an RGB image run the filter thrice.
+    if kernel_size < 1 or kernel_size % 2 == 0:
+        raise ValueError(f"The kernel size must be a positive odd number and not {kernel_size}")
+    input_image = np.ascontiguousarray(input_image, dtype=np.uint8)
+    if out is None:
+        out = np.empty(input_image.shape, dtype=np.uint8)
+    elif out.shape != input_image.shape or out.dtype != np.uint8 or not out.flags.c_contiguous:
+        raise ValueError(f"Can't write a {input_image.shape} mean image to a {out.dtype} {out.shape} array")
+
     if len(input_image.shape) > 2:
-        result = np.empty(input_image.shape, dtype=input_image.dtype)
-        def set_result(input_image, depth, result):
-            result[:, :, depth] = filter_2d(input_image[:, :, depth])
-        threads = []
+        _box_mean(input_image, kernel_size // 2, out)
+    else:
+        # A greyscale image is filtered as a single channel image.
+        _box_mean(input_image[:, :, np.newaxis], kernel_size // 2, out[:, :, np.newaxis])
+    return out
 
-        for depth in range(3):
-            current_thread = threading.Thread(target=set_result, args=(input_image, depth, result))
-            current_thread.setDaemon(True)
-            current_thread.start()
-            threads.append(current_thread)
 
-        for t in threads:
-            t.join()
-        return result
+@njit(cache=True, nogil=True)
+def _box_mean_batch(images, radius, results):
+    """`_box_mean` of every image of an NxHxWxC stack."""
+    for index in range(images.shape[0]):
+        _box_mean(images[index], radius, results[index])
+
+
+def get_mean_image_batch(
+    input_images: np.ndarray,
+    kernel_size: int = 3,
+    out: np.ndarray or None = None
+) -> np.ndarray:
+    """Run an averaging filter over every image of a stack, in a single kernel call.
+
+    Each image is filtered on its own, exactly as `get_mean_image` would. Filtering many small
+    images this way saves the Python overhead of a call per image.
+
+    Args:
+        input_images: The images stacked along the first axis, all greyscale or all RGB.
+        kernel_size: Width of the square averaging window, must be odd.
+        out: Optional preallocated C-contiguous uint8 array of the same shape to write the
+            results to. A new one is allocated if not given.
+
+    Returns:
+        The stack of blurred images, which is `out` if it was given.
+
+    Raises:
+        ValueError: If `kernel_size` isn't a positive odd number or `out` doesn't fit the images.
+
+    """
+    if kernel_size < 1 or kernel_size % 2 == 0:
+        raise ValueError(f"The kernel size must be a positive odd number and not {kernel_size}")
+    input_images = np.ascontiguousarray(input_images, dtype=np.uint8)
+    if out is None:
+        out = np.empty(input_images.shape, dtype=np.uint8)
+    elif out.shape != input_images.shape or out.dtype != np.uint8 or not out.flags.c_contiguous:
+        raise ValueError(f"Can't write {input_images.shape} mean images to a {out.dtype} {out.shape} array")
+
+    if len(input_images.shape) > 3:
+        _box_mean_batch(input_images, kernel_size // 2, out)
+    else:
+        _box_mean_batch(input_images[..., np.newaxis], kernel_size // 2, out[..., np.newaxis])
+    return out
+
+
+class StripMeanFilter:
+    """Mean filter an image that arrives as horizontal strips, from the top.
+
+    The rows a pixel's window needs below it may not have arrived yet, so the output lags the input
+    by `kernel_size // 2` rows. Those rows, and as many above them, are kept as a halo for the next
+    strip; nothing else is held on to. The output is identical to `get_mean_image` on the whole image.
+
+    Args:
+        kernel_size: Width of the square averaging window, must be odd.
+    """
 
-    a = filter_2d(input_image)
-    return a
+    def __init__(self, kernel_size: int = 3):
+        self.kernel_size = kernel_size
+        self.radius = kernel_size // 2
+        # Input rows still needed, the first of which is row `_first_row` of the image.
+        self._rows = None
+        self._first_row = 0
+        self._rows_received = 0
+        self._rows_filtered = 0
+
+    def push(self, rows: np.ndarray, last: bool = False) -> np.ndarray:
+        """Add the next `rows` of the image and get the rows of the output that are now final.
+
+        Args:
+            rows: The next rows of the image, greyscale or RGB. May be empty.
+            last: Set to true if these are the last rows of the image.
+
+        Returns:
+            The next rows of the output, possibly none.
+
+        """
+        self._rows = rows if self._rows is None else np.concatenate([self._rows, rows])
+        self._rows_received += len(rows)
+        if last:
+            final_row = self._rows_received
+        else:
+            final_row = max(self._rows_received - self.radius, self._rows_filtered)
+        if final_row == self._rows_filtered:
+            return self._rows[:0]
+
+        # Start far enough above the first output row that its window isn't clipped early.
+        start = max(self._rows_filtered - self.radius, 0)
+        stop = min(final_row + self.radius, self._rows_received)
+        window = self._rows[start - self._first_row:stop - self._first_row]
+        output_rows = get_mean_image(window, kernel_size=self.kernel_size)
+        output_rows = output_rows[self._rows_filtered - start:final_row - start]
+
+        self._rows_filtered = final_row
+        halo_start = max(final_row - self.radius, self._first_row)
+        self._rows = self._rows[halo_start - self._first_row:]
+        self._first_row = halo_start
+        return output_rows
+
+
+def warm_up_kernels() -> None:
+    """Compile (or load from the on-disk cache) every kernel a request can hit.
+
+    Call this once per worker process before serving so that no request pays for the compilation.
+    """
+    for shape in [(3, 3), (3, 3, 3)]:
+        image = np.zeros(shape, dtype=np.uint8)
+        get_mean_image(image)
+        get_mean_image_batch(image[np.newaxis])
+        # Images decoded from a request are read-only, which Numba compiles separately.
+        get_mean_image(convert_proto_to_image(convert_image_to_proto(image)))
 
 
 def get_rotated_image(
@@ -87,6 +265,27 @@ def get_rotated_image(
 ) -> np.ndarray:
     """Get a rotated image around the center.
 
+    Multiples of 90 degrees, which is all NLImageRotateRequest allows, are an exact reordering
+    of the pixels. They are returned as a strided view of `input_image` without copying or
+    resampling; the pixels are only laid out when the view is serialised.
+
+    Args:
+        input_image: The image that the user provided.
+        rotation_request: Anticlockwise rotation in degrees to rotate the image.
+
+    Returns:
+        The rotated image around the center of the original image.
+
+    """
+    if rotation_request % 90 == 0:
+        # np.rot90 turns the rows towards the columns, which is anticlockwise on screen.
+        return np.rot90(input_image, k=(rotation_request // 90) % 4)
+    return _get_affine_rotated_image(input_image, rotation_request)
+
+
+def _get_affine_rotated_image(input_image: np.ndarray, rotation_request: float) -> np.ndarray:
+    """Rotate by an arbitrary angle, resampling into the bounding box of the rotated image.
+
     This API is copied from the image utils convenience functions.
 
     Args:
@@ -102,10 +301,9 @@ def get_rotated_image(
     (h, w) = input_image.shape[:2]
     (cX, cY) = (w / 2, h / 2)
 
-    # grab the rotation matrix (applying the negative of the
-    # angle to rotate clockwise), then grab the sine and cosine
-    # (i.e., the rotation components of the matrix)
-    M = cv2.getRotationMatrix2D((cX, cY), -rotation_request, 1.0)
+    # grab the rotation matrix (positive angles are anticlockwise in opencv),
+    # then grab the sine and cosine (i.e., the rotation components of the matrix)
+    M = cv2.getRotationMatrix2D((cX, cY), rotation_request, 1.0)
     cos = np.abs(M[0, 0])
     sin = np.abs(M[0, 1])
 
@@ -121,22 +319,75 @@ def get_rotated_image(
     return cv2.warpAffine(input_image, M, (nW, nH))
 
 
-def convert_image_to_proto(image: np.ndarray) -> NLImage:
-    """Convert a numpy `image` to a protobuf message."""
+def convert_image_to_proto(image: np.ndarray, encoding: int = NLImage.RAW) -> NLImage:
+    """Convert a numpy `image` to a protobuf message.
+
+    The raw pixels are copied once, straight into the message bytes. Strided views such as a
+    rotated image are laid out row-wise in that same copy.
+
+    Args:
+        image: The greyscale or 3 channel image.
+        encoding: The NLImage encoding of the message data. RAW by default.
+
+    Returns:
+        The protobuf message of the image.
+
+    Raises:
+        ValueError: If the image can't be encoded.
+
+    """
+    if image.dtype != np.uint8:
+        image = image.astype(np.uint8)
+    if encoding == NLImage.RAW:
+        data = image.tobytes()
+    else:
+        success, encoded_image = cv2.imencode(
+            IMAGE_ENCODING_EXTENSIONS[encoding], image, IMAGE_ENCODING_PARAMETERS[encoding]
+        )
+        if not success:
+            raise ValueError(f"Failed to encode the image as {NLImage.Encoding.Name(encoding)}")
+        data = encoded_image.tobytes()
     return NLImage(
         color=len(image.shape) > 2, # If the dimensions has a 3rd value which is the channels, it is RGB.
-        data=image.flatten().tobytes(),
+        data=data,
         width=image.shape[1],
-        height=image.shape[0]
+        height=image.shape[0],
+        encoding=encoding,
     )
 
 
 def convert_proto_to_image(image_pb: NLImage) -> np.ndarray:
-    """Convert an NLImage protobuf message to a numpy image."""
+    """Convert an NLImage protobuf message to a numpy image.
+
+    A RAW image is a read-only view of the message bytes, nothing is copied. Write results to a
+    new (or preallocated) array instead of modifying it. Encoded images are decoded to a greyscale
+    or 3 channel uint8 image.
+
+    Raises:
+        ValueError: If the size of the data doesn't match the dimensions of the image, or the data
+            can't be decoded.
+    """
     input_array = np.frombuffer(image_pb.data, dtype=np.uint8)
+    if image_pb.encoding != NLImage.RAW:
+        input_image = _decode_image(input_array)
+        # Some formats, e.g. WebP, always decode to 3 channels. Follow the sender if it said.
+        if image_pb.width and not image_pb.color and len(input_image.shape) > 2:
+            input_image = cv2.cvtColor(input_image, cv2.COLOR_BGR2GRAY)
+        return input_image
     dimensions = [image_pb.height, image_pb.width]
     if image_pb.color:
         dimensions.append(3)
     input_image = input_array.reshape(dimensions)
     return input_image
 
+
+def _decode_image(encoded_image: np.ndarray) -> np.ndarray:
+    """Decode the bytes of an image file to the image layouts NLImage supports."""
+    image = cv2.imdecode(encoded_image, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("Failed to decode the image data")
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    if len(image.shape) > 2 and image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
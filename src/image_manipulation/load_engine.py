@@ -0,0 +1,363 @@
+"""Push a folder of images through the server from a bounded pool of client processes.
+
+Each worker process opens its own channel once it has started, and keeps a window of requests in
+flight on one stream. The images are read lazily as the stream asks for them, and the responses are
+handed to a writer thread so that writing to disk never holds up the stream.
+
+With a cache directory, the files are hashed first. The images whose responses are in the cache are
+written straight from it, and of the images that are the same as others only one is sent, its
+output being copied to the others. So reprocessing a folder where a few images changed only sends
+those.
+"""
+import os
+import logging
+import multiprocessing
+import queue
+import shutil
+import sys
+import threading
+from typing import List
+
+import cv2
+
+from image_manipulation.cache import ResultCache, make_data_cache_key
+from image_manipulation.health_checks import wait_until_serving
+from image_manipulation.image_pb2 import NLImage, NLImagePipelineRequest
+from image_manipulation.image_utils import (
+    convert_proto_to_image,
+    convert_image_to_proto,
+    get_encoding_from_path,
+)
+from image_manipulation.communication_utils import (
+    create_channel,
+    get_pipeline_operations,
+    stream_requests_on_channel,
+)
+
+
+LOG = logging.getLogger(__name__)
+
+MEGABYTE = 1024 * 1024
+# Seconds to wait for the server to finish compiling its kernels and answer SERVING.
+SERVER_READY_TIMEOUT_SECONDS = 60.0
+
+
+def list_image_files(directory: str, extensions: List[str]) -> List[str]:
+    """The names of the files in `directory` with one of the image `extensions`, sorted."""
+    extensions = [extension.lower() for extension in extensions]
+    return [
+        filename for filename in sorted(os.listdir(directory))
+        if os.path.splitext(filename)[-1].lower() in extensions
+    ]
+
+
+def read_image_proto(image_file_path: str, encoded: bool = False) -> NLImage or None:
+    """Read an image file into a message to send to the server.
+
+    Args:
+        image_file_path: Path to the image.
+        encoded: Set to true to send the file as it is on disk, and get the response back in the
+            same format. Otherwise the image is decoded and sent as raw pixels.
+
+    Returns:
+        The message of the image, None if it couldn't be read.
+
+    """
+    if encoded:
+        with open(image_file_path, "rb") as image_file:
+            encoding = get_encoding_from_path(image_file_path)
+            return NLImage(data=image_file.read(), encoding=encoding, response_encoding=encoding)
+    try:
+        input_image = cv2.imread(image_file_path)
+    except:
+        LOG.error(f"something went wrong while reading the input image: {image_file_path}")
+        return None
+    if input_image is None:
+        LOG.error(f"something went wrong while reading the input image: {image_file_path}")
+        return None
+    return convert_image_to_proto(input_image)
+
+
+def write_image_proto(image_pb: NLImage, image_file_path: str) -> None:
+    """Write an image message returned by the server to `image_file_path`.
+
+    Raises:
+        OSError: If the file couldn't be written.
+
+    """
+    if image_pb.encoding == NLImage.RAW:
+        # OpenCV returns False rather than raising.
+        if not cv2.imwrite(img=convert_proto_to_image(image_pb), filename=image_file_path):
+            raise OSError(f"Couldn't write {image_file_path}")
+    else:
+        with open(image_file_path, "wb") as image_file:
+            image_file.write(image_pb.data)
+
+
+def get_output_path(output_directory: str, image_file_path: str) -> str:
+    """Where the result of `image_file_path` is written."""
+    return os.path.join(output_directory, f"manipulated_{os.path.basename(image_file_path)}")
+
+
+def _make_file_cache_key(image_file_path: str, mean: bool, rotate: int, encoded: bool) -> str:
+    """The cache key of the result of an image file, from the bytes of the file."""
+    with open(image_file_path, "rb") as image_file:
+        data = image_file.read()
+    # The extension is the encoding of the response of an encoded request.
+    extension = os.path.splitext(image_file_path)[-1].lower()
+    return make_data_cache_key(data, int(mean), rotate % 360, encoded, extension)
+
+
+def _write_responses(
+    responses: queue.Queue,
+    output_directory: str,
+    counts: dict,
+    written_file_paths: list,
+    cache: ResultCache or None = None,
+) -> None:
+    """The writer stage: write the responses put on `responses` until a None comes.
+
+    The images whose results it wrote are added to `written_file_paths`.
+    """
+    while True:
+        item = responses.get()
+        if item is None:
+            return
+        image_file_path, cache_key, response = item
+        # If the image was invalid or so, the server returns a Null image with exception in the message.
+        if response.width == 0:
+            LOG.error(f"The server failed on {image_file_path}: {response.data.decode('utf-8')}")
+            counts["failed"] += 1
+            continue
+        try:
+            # Hooray, we now write the image to the user's preferred location.
+            write_image_proto(response, get_output_path(output_directory, image_file_path))
+            if cache is not None and cache_key is not None:
+                cache.put(cache_key, response.SerializeToString())
+        except Exception as e:
+            LOG.error(f"Couldn't write the result of {image_file_path}: {format(e)}")
+            counts["failed"] += 1
+            continue
+        counts["written"] += 1
+        written_file_paths.append(image_file_path)
+
+
+def _put_for_writer(responses: queue.Queue, item: tuple or None, writer: threading.Thread) -> bool:
+    """Put `item` on the bounded `responses`, unless the writer stopped taking them.
+
+    Returns:
+        False if the writer stopped.
+
+    """
+    while writer.is_alive():
+        try:
+            responses.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _run_worker(
+    target: str,
+    work_queue: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    output_directory: str,
+    mean: bool,
+    rotate: int,
+    encoded: bool,
+    compression: str,
+    window: int,
+    cache_directory: str or None = None,
+) -> None:
+    """One worker process: stream the images of `work_queue` to the server until a None comes.
+
+    It puts its counts and the images whose results it wrote on `results` once done.
+    """
+    counts = {"written": 0, "failed": 0}
+    written_file_paths = []
+    read_failures = [0]
+    try:
+        channel = create_channel(target, compression=compression)
+        operations = get_pipeline_operations(mean=mean, rotate=rotate)
+        cache = None
+        if cache_directory is not None:
+            # Every image comes once, the responses only need to go to the directory. `run_load`
+            # trims it once the workers are done, rather than each of them to its own view of it.
+            cache = ResultCache(max_bytes=0, directory=cache_directory, max_directory_bytes=sys.maxsize)
+        image_file_paths = {}
+
+        def _read_requests():
+            for request_id, image_file_path, cache_key in iter(work_queue.get, None):
+                image_pb = read_image_proto(image_file_path, encoded=encoded)
+                if image_pb is None:
+                    read_failures[0] += 1
+                    continue
+                image_file_paths[request_id] = (image_file_path, cache_key)
+                yield request_id, NLImagePipelineRequest(operations=operations, image=image_pb)
+
+        # Bounded, so a slow disk holds back the stream rather than filling the memory.
+        responses = queue.Queue(maxsize=window)
+        writer = threading.Thread(
+            target=_write_responses, args=(responses, output_directory, counts, written_file_paths, cache),
+            daemon=True,
+        )
+        writer.start()
+        try:
+            for request_id, response in stream_requests_on_channel(
+                requests=_read_requests(), channel=channel, window=window, compression=compression
+            ):
+                if not _put_for_writer(responses, (*image_file_paths.pop(request_id), response), writer):
+                    raise RuntimeError("The writer thread stopped")
+        finally:
+            _put_for_writer(responses, None, writer)
+            writer.join()
+            channel.close()
+    except Exception as e:
+        LOG.error(f"A client worker stopped: {format(e)}")
+    finally:
+        counts["failed"] += read_failures[0]
+        results.put((counts, written_file_paths))
+
+
+def run_load(
+    input_directory: str,
+    output_directory: str,
+    target: str,
+    mean: bool,
+    rotate: int,
+    extensions: List[str],
+    workers: int = 4,
+    window: int = 16,
+    encoded: bool = False,
+    compression: str = "gzip",
+    cache_directory: str or None = None,
+    cache_directory_megabytes: int = 1024,
+) -> dict:
+    """Process every image of `input_directory` on the server and write the results.
+
+    Args:
+        input_directory: The folder of images.
+        output_directory: The folder to write the results to, as manipulated_<name of the input>.
+        target: The host and port of the server.
+        mean: Set to true if a mean filter needs to be applied on the images.
+        rotate: Anticlockwise rotation in degrees to rotate the images.
+        extensions: The file extensions of the images to process.
+        workers: Number of client processes, each with its own channel and stream.
+        window: Maximum number of images in flight on each stream.
+        encoded: Set to true to send the image files as they are and get the same format back.
+        compression: The compression policy of the requests.
+        cache_directory: Optional directory to keep the responses in. The images whose responses
+            are there aren't sent, nor the images that are the same as others of the folder.
+        cache_directory_megabytes: The size the cache directory is trimmed to.
+
+    Returns:
+        The number of images "written" and "failed".
+
+    Raises:
+        TimeoutError: If the server doesn't answer its health checks with SERVING in time.
+
+    """
+    image_file_paths = [
+        os.path.join(input_directory, filename) for filename in list_image_files(input_directory, extensions)
+    ]
+    counts = {"written": 0, "failed": 0}
+    # The images of each key that aren't sent, and get the output of the one that is.
+    duplicates = {}
+    # Spawn rather than fork, gRPC doesn't support forking once it has been used.
+    context = multiprocessing.get_context("spawn")
+    work_queue = context.Queue()
+    cache_directory_bytes = cache_directory_megabytes * MEGABYTE
+    cache = None
+    if cache_directory is not None:
+        cache = ResultCache(
+            max_bytes=0, directory=cache_directory, max_directory_bytes=cache_directory_bytes
+        )
+    sent = 0
+    for request_id, image_file_path in enumerate(image_file_paths):
+        cache_key = None
+        if cache is not None:
+            try:
+                cache_key = _make_file_cache_key(image_file_path, mean, rotate, encoded)
+            except OSError as e:
+                LOG.error(f"Couldn't read {image_file_path}: {format(e)}")
+                counts["failed"] += 1
+                continue
+            if cache_key in duplicates:
+                duplicates[cache_key].append(image_file_path)
+                continue
+            cached_response = cache.get(cache_key)
+            if cached_response is not None:
+                try:
+                    write_image_proto(
+                        NLImage.FromString(cached_response), get_output_path(output_directory, image_file_path)
+                    )
+                except Exception as e:
+                    LOG.error(f"Couldn't write the result of {image_file_path}: {format(e)}")
+                    counts["failed"] += 1
+                    continue
+                counts["written"] += 1
+                # The same images further on are written from the cache too.
+                continue
+            duplicates[cache_key] = [image_file_path]
+        work_queue.put((request_id, image_file_path, cache_key))
+        sent += 1
+    for _ in range(workers):
+        work_queue.put(None)
+
+    # Rather than timing the first requests on kernels that are still compiling.
+    wait_until_serving(target, timeout=SERVER_READY_TIMEOUT_SECONDS)
+    results = context.Queue()
+    worker_processes = [
+        context.Process(
+            target=_run_worker,
+            args=(
+                target, work_queue, results, output_directory, mean, rotate, encoded, compression,
+                window, cache_directory,
+            ),
+        )
+        for _ in range(workers)
+    ]
+    for worker_process in worker_processes:
+        worker_process.start()
+    worker_results = []
+    while len(worker_results) < len(worker_processes):
+        # Checked before waiting, as what the exited workers put is already in the queue.
+        exited = all(worker_process.exitcode is not None for worker_process in worker_processes)
+        try:
+            worker_results.append(results.get(timeout=1.0))
+        except queue.Empty:
+            if exited:
+                LOG.error(f"{len(worker_processes) - len(worker_results)} client workers died")
+                break
+    for worker_process in worker_processes:
+        worker_process.join()
+    accounted = 0
+    # Rather than the outputs on disk, which may be left from an earlier run.
+    written_file_paths = set()
+    for worker_count, worker_written_file_paths in worker_results:
+        for key, value in worker_count.items():
+            counts[key] += value
+            accounted += value
+        written_file_paths.update(worker_written_file_paths)
+    # The images of the workers that died.
+    counts["failed"] += max(0, sent - accounted)
+    if cache is not None:
+        # With the responses of the workers in.
+        cache.trim()
+
+    for sent_file_path, *same_file_paths in duplicates.values():
+        sent_output_path = get_output_path(output_directory, sent_file_path)
+        for image_file_path in same_file_paths:
+            if sent_file_path not in written_file_paths:
+                # The image failed, and so do the same ones.
+                counts["failed"] += 1
+                continue
+            try:
+                shutil.copyfile(sent_output_path, get_output_path(output_directory, image_file_path))
+            except OSError as e:
+                LOG.error(f"Couldn't write the result of {image_file_path}: {format(e)}")
+                counts["failed"] += 1
+                continue
+            counts["written"] += 1
+    return counts
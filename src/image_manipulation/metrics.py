@@ -0,0 +1,468 @@
+"""Count and time what the server does, and serve it in the Prometheus text format.
+
+The metrics are plain counters, gauges and histograms kept in the memory of each server process,
+each behind its own lock, so recording one costs a few microseconds and they can stay on. An
+interceptor records the calls: their duration, how many are in flight, the bytes of their messages
+and the exceptions they raise. The service records the time its stages take, decoding the image,
+computing and encoding the result, and the errors it answers with a Null image.
+
+Every server process serves its metrics over HTTP at /metrics, and as json at /metrics.json. The
+process that spawned them serves the sum of theirs, so one scrape covers the whole server.
+"""
+import bisect
+import http.server
+import inspect
+import json
+import logging
+import threading
+import time
+import urllib.request
+from concurrent import futures
+from typing import Callable, Dict, Iterable, List
+
+import grpc
+
+
+LOG = logging.getLogger(__name__)
+
+# Upper bounds of the buckets of the duration histograms, in seconds.
+DURATION_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0,
+)
+TEXT_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Metric:
+    """The values of a metric, one per combination of the values of its labels."""
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[label_name]) for label_name in self.label_names)
+
+    def _samples(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def snapshot(self) -> dict:
+        """The values of the metric, in a form json can hold."""
+        return {
+            "type": self.kind,
+            "help": self.documentation,
+            "labels": list(self.label_names),
+            "samples": self._samples(),
+        }
+
+
+class Counter(_Metric):
+    """A total that only goes up."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, set directly or read from a function when collected."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._functions = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        """Read the value of `labels` from `function` whenever the metrics are collected."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def _samples(self) -> list:
+        samples = super()._samples()
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                samples.append([list(key), float(function())])
+            except Exception as e:
+                LOG.debug(f"Couldn't read the gauge {self.name}{key}: {format(e)}")
+        return samples
+
+
+class _Timer:
+    """Observe the seconds spent in a with block."""
+
+    def __init__(self, histogram: "Histogram", labels: dict):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+
+class Histogram(_Metric):
+    """Counts of the observed values per bucket, with their sum.
+
+    Args:
+        buckets: The upper bounds of the buckets, increasing. The last bucket, of everything, is added.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Iterable[str] = (),
+        buckets: Iterable[float] = DURATION_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            values["counts"][bucket] += 1
+            values["sum"] += value
+
+    def time(self, **labels) -> _Timer:
+        """A context manager observing the seconds its block takes."""
+        return _Timer(self, labels)
+
+    def _samples(self) -> list:
+        with self._lock:
+            return [
+                [list(key), {"counts": list(values["counts"]), "sum": values["sum"]}]
+                for key, values in self._values.items()
+            ]
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        return snapshot
+
+
+class Registry:
+    """The metrics of a process."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict[str, dict]:
+        """The values of all the metrics, by name."""
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+
+REGISTRY = Registry()
+
+RPC_SECONDS = REGISTRY.register(Histogram(
+    "image_service_rpc_duration_seconds", "Duration of the calls.", ["method"]
+))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "image_service_stage_duration_seconds",
+    "Duration of the stages of the image operations: decode, compute and encode.",
+    ["stage"],
+))
+RPCS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "image_service_rpcs_in_flight", "Calls being answered.", ["method"]
+))
+RECEIVED_BYTES = REGISTRY.register(Counter(
+    "image_service_received_bytes_total", "Bytes of the request messages.", ["method"]
+))
+SENT_BYTES = REGISTRY.register(Counter(
+    "image_service_sent_bytes_total", "Bytes of the response messages.", ["method"]
+))
+ERRORS = REGISTRY.register(Counter(
+    "image_service_errors_total", "Calls that failed, by exception type.", ["method", "type"]
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "image_service_queue_depth", "Jobs waiting for a worker of a pool.", ["queue"]
+))
+
+
+def get_executor_queue_depth(executor: futures.Executor) -> int:
+    """The number of jobs submitted to `executor` that no worker has taken yet."""
+    if isinstance(executor, futures.ProcessPoolExecutor):
+        # The process pool moves the jobs to its call queue as soon as a worker may take them.
+        return max(0, len(executor._pending_work_items) - executor._max_workers)
+    return executor._work_queue.qsize()
+
+
+def merge_snapshots(snapshots: Iterable[Dict[str, dict]]) -> Dict[str, dict]:
+    """The sum of the snapshots of several processes."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if name not in merged:
+                merged[name] = dict(metric, samples={})
+            samples = merged[name]["samples"]
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                if metric["type"] != "histogram":
+                    samples[key] = samples.get(key, 0.0) + value
+                elif key not in samples:
+                    samples[key] = {"counts": list(value["counts"]), "sum": value["sum"]}
+                else:
+                    samples[key]["counts"] = [a + b for a, b in zip(samples[key]["counts"], value["counts"])]
+                    samples[key]["sum"] += value["sum"]
+    for metric in merged.values():
+        metric["samples"] = [[list(key), value] for key, value in metric["samples"].items()]
+    return merged
+
+
+def _format_labels(label_names: List[str], label_values: List[str], **extra_labels) -> str:
+    pairs = list(zip(label_names, label_values)) + list(extra_labels.items())
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def render(snapshot: Dict[str, dict]) -> str:
+    """A snapshot in the Prometheus text format."""
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        label_names = metric["labels"]
+        for label_values, value in metric["samples"]:
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(label_names, label_values)} {value}")
+                continue
+            count = 0
+            for upper_bound, bucket_count in zip(metric["buckets"] + ["+Inf"], value["counts"]):
+                count += bucket_count
+                labels = _format_labels(label_names, label_values, le=upper_bound)
+                lines.append(f"{name}_bucket{labels} {count}")
+            lines.append(f"{name}_sum{_format_labels(label_names, label_values)} {value['sum']}")
+            lines.append(f"{name}_count{_format_labels(label_names, label_values)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def fetch_snapshot(url: str, timeout: float = 1.0) -> Dict[str, dict]:
+    """The snapshot served at `url`, the /metrics.json of a server process."""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def collect_from(urls: List[str]) -> Dict[str, dict]:
+    """The sum of the snapshots served at `urls`, leaving out the processes that don't answer."""
+    snapshots = []
+    for url in urls:
+        try:
+            snapshots.append(fetch_snapshot(url))
+        except (OSError, ValueError) as e:
+            LOG.debug(f"Couldn't collect the metrics of {url}: {format(e)}")
+    return merge_snapshots(snapshots)
+
+
+def start_metrics_server(
+    host: str, port: int, collect: Callable[[], Dict[str, dict]] = REGISTRY.snapshot
+) -> http.server.ThreadingHTTPServer:
+    """Serve the metrics `collect` returns at /metrics and /metrics.json, from a daemon thread.
+
+    Returns:
+        The HTTP server, to shut it down.
+
+    """
+
+    class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/metrics":
+                body = render(collect()).encode("utf-8")
+                content_type = TEXT_CONTENT_TYPE
+            elif path == "/metrics.json":
+                body = json.dumps(collect()).encode("utf-8")
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Not a line per scrape.
+            pass
+
+    metrics_server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    metrics_server.daemon_threads = True
+    threading.Thread(target=metrics_server.serve_forever, daemon=True).start()
+    LOG.info(f"Serving the metrics at http://{host}:{metrics_server.server_address[1]}/metrics")
+    return metrics_server
+
+
+def _get_method_name(handler_call_details: grpc.HandlerCallDetails) -> str:
+    return handler_call_details.method.rsplit("/", 1)[-1]
+
+
+class _CallRecord:
+    """Records a call of `method`, from its start until `finish`."""
+
+    def __init__(self, method: str):
+        self.method = method
+        self._start = time.perf_counter()
+        RPCS_IN_FLIGHT.inc(method=method)
+
+    def received(self, message) -> None:
+        RECEIVED_BYTES.inc(message.ByteSize(), method=self.method)
+
+    def sent(self, message) -> None:
+        SENT_BYTES.inc(message.ByteSize(), method=self.method)
+
+    def failed(self, error: BaseException) -> None:
+        ERRORS.inc(method=self.method, type=type(error).__name__)
+
+    def finish(self) -> None:
+        RPCS_IN_FLIGHT.dec(method=self.method)
+        RPC_SECONDS.observe(time.perf_counter() - self._start, method=self.method)
+
+
+def _record_requests(record: _CallRecord, request_iterator):
+    for request in request_iterator:
+        record.received(request)
+        yield request
+
+
+async def _record_requests_async(record: _CallRecord, request_iterator):
+    async for request in request_iterator:
+        record.received(request)
+        yield request
+
+
+def _instrument_behavior(behavior: Callable, method: str, request_streaming: bool, response_streaming: bool):
+    """Wrap the function answering the calls of `method` so that it records them."""
+    asynchronous = inspect.iscoroutinefunction(behavior) or inspect.isasyncgenfunction(behavior)
+
+    def _start(request_or_iterator):
+        record = _CallRecord(method)
+        if not request_streaming:
+            record.received(request_or_iterator)
+        elif asynchronous:
+            request_or_iterator = _record_requests_async(record, request_or_iterator)
+        else:
+            request_or_iterator = _record_requests(record, request_or_iterator)
+        return record, request_or_iterator
+
+    if asynchronous and response_streaming:
+        async def _instrumented(request_or_iterator, context):
+            record, request_or_iterator = _start(request_or_iterator)
+            try:
+                async for response in behavior(request_or_iterator, context):
+                    record.sent(response)
+                    yield response
+            except BaseException as e:
+                record.failed(e)
+                raise
+            finally:
+                record.finish()
+    elif asynchronous:
+        async def _instrumented(request_or_iterator, context):
+            record, request_or_iterator = _start(request_or_iterator)
+            try:
+                response = await behavior(request_or_iterator, context)
+                record.sent(response)
+                return response
+            except BaseException as e:
+                record.failed(e)
+                raise
+            finally:
+                record.finish()
+    elif response_streaming:
+        def _instrumented(request_or_iterator, context):
+            record, request_or_iterator = _start(request_or_iterator)
+            try:
+                for response in behavior(request_or_iterator, context):
+                    record.sent(response)
+                    yield response
+            except BaseException as e:
+                record.failed(e)
+                raise
+            finally:
+                record.finish()
+    else:
+        def _instrumented(request_or_iterator, context):
+            record, request_or_iterator = _start(request_or_iterator)
+            try:
+                response = behavior(request_or_iterator, context)
+                record.sent(response)
+                return response
+            except BaseException as e:
+                record.failed(e)
+                raise
+            finally:
+                record.finish()
+    return _instrumented
+
+
+def _instrument_handler(handler: grpc.RpcMethodHandler or None, method: str) -> grpc.RpcMethodHandler or None:
+    if handler is None:
+        return None
+    kind = {
+        (False, False): "unary_unary",
+        (False, True): "unary_stream",
+        (True, False): "stream_unary",
+        (True, True): "stream_stream",
+    }[(handler.request_streaming, handler.response_streaming)]
+    behavior = _instrument_behavior(
+        getattr(handler, kind), method, handler.request_streaming, handler.response_streaming
+    )
+    return handler._replace(**{kind: behavior})
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """Record the duration, the messages and the exceptions of the calls of a threaded server."""
+
+    def intercept_service(self, continuation, handler_call_details):
+        return _instrument_handler(continuation(handler_call_details), _get_method_name(handler_call_details))
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """Record the duration, the messages and the exceptions of the calls of a `grpc.aio` server."""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        return _instrument_handler(
+            await continuation(handler_call_details), _get_method_name(handler_call_details)
+        )
@@ -0,0 +1,155 @@
+"""Profile a live server process by sampling the stacks of its threads.
+
+A thread of the process looks at the Python stack of every other thread a couple of hundred times
+a second, and counts how often each stack comes up. The counts are written in the collapsed stack
+format, one "outermost;...;innermost count" line per stack, which flamegraph.pl, speedscope and
+most flame graph viewers read.
+
+The servers start a capture of a few seconds when they get SIGUSR2, and pass the signal on to their
+own server or compute processes, so signalling the process `spawn_server` runs profiles all of them
+at once, each writing its own file. The stacks of threads waiting for work are left out, and so is
+the time spent in C without the Python frame changing, e.g. inside a Numba kernel, which shows up
+as the Python function calling it.
+"""
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable
+
+
+LOG = logging.getLogger(__name__)
+
+PROFILE_SIGNAL = signal.SIGUSR2
+# The innermost frames of the threads that wait for work, by file name and function.
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("_server.py", "_serve"),
+    ("communication_utils.py", "_wait_forever"),
+    # The capture itself, sleeping while the samples are taken.
+    ("profiling.py", "profile"),
+}
+
+
+def _get_frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Count the stacks of the threads of this process, sampled from a thread of its own.
+
+    Args:
+        interval: Seconds between two samples.
+        include_idle: Set to true to keep the stacks of the threads waiting for work.
+    """
+
+    def __init__(self, interval: float = 0.005, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.counts = collections.Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _is_idle(self, frame) -> bool:
+        return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+    def sample(self) -> None:
+        """Count the current stack of every other thread."""
+        own_thread = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread or (not self.include_idle and self._is_idle(frame)):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_get_frame_name(frame))
+                frame = frame.f_back
+            self.counts[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> collections.Counter:
+        """Stop sampling, and return the number of samples of each stack."""
+        self._stopped.set()
+        self._thread.join()
+        return self.counts
+
+
+def write_collapsed_stacks(counts: Dict[str, int], path: str) -> None:
+    """Write stack counts in the collapsed stack format, the most frequent first."""
+    with open(path, "w") as collapsed_file:
+        for stack, count in counts.most_common():
+            collapsed_file.write(f"{stack} {count}\n")
+
+
+def profile(seconds: float, directory: str, interval: float = 0.005) -> str:
+    """Sample this process for `seconds` and write the stacks to a file of `directory`.
+
+    Returns:
+        The path of the file, named after the process id and the time the capture started.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory, f"profile_{os.getpid()}_{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+    )
+    profiler = SamplingProfiler(interval=interval)
+    profiler.start()
+    time.sleep(seconds)
+    counts = profiler.stop()
+    write_collapsed_stacks(counts, path)
+    LOG.info(f"Wrote {sum(counts.values())} stacks of {profiler.samples} samples to {path}")
+    return path
+
+
+def install_profile_signal_handler(
+    directory: str,
+    seconds: float = 10.0,
+    child_process_ids: Callable[[], Iterable[int]] = tuple,
+) -> None:
+    """Profile this process for `seconds` whenever it gets `PROFILE_SIGNAL`.
+
+    A signal coming during a capture is ignored. Call it from the main thread.
+
+    Args:
+        directory: The directory to write the stacks to.
+        seconds: How long each capture lasts.
+        child_process_ids: Returns the processes to pass the signal on to.
+    """
+    capturing = threading.Lock()
+
+    def _capture() -> None:
+        try:
+            profile(seconds, directory)
+        except Exception as e:
+            LOG.error(f"The profile of process {os.getpid()} failed: {format(e)}")
+        finally:
+            capturing.release()
+
+    def _handle_signal(signum, frame) -> None:
+        for process_id in child_process_ids():
+            try:
+                os.kill(process_id, PROFILE_SIGNAL)
+            except OSError:
+                # It exited in the meantime.
+                pass
+        if capturing.acquire(blocking=False):
+            # Not in the handler, which holds up the main thread.
+            threading.Thread(target=_capture, name="profile-capture", daemon=True).start()
+
+    signal.signal(PROFILE_SIGNAL, _handle_signal)
@@ -0,0 +1,75 @@
+import grpc
+import pytest
+
+from image_manipulation import balancing
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_parse_and_read_endpoints(tmp_path):
+    assert balancing.parse_endpoints("a:1, b:2,") == ["a:1", "b:2"]
+    endpoints_path = tmp_path / "endpoints.txt"
+    endpoints_path.write_text("# The servers\na:1\n\nb:2  # The new one\n")
+    assert balancing.read_endpoints_file(str(endpoints_path)) == ["a:1", "b:2"]
+
+
+def test_least_outstanding():
+    balancer = balancing.EndpointBalancer(["a", "b", "c"], policy="least_outstanding")
+    picks = [balancer.pick() for _ in range(3)]
+    assert sorted(picks) == [0, 1, 2]
+    balancer.finish(1, 0.01, grpc.StatusCode.OK)
+    assert balancer.pick() == 1
+    with pytest.raises(ValueError):
+        balancing.EndpointBalancer(["a"], policy="random")
+
+
+def test_power_of_two_prefers_the_less_loaded():
+    balancer = balancing.EndpointBalancer(["a", "b"], policy="power_of_two")
+    # With two servers, both are the choices every time, so the one with fewer calls gets the next.
+    for _ in range(10):
+        balancer.pick()
+    assert [stats["outstanding"] for stats in balancer.stats()] == [5, 5]
+
+
+def test_ejection_on_failures():
+    clock = _Clock()
+    balancer = balancing.EndpointBalancer(["a", "b", "c", "d"], policy="round_robin", ejection_seconds=10.0, clock=clock)
+    for _ in range(balancing.FAILURES_TO_EJECT):
+        balancer.finish(0, 0.01, grpc.StatusCode.UNAVAILABLE)
+    assert [stats["ejected"] for stats in balancer.stats()] == [True, False, False, False]
+    assert 0 not in [balancer.pick() for _ in range(6)]
+    # At most half of the servers are ejected.
+    for index in [1, 2]:
+        for _ in range(balancing.FAILURES_TO_EJECT):
+            balancer.finish(index, 0.01, grpc.StatusCode.UNAVAILABLE)
+    assert [stats["ejected"] for stats in balancer.stats()] == [True, True, False, False]
+    # Failures of the caller don't count.
+    for _ in range(balancing.FAILURES_TO_EJECT):
+        balancer.finish(3, 0.01, grpc.StatusCode.INVALID_ARGUMENT)
+    clock.now = 10.0
+    assert [stats["ejected"] for stats in balancer.stats()] == [False] * 4
+
+
+def test_ejection_on_latency():
+    clock = _Clock()
+    balancer = balancing.EndpointBalancer(["a", "b", "c"], clock=clock)
+    for _ in range(balancing.MINIMUM_CALLS_TO_JUDGE_LATENCY):
+        for index, seconds in enumerate([0.01, 0.012, 0.1]):
+            balancer.finish(index, seconds, grpc.StatusCode.OK)
+    assert [stats["ejected"] for stats in balancer.stats()] == [False, False, True]
+
+
+def test_health_checks():
+    balancer = balancing.EndpointBalancer(["a", "b"], policy="round_robin")
+    balancer.set_serving(0, False)
+    assert {balancer.pick() for _ in range(4)} == {1}
+    # Rather than failing, the calls go to all the servers when none is serving.
+    balancer.set_serving(1, False)
+    assert {balancer.pick() for _ in range(4)} == {0, 1}
+
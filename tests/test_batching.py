@@ -0,0 +1,49 @@
+from concurrent import futures
+import threading
+
+import pytest
+
+from image_manipulation.batching import MicroBatcher
+
+
+def test_concurrent_requests_are_batched():
+    batches = []
+    started = threading.Barrier(6)
+
+    def _run_batch(key, items):
+        batches.append((key, sorted(items)))
+        return [key * item for item in items]
+
+    # A long window, the batches are closed by their size.
+    batcher = MicroBatcher(_run_batch, window=10.0, max_batch_size=3)
+
+    def _run(key, item):
+        started.wait()
+        return batcher.run(key, item)
+
+    with futures.ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(_run, [1, 1, 1, 10, 10, 10], [1, 2, 3, 4, 5, 6]))
+
+    assert results == [1, 2, 3, 40, 50, 60]
+    assert sorted(batches) == [(1, [1, 2, 3]), (10, [4, 5, 6])]
+
+
+def test_window_closes_batches():
+    batcher = MicroBatcher(lambda key, items: [len(items)] * len(items), window=0.001)
+    # Nobody else comes, the request runs alone once the window is over.
+    assert batcher.run("mean", None) == 1
+
+
+def test_errors_reach_every_request_of_the_batch():
+    def _run_batch(key, items):
+        raise ValueError("bad batch")
+
+    batcher = MicroBatcher(_run_batch, window=10.0, max_batch_size=2)
+    with futures.ThreadPoolExecutor(max_workers=2) as executor:
+        calls = [executor.submit(batcher.run, "mean", item) for item in range(2)]
+        for call in calls:
+            with pytest.raises(ValueError):
+                call.result()
+
+    with pytest.raises(ValueError):
+        MicroBatcher(_run_batch, max_batch_size=0)
@@ -0,0 +1,59 @@
+from concurrent import futures
+import csv
+import json
+
+import grpc
+import pytest
+
+from image_manipulation import benchmark
+from image_manipulation.communication_utils import ImageService
+from image_manipulation.image_pb2_grpc import add_NLImageServiceServicer_to_server
+
+
+def test_scenarios(tmp_path):
+    scenario_path = tmp_path / "scenarios.json"
+    scenario_path.write_text(json.dumps([{"name": "small", "concurrency": 2}, {"requests": 10}]))
+    scenarios = benchmark.load_scenarios(str(scenario_path))
+    assert scenarios[0]["concurrency"] == 2
+    assert scenarios[0]["image_sizes"] == benchmark.DEFAULT_SCENARIO["image_sizes"]
+    assert scenarios[1]["requests"] == 10
+    with pytest.raises(ValueError):
+        benchmark.make_scenario(concurency=2)
+
+
+def test_summarise_and_report(tmp_path):
+    # (start, end, latency, bytes, succeeded) of 100 requests over 9.9 seconds, one of them failed.
+    records = [(index * 0.1, index * 0.1 + 0.1, (index + 1) / 1000.0, 1000000, True) for index in range(99)]
+    records.append((5.0, 5.1, 0.1, 0, False))
+    summary = benchmark.summarise(records, benchmark.make_scenario(name="fake"), label="test")
+    assert summary["requests"] == 99
+    assert summary["errors"] == 1
+    assert summary["requests_per_s"] == pytest.approx(10.0)
+    assert summary["megabytes_per_s"] == pytest.approx(10.0)
+    assert summary["latency_p50_ms"] == pytest.approx(50.0)
+    assert summary["latency_max_ms"] == pytest.approx(99.0)
+    assert "p99.9" in benchmark.format_summary(summary)
+
+    report_path = str(tmp_path / "report.csv")
+    benchmark.write_report([summary], report_path)
+    benchmark.write_report([dict(summary, label="other")], report_path)
+    with open(report_path) as report_file:
+        assert [row["label"] for row in csv.DictReader(report_file)] == ["test", "other"]
+
+
+def test_run_benchmark():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    add_NLImageServiceServicer_to_server(ImageService(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        scenario = benchmark.make_scenario(
+            image_sizes=["64x48"], concurrency=3, processes=2, requests=21, warmup=0.1
+        )
+        summary = benchmark.run_benchmark(f"localhost:{port}", scenario, label="in-process")
+    finally:
+        server.stop(None)
+    # One process runs two threads, the other one.
+    assert summary["requests"] == 21
+    assert summary["errors"] == 0
+    assert summary["latency_p50_ms"] <= summary["latency_p99_ms"]
@@ -0,0 +1,126 @@
+from concurrent import futures
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from image_manipulation.cache import (
+    CACHE_FILE_EXTENSION,
+    ResultCache,
+    SingleFlight,
+    make_cache_key,
+    make_image_cache_key,
+)
+from image_manipulation.image_pb2 import NLImage
+from image_manipulation.image_utils import convert_image_to_proto
+
+
+def test_cache_key():
+    image_pb = convert_image_to_proto(np.arange(24, dtype=np.uint8).reshape(2, 4, 3))
+    key = make_cache_key(image_pb, 1, 90)
+    assert make_cache_key(convert_image_to_proto(np.arange(24, dtype=np.uint8).reshape(2, 4, 3)), 1, 90) == key
+    # A full turn is no rotation.
+    assert make_cache_key(image_pb, 1, 450) == key
+
+    assert make_cache_key(image_pb, 0, 90) != key
+    assert make_cache_key(image_pb, 1, 180) != key
+    # The same bytes as another shape, or asked back in another encoding, are another request.
+    assert make_cache_key(convert_image_to_proto(np.arange(24, dtype=np.uint8).reshape(4, 6)), 1, 90) != key
+    image_pb.response_encoding = NLImage.PNG
+    assert make_cache_key(image_pb, 1, 90) != key
+
+    # Without making the message first.
+    image = np.arange(48, dtype=np.uint8).reshape(4, 4, 3)
+    assert make_image_cache_key(image[:, ::2], 1, 0) == make_cache_key(convert_image_to_proto(image[:, ::2]), 1, 0)
+
+
+def test_least_recently_used_are_evicted():
+    cache = ResultCache(max_bytes=30)
+    cache.put("a", bytes(10))
+    cache.put("b", bytes(10))
+    cache.put("c", bytes(10))
+    assert cache.get("a") == bytes(10)
+    cache.put("d", bytes(10))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    # Responses larger than the whole budget aren't kept.
+    cache.put("e", bytes(31))
+    assert cache.get("e") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (2, 2, 1)
+    assert (stats["entries"], stats["bytes"]) == (3, 30)
+
+
+def test_evicted_responses_spill_to_the_directory(tmpdir):
+    directory = str(tmpdir)
+    cache = ResultCache(max_bytes=10, directory=directory, max_directory_bytes=20)
+    for key in ["a", "b", "c", "d"]:
+        cache.put(key, key.encode("utf-8") * 10)
+    # d is in memory, b and c on disk, and a went over the disk budget.
+    assert sorted(os.listdir(directory)) == ["b" + CACHE_FILE_EXTENSION, "c" + CACHE_FILE_EXTENSION]
+    assert cache.get("a") is None
+    assert (cache.stats()["disk_evictions"], cache.stats()["files"]) == (1, 2)
+    assert cache.get("b") == b"b" * 10
+    assert cache.stats()["disk_hits"] == 1
+
+    # A new server picks up the files of the previous one.
+    assert ResultCache(max_bytes=10, directory=directory, max_directory_bytes=20).get("b") == b"b" * 10
+
+
+def test_trim(tmpdir):
+    directory = str(tmpdir)
+    cache = ResultCache(max_bytes=0, directory=directory, max_directory_bytes=20)
+    cache.put("a", b"a" * 10)
+    # Another process writing to the directory within a budget of its own.
+    other_cache = ResultCache(max_bytes=0, directory=directory, max_directory_bytes=100)
+    for key in ["b", "c"]:
+        other_cache.put(key, key.encode("utf-8") * 10)
+    os.utime(os.path.join(directory, "a" + CACHE_FILE_EXTENSION), (0, 0))
+    assert len(os.listdir(directory)) == 3
+
+    cache.trim()
+    assert sorted(os.listdir(directory)) == ["b" + CACHE_FILE_EXTENSION, "c" + CACHE_FILE_EXTENSION]
+    assert (cache.stats()["files"], cache.stats()["directory_bytes"]) == (2, 20)
+
+
+def test_single_flight():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def _call():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "response"
+
+    with futures.ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(single_flight.run, "a", _call)
+        started.wait(5)
+        followers = [executor.submit(single_flight.run, "a", _call) for _ in range(3)]
+        other_key = executor.submit(single_flight.run, "b", lambda: "other")
+        assert other_key.result(5) == "other"
+        release.set()
+        assert [call.result(5) for call in [leader] + followers] == ["response"] * 4
+    assert calls == [1]
+
+    # Once done, the key runs again, and errors reach the callers.
+    with pytest.raises(ValueError):
+        single_flight.run("a", lambda: int("not a number"))
+    assert single_flight.run("a", lambda: "again") == "again"
+
+
+def test_get_or_run(tmpdir):
+    cache = ResultCache(max_bytes=0, directory=str(tmpdir), max_directory_bytes=100)
+    assert cache.get_or_run("a", lambda: b"response") == b"response"
+    # Too large for the memory, it went to the directory.
+    assert os.listdir(str(tmpdir)) == ["a" + CACHE_FILE_EXTENSION]
+    assert cache.get_or_run("a", lambda: b"not run") == b"response"
+
+    with pytest.raises(ValueError):
+        cache.get_or_run("b", lambda: int("not a number"))
+    assert cache.get("b") is None
@@ -1,12 +1,54 @@
+import asyncio
+import contextlib
+import multiprocessing
 import os
+import signal
+import socket
+import threading
+import time
 
+from concurrent import futures
 from copy import copy
 import cv2
+import grpc
+from grpc_health.v1 import health_pb2, health_pb2_grpc
 from mock import Mock
 import numpy as np
+import pytest
 
-from image_manipulation.communication_utils import ImageService
+from image_manipulation.health_checks import wait_until_serving
+from image_manipulation.communication_utils import (
+    AsyncImageService,
+    ImageService,
+    _SharedMemoryRing,
+    _Supervisor,
+    _run_worker,
+    _run_asyncio_server_one_process,
+    _run_servers_one_process,
+    create_channel,
+    get_pipeline_operations,
+    run_one_proto_request_on_channel,
+    run_one_request_on_channel,
+    run_strip_request_on_channel,
+    spawn_server,
+    stream_requests_on_channel,
+    stream_strips_on_channel,
+)
+from image_manipulation.image_pb2 import (
+    NLImage,
+    NLImageOperation,
+    NLImagePipelineRequest,
+    NLImageRotateRequest,
+    NLImageStreamRequest,
+    NLMeanFilterOperation,
+)
+from image_manipulation.image_pb2_grpc import (
+    add_NLImageServiceServicer_to_server,
+    NLImageServiceServicer,
+    NLImageServiceStub,
+)
 from image_manipulation import image_utils
+from image_manipulation.cache import ResultCache
 
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -28,3 +70,585 @@ def test_service_object():
     invalid_pb_image.width = 80
     op_pb = service_object.MeanFilter(invalid_pb_image, context=Mock())
     assert op_pb.width == 0
+
+
+def test_service_object_batches_mean_filters():
+    service_object = ImageService(batch_window=10.0, max_batch_size=4)
+    random_state = np.random.RandomState(0)
+    input_images = [random_state.randint(0, 256, (8, 6, 3)).astype(np.uint8) for _ in range(4)]
+    # The four concurrent calls are filtered in one batch.
+    with futures.ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(executor.map(
+            lambda image: service_object.MeanFilter(image_utils.convert_image_to_proto(image), Mock()),
+            input_images,
+        ))
+    for input_image, response in zip(input_images, responses):
+        output_image = image_utils.convert_proto_to_image(response)
+        assert np.array_equal(output_image, image_utils.get_mean_image(input_image))
+
+
+def test_asyncio_server_refuses_batching():
+    with pytest.raises(ValueError):
+        spawn_server(asyncio_server=True, batch_window_ms=2)
+
+
+def test_service_object_cache():
+    cache = ResultCache(max_bytes=1024 * 1024)
+    service_object = ImageService(cache=cache)
+    input_image = np.random.RandomState(0).randint(0, 256, (8, 6, 3)).astype(np.uint8)
+    image_pb = image_utils.convert_image_to_proto(input_image)
+
+    first_response = service_object.MeanFilter(image_pb, Mock())
+    assert cache.stats()["misses"] == 1
+    # A pipeline of the same mean filter is the same request.
+    pipeline_response = service_object.Process(
+        NLImagePipelineRequest(operations=get_pipeline_operations(mean=True, rotate=0), image=image_pb),
+        Mock(),
+    )
+    assert cache.stats()["hits"] == 1
+    assert pipeline_response == first_response
+
+    service_object.RotateImage(NLImageRotateRequest(rotation=1, image=image_pb), Mock())
+    assert cache.stats()["misses"] == 2
+
+    # Errors aren't cached.
+    invalid_image_pb = copy(image_pb)
+    invalid_image_pb.width = 5
+    for _ in range(2):
+        assert service_object.MeanFilter(invalid_image_pb, Mock()).width == 0
+    assert cache.stats()["entries"] == 2
+
+
+def test_service_object_auto_compression():
+    service_object = ImageService(compression="auto")
+    flat_image = np.full((256, 256, 3), 7, dtype=np.uint8)
+    context = Mock()
+    op_pb = service_object.RotateImage(
+        NLImageRotateRequest(rotation=1, image=image_utils.convert_image_to_proto(flat_image)),
+        context=context,
+    )
+    assert op_pb.width == 256
+    context.set_compression.assert_called_once_with(grpc.Compression.Gzip)
+
+
+def test_service_object_encoded_images():
+    service_object = ImageService()
+    input_image = cv2.imread(os.path.join(dir_path, "testing_data/image.png"))
+    image_pb = image_utils.convert_image_to_proto(input_image, encoding=NLImage.PNG)
+    image_pb.response_encoding = NLImage.PNG
+
+    op_pb = service_object.MeanFilter(image_pb, context=Mock())
+    assert op_pb.encoding == NLImage.PNG
+    assert np.array_equal(
+        image_utils.convert_proto_to_image(op_pb), image_utils.get_mean_image(input_image)
+    )
+
+    # Data that doesn't decode is reported like any other invalid image.
+    image_pb.data = image_pb.data[:100]
+    op_pb = service_object.MeanFilter(image_pb, context=Mock())
+    assert op_pb.width == 0
+
+
+def test_service_object_pipeline():
+    service_object = ImageService()
+    input_image = cv2.imread(os.path.join(dir_path, "testing_data/image.png"))
+    operations = [
+        NLImageOperation(rotation=NLImageRotateRequest.NINETY_DEG),
+        NLImageOperation(mean_filter=NLMeanFilterOperation()),
+        NLImageOperation(rotation=NLImageRotateRequest.ONE_EIGHTY_DEG),
+    ]
+    op_pb = service_object.Process(
+        NLImagePipelineRequest(
+            operations=operations, image=image_utils.convert_image_to_proto(input_image)
+        ),
+        context=Mock(),
+    )
+    expected_image = image_utils.get_rotated_image(input_image, 90)
+    expected_image = image_utils.get_mean_image(expected_image)
+    expected_image = image_utils.get_rotated_image(expected_image, 180)
+    assert np.array_equal(image_utils.convert_proto_to_image(op_pb), expected_image)
+
+    # An operation with nothing set is invalid.
+    op_pb = service_object.Process(
+        NLImagePipelineRequest(
+            operations=[NLImageOperation()], image=image_utils.convert_image_to_proto(input_image)
+        ),
+        context=Mock(),
+    )
+    assert op_pb.width == 0
+
+
+class _ServiceWithoutPipeline(ImageService):
+    """A server from before the Process call was added."""
+    Process = NLImageServiceServicer.Process
+
+
+@pytest.mark.parametrize("service_class", [ImageService, _ServiceWithoutPipeline])
+def test_mean_and_rotate_on_channel(service_class):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    add_NLImageServiceServicer_to_server(service_class(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        input_image = cv2.imread(os.path.join(dir_path, "testing_data/image.png"))
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            output_image = run_one_request_on_channel(
+                mean=True, rotate=270, channel=channel, input_image=input_image
+            )
+        expected_image = image_utils.get_rotated_image(image_utils.get_mean_image(input_image), 270)
+        assert np.array_equal(output_image, expected_image)
+    finally:
+        server.stop(None)
+
+
+class _CountingService(ImageService):
+    """Counts the Process calls it answers."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def Process(self, request, context):
+        self.calls += 1
+        return super().Process(request, context)
+
+
+def test_client_cache(tmpdir):
+    service = _CountingService()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    add_NLImageServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        input_image = cv2.imread(os.path.join(dir_path, "testing_data/image.png"))
+        cache = ResultCache(max_bytes=0, directory=str(tmpdir), max_directory_bytes=1024 * 1024 * 1024)
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            # The concurrent calls for the same image share one request.
+            with futures.ThreadPoolExecutor(max_workers=4) as executor:
+                output_images = list(executor.map(
+                    lambda _: run_one_request_on_channel(
+                        mean=True, rotate=90, channel=channel, input_image=input_image, cache=cache
+                    ),
+                    range(4),
+                ))
+            # And a later client with the same directory doesn't send it.
+            output_images.append(run_one_request_on_channel(
+                mean=True,
+                rotate=90,
+                channel=channel,
+                input_image=input_image,
+                cache=ResultCache(max_bytes=0, directory=str(tmpdir), max_directory_bytes=1024 * 1024 * 1024),
+            ))
+        expected_image = image_utils.get_rotated_image(image_utils.get_mean_image(input_image), 90)
+        for output_image in output_images:
+            assert np.array_equal(output_image, expected_image)
+        assert service.calls == 1
+    finally:
+        server.stop(None)
+
+
+def test_stream_requests_of_an_inactive_call_are_dropped():
+    # Once past its deadline, a stream's requests still waiting aren't run.
+    context = Mock()
+    context.is_active.return_value = False
+    image_pb = image_utils.convert_image_to_proto(np.zeros((8, 6), dtype=np.uint8))
+    requests = [
+        NLImageStreamRequest(
+            request_id=request_id,
+            request=NLImagePipelineRequest(operations=get_pipeline_operations(mean=True, rotate=0), image=image_pb),
+        )
+        for request_id in range(3)
+    ]
+    responses = list(ImageService().StreamProcess(iter(requests), context))
+    assert sorted(response.request_id for response in responses) == [0, 1, 2]
+    assert all(response.image.width == 0 for response in responses)
+
+
+class _BlockingService(ImageService):
+    """Holds every Process call until released, and counts those run."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.processed = 0
+
+    def Process(self, request, context):
+        self.started.set()
+        self.release.wait()
+        self.processed += 1
+        return super().Process(request, context)
+
+
+def test_calls_over_the_limit_are_shed():
+    service = _BlockingService()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), maximum_concurrent_rpcs=1)
+    add_NLImageServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    request = NLImagePipelineRequest(
+        operations=get_pipeline_operations(mean=True, rotate=0),
+        image=image_utils.convert_image_to_proto(np.zeros((8, 6), dtype=np.uint8)),
+    )
+    try:
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            stub = NLImageServiceStub(channel)
+            first_call = stub.Process.future(request)
+            assert service.started.wait(10)
+            with pytest.raises(grpc.RpcError) as error:
+                stub.Process(request, timeout=10)
+            assert error.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+            service.release.set()
+            assert first_call.result().width == 6
+    finally:
+        service.release.set()
+        server.stop(None)
+
+
+def test_calls_past_their_deadline_are_dropped():
+    service = _BlockingService()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
+    add_NLImageServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    request = NLImagePipelineRequest(
+        operations=get_pipeline_operations(mean=True, rotate=0),
+        image=image_utils.convert_image_to_proto(np.zeros((8, 6), dtype=np.uint8)),
+    )
+    try:
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            stub = NLImageServiceStub(channel)
+            first_call = stub.Process.future(request)
+            assert service.started.wait(10)
+            # Queued behind the first call for longer than its deadline.
+            with pytest.raises(grpc.RpcError) as error:
+                stub.Process(request, timeout=0.2)
+            assert error.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+            service.release.set()
+            first_call.result()
+            # A call that would run now comes after the queued one.
+            stub.Process(request, timeout=10)
+        assert service.processed == 2
+    finally:
+        service.release.set()
+        server.stop(None)
+
+
+def test_asyncio_calls_past_their_deadline_are_dropped():
+    async def _process():
+        compute_executor = Mock()
+        service = AsyncImageService(compute_executor, Mock())
+        context = Mock()
+        context.time_remaining.return_value = 0.0
+        request = NLImagePipelineRequest(
+            operations=get_pipeline_operations(mean=True, rotate=0),
+            image=image_utils.convert_image_to_proto(np.zeros((8, 6), dtype=np.uint8)),
+        )
+        response = await service.Process(request, context)
+        assert response.width == 0
+        compute_executor.submit.assert_not_called()
+
+    asyncio.run(_process())
+
+
+def test_stream_requests_on_channel():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    add_NLImageServiceServicer_to_server(ImageService(stream_workers=3), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        random_state = np.random.RandomState(0)
+        input_images = [
+            random_state.randint(0, 256, (10 + index, 20, 3)).astype(np.uint8) for index in range(20)
+        ]
+        operations = get_pipeline_operations(mean=True, rotate=90)
+        requests = [
+            (index, NLImagePipelineRequest(
+                operations=operations, image=image_utils.convert_image_to_proto(input_image)
+            ))
+            for index, input_image in enumerate(input_images)
+        ]
+        # An invalid image only fails its own request.
+        requests[5][1].image.width = 3
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            responses = dict(stream_requests_on_channel(requests, channel=channel, window=4))
+
+        assert sorted(responses) == list(range(20))
+        assert responses[5].width == 0
+        for index, input_image in enumerate(input_images):
+            if index == 5:
+                continue
+            expected_image = image_utils.get_rotated_image(image_utils.get_mean_image(input_image), 90)
+            assert np.array_equal(image_utils.convert_proto_to_image(responses[index]), expected_image)
+    finally:
+        server.stop(None)
+
+
+def test_strips_on_channel():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    add_NLImageServiceServicer_to_server(ImageService(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        input_image = cv2.imread(os.path.join(dir_path, "testing_data/image.png"))
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            output_image = run_strip_request_on_channel(
+                mean=True, channel=channel, input_image=input_image, strip_bytes=100000
+            )
+            assert np.array_equal(output_image, image_utils.get_mean_image(input_image))
+
+            # Rotations can't be done a strip at a time.
+            with pytest.raises(image_utils.NLGRPCException):
+                list(stream_strips_on_channel(
+                    strips=[input_image],
+                    width=input_image.shape[1],
+                    height=input_image.shape[0],
+                    color=True,
+                    operations=get_pipeline_operations(mean=False, rotate=90),
+                    channel=channel,
+                ))
+
+            # Neither can an image that doesn't have as many rows as it says.
+            with pytest.raises(image_utils.NLGRPCException):
+                list(stream_strips_on_channel(
+                    strips=[input_image[:10]],
+                    width=input_image.shape[1],
+                    height=input_image.shape[0],
+                    color=True,
+                    operations=get_pipeline_operations(mean=True, rotate=0),
+                    channel=channel,
+                ))
+    finally:
+        server.stop(None)
+
+
+class _ShortStripsService(ImageService):
+    """Sends back the first strip only."""
+
+    def ProcessStrips(self, request_iterator, context):
+        for response in super().ProcessStrips(request_iterator, context):
+            yield response
+            return
+
+
+def test_strips_on_channel_missing_rows():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    add_NLImageServiceServicer_to_server(_ShortStripsService(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        input_image = cv2.imread(os.path.join(dir_path, "testing_data/image.png"))
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            with pytest.raises(image_utils.NLGRPCException):
+                run_strip_request_on_channel(
+                    mean=True, channel=channel, input_image=input_image, strip_bytes=100000
+                )
+    finally:
+        server.stop(None)
+
+
+@contextlib.contextmanager
+def _asyncio_server():
+    """Run an asyncio server with two compute processes in a process of its own, yielding its port."""
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+    # The server is stopped the way a keyboard interrupt would.
+    server_process = multiprocessing.get_context("spawn").Process(
+        target=_run_asyncio_server_one_process, args=(f"localhost:{port}", 2, "gzip", 4, 2)
+    )
+    server_process.start()
+    try:
+        wait_until_serving(f"localhost:{port}", timeout=120)
+        yield port
+    finally:
+        os.kill(server_process.pid, signal.SIGINT)
+        server_process.join()
+    assert server_process.exitcode == 0
+
+
+def test_server_health():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+    server_process = multiprocessing.get_context("spawn").Process(
+        target=_run_servers_one_process,
+        args=(f"localhost:{port}", 2),
+        kwargs=dict(shutdown_drain_seconds=3.0),
+    )
+    server_process.start()
+    try:
+        # NOT_SERVING while the kernels compile, then SERVING.
+        wait_until_serving(f"localhost:{port}", timeout=120)
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            health_stub = health_pb2_grpc.HealthStub(channel)
+            request = health_pb2.HealthCheckRequest(service="NLImageService")
+            assert health_stub.Check(request).status == health_pb2.HealthCheckResponse.SERVING
+            # Stopping, it still answers for a while, with NOT_SERVING.
+            os.kill(server_process.pid, signal.SIGINT)
+            deadline = time.time() + 2
+            while health_stub.Check(request, timeout=1).status == health_pb2.HealthCheckResponse.SERVING:
+                assert time.time() < deadline
+                time.sleep(0.05)
+    finally:
+        if server_process.is_alive():
+            os.kill(server_process.pid, signal.SIGINT)
+        server_process.join()
+    assert server_process.exitcode == 0
+
+
+def _pretend_server(ready, directory):
+    """Stands for a server process: it records its pid while running, and drains on SIGTERM."""
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    pid_path = os.path.join(directory, str(os.getpid()))
+    open(pid_path, "w").close()
+    ready.set()
+    try:
+        while True:
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        os.remove(pid_path)
+
+
+def _supervise_pretend_servers(directory):
+    context = multiprocessing.get_context("spawn")
+
+    def _start_worker(slot, ready):
+        worker = context.Process(target=_run_worker, args=(_pretend_server, ready, directory))
+        worker.start()
+        return worker
+
+    supervisor = _Supervisor(
+        _start_worker, 2, shutdown_grace_seconds=1.0, shutdown_drain_seconds=0.0, context=context
+    )
+    supervisor.run()
+
+
+def _wait_for_pids(directory, condition) -> set:
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        pids = {int(name) for name in os.listdir(directory)}
+        if condition(pids):
+            return pids
+        time.sleep(0.05)
+    raise TimeoutError(f"The server processes are {pids}")
+
+
+def _start_supervisor(directory):
+    supervisor = multiprocessing.get_context("spawn").Process(target=_supervise_pretend_servers, args=(directory,))
+    supervisor.start()
+    return supervisor
+
+
+def test_supervisor(tmp_path):
+    directory = str(tmp_path)
+    supervisor = _start_supervisor(directory)
+    try:
+        pids = _wait_for_pids(directory, lambda pids: len(pids) == 2)
+        # A process that dies is respawned.
+        killed_pid = min(pids)
+        os.kill(killed_pid, signal.SIGKILL)
+        os.remove(os.path.join(directory, str(killed_pid)))
+        pids = _wait_for_pids(directory, lambda new_pids: len(new_pids) == 2 and killed_pid not in new_pids)
+        # SIGHUP replaces every process, each one draining once its replacement serves.
+        os.kill(supervisor.pid, signal.SIGHUP)
+        _wait_for_pids(directory, lambda new_pids: len(new_pids) == 2 and not new_pids & pids)
+        # SIGTERM drains them all.
+        os.kill(supervisor.pid, signal.SIGTERM)
+        supervisor.join(30)
+    finally:
+        if supervisor.is_alive():
+            supervisor.kill()
+    assert supervisor.exitcode == 0
+    assert os.listdir(directory) == []
+
+
+def test_server_processes_stop_with_the_supervisor(tmp_path):
+    directory = str(tmp_path)
+    supervisor = _start_supervisor(directory)
+    try:
+        _wait_for_pids(directory, lambda pids: len(pids) == 2)
+        os.kill(supervisor.pid, signal.SIGKILL)
+        supervisor.join()
+        # They drain as on SIGTERM, rather than keep serving the port.
+        _wait_for_pids(directory, lambda pids: not pids)
+    finally:
+        if supervisor.is_alive():
+            supervisor.kill()
+
+
+def test_shared_memory_ring():
+    async def _take_and_release():
+        ring = _SharedMemoryRing(1024)
+        try:
+            first = await ring.take(300)
+            second = await ring.take(400)
+            assert (first[0], second[0]) == (0, 320)
+            # The end of the ring is too small, the start is still taken.
+            waiting = asyncio.ensure_future(ring.take(300))
+            await asyncio.sleep(0)
+            assert not waiting.done()
+            # Released out of order, the space comes back with the oldest range.
+            ring.release(second)
+            await asyncio.sleep(0)
+            assert not waiting.done()
+            ring.release(first)
+            assert (await waiting)[0] == 0
+
+            with pytest.raises(ValueError):
+                await ring.take(2048)
+        finally:
+            ring.close()
+
+    asyncio.new_event_loop().run_until_complete(_take_and_release())
+
+
+def test_asyncio_server():
+    random_state = np.random.RandomState(0)
+    color_image = random_state.randint(0, 256, (37, 51, 3)).astype(np.uint8)
+    greyscale_image = random_state.randint(0, 256, (40, 30)).astype(np.uint8)
+    with _asyncio_server() as port:
+        with create_channel(f"localhost:{port}") as channel:
+            for input_image in [color_image, greyscale_image]:
+                for mean, rotate in [(True, 0), (False, 90), (True, 270)]:
+                    output_image = run_one_request_on_channel(
+                        mean=mean, rotate=rotate, channel=channel, input_image=input_image
+                    )
+                    expected_image = input_image
+                    if mean:
+                        expected_image = image_utils.get_mean_image(expected_image)
+                    expected_image = image_utils.get_rotated_image(expected_image, rotate)
+                    assert np.array_equal(output_image, expected_image)
+
+            # Encoded images are decoded and encoded by the compute processes.
+            png_pb = image_utils.convert_image_to_proto(color_image, encoding=NLImage.PNG)
+            png_pb.response_encoding = NLImage.PNG
+            response = run_one_proto_request_on_channel(
+                mean=True, rotate=90, channel=channel, image_pb=png_pb
+            )
+            assert response.encoding == NLImage.PNG
+            assert np.array_equal(
+                image_utils.convert_proto_to_image(response),
+                image_utils.get_rotated_image(image_utils.get_mean_image(color_image), 90),
+            )
+
+            # An invalid image only fails its own request of a stream.
+            requests = [
+                (index, NLImagePipelineRequest(
+                    operations=get_pipeline_operations(mean=True, rotate=180),
+                    image=image_utils.convert_image_to_proto(color_image),
+                ))
+                for index in range(10)
+            ]
+            requests[3][1].image.width = 3
+            responses = dict(stream_requests_on_channel(requests, channel=channel, window=4))
+            assert sorted(responses) == list(range(10))
+            assert responses[3].width == 0
+            expected_image = image_utils.get_rotated_image(image_utils.get_mean_image(color_image), 180)
+            assert np.array_equal(image_utils.convert_proto_to_image(responses[0]), expected_image)
+
+            # The strips run on the threads of the server.
+            output_image = run_strip_request_on_channel(
+                mean=True, channel=channel, input_image=color_image, strip_bytes=1000
+            )
+            assert np.array_equal(output_image, image_utils.get_mean_image(color_image))
@@ -0,0 +1,25 @@
+import grpc
+import numpy as np
+import pytest
+
+from image_manipulation import compression
+
+
+def test_fixed_policies():
+    assert compression.get_default_compression("none") == grpc.Compression.NoCompression
+    assert compression.get_default_compression("GZIP") == grpc.Compression.Gzip
+    assert compression.get_default_compression("auto") == grpc.Compression.NoCompression
+    assert compression.choose_message_compression(b"", "deflate") == grpc.Compression.Deflate
+    with pytest.raises(ValueError):
+        compression.check_compression_policy("brotli")
+
+
+def test_auto_policy():
+    # Small messages aren't worth compressing.
+    assert compression.choose_message_compression(bytes(1024), "auto") == grpc.Compression.NoCompression
+
+    flat_image = np.full((512, 512, 3), 128, dtype=np.uint8).tobytes()
+    assert compression.choose_message_compression(flat_image, "auto") == grpc.Compression.Gzip
+
+    noisy_image = np.random.RandomState(0).randint(0, 256, (512, 512, 3)).astype(np.uint8).tobytes()
+    assert compression.choose_message_compression(noisy_image, "auto") == grpc.Compression.NoCompression
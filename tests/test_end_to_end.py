@@ -1,15 +1,24 @@
 from contextlib import contextmanager
-from multiprocessing import Process
+import signal
+import socket
 import subprocess
 import time
 import os
 
+from image_manipulation.health_checks import wait_until_serving
+
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
 
+def _get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
 @contextmanager
-def grpc_server_process(port:int = 5000, host: str = "localhost") -> Process:
+def grpc_server_process(port: int, host: str = "localhost") -> subprocess.Popen:
     """An image-manipulation server handle.
 
     Args:
@@ -19,29 +28,29 @@ def grpc_server_process(port:int = 5000, host: str = "localhost") -> Process:
     Returns:
         The image manipulation server process handle.
     """
-
-    def _start_mock_server():
-        server_sub_process = subprocess.Popen(
-            ["server", f"--host {host}", f"--port {port}"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        _, _ = server_sub_process.communicate()
-
-    server_process = Process(target=_start_mock_server)
-    server_process.start()
+    server_process = subprocess.Popen(
+        ["server", "--host", f"{host}", "--port", f"{port}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
     try:
+        # Once a server process has compiled its kernels.
+        wait_until_serving(f"{host}:{port}", timeout=120)
         yield server_process
-    finally: server_process.terminate()
+    finally:
+        # The supervisor drains its server processes and waits for them.
+        server_process.send_signal(signal.SIGTERM)
+        server_process.wait()
 
 
-def test_end_to_end_server_client(port: int = 5000, host: str = "localhost"): 
+def test_end_to_end_server_client(tmp_path, host: str = "localhost"): 
     """Test one full client-server call."""
+    port = _get_free_port()
     input_image_path = os.path.join(dir_path, "testing_data/image.png")
     time_at_start = time.time()
-    output_image_path = os.path.join(dir_path, f"testing_data/op_{time_at_start}.png")
+    output_image_path = str(tmp_path / f"op_{time_at_start}.png")
     # Start the server.
-    with grpc_server_process() as server:
+    with grpc_server_process(port, host) as server:
         client_sub_process = subprocess.run(
             [
                 "client", 
@@ -0,0 +1,28 @@
+from concurrent import futures
+
+import grpc
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+import pytest
+
+from image_manipulation import health_checks
+
+
+def test_check_health():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    health_servicer = health.HealthServicer()
+    health_pb2_grpc.add_HealthServicer_to_server(health_servicer, server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            health_servicer.set("", health_pb2.HealthCheckResponse.NOT_SERVING)
+            assert not health_checks.check_health(channel)
+            with pytest.raises(TimeoutError):
+                health_checks.wait_until_serving(f"localhost:{port}", timeout=0.5)
+            health_servicer.set("", health_pb2.HealthCheckResponse.SERVING)
+            assert health_checks.check_health(channel)
+            health_checks.wait_until_serving(f"localhost:{port}", timeout=5)
+    finally:
+        server.stop(None)
+    with grpc.insecure_channel("localhost:1") as channel:
+        assert not health_checks.check_health(channel)
@@ -0,0 +1,183 @@
+import asyncio
+from concurrent import futures
+import os
+import shutil
+import threading
+import time
+
+import cv2
+import grpc
+import numpy as np
+import pytest
+
+from image_manipulation import image_utils
+from image_manipulation.communication_utils import ImageService, SERVER_OPTIONS
+from image_manipulation.image_client import AsyncImageClient, ImageClient
+from image_manipulation.image_pb2 import NLImage
+from image_manipulation.image_pb2_grpc import add_NLImageServiceServicer_to_server
+
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+input_image_path = os.path.join(dir_path, "testing_data/image.png")
+
+
+class _ConcurrencyService(ImageService):
+    """Records the number of pipeline requests and the most it was running at once."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.calls = 0
+
+    def Process(self, request, context):
+        with self._lock:
+            self.running += 1
+            self.calls += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            return super().Process(request, context)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def _start_server() -> tuple:
+    service = _ConcurrencyService()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=8), options=SERVER_OPTIONS)
+    add_NLImageServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    return server, f"localhost:{port}", service
+
+
+@pytest.fixture
+def server():
+    server, target, service = _start_server()
+    yield target, service
+    server.stop(None)
+
+
+def _copy_input_images(tmp_path, count: int) -> tuple:
+    input_paths = [str(tmp_path / f"image_{index}.png") for index in range(count)]
+    for input_path in input_paths:
+        shutil.copy(input_image_path, input_path)
+    broken_path = tmp_path / "broken.png"
+    broken_path.write_text("not an image")
+    input_paths.insert(1, str(broken_path))
+    output_paths = [str(tmp_path / f"manipulated_{index}.png") for index in range(len(input_paths))]
+    return input_paths, output_paths
+
+
+def test_image_client(server):
+    target, service = server
+    input_image = cv2.imread(input_image_path)
+    expected_image = image_utils.get_rotated_image(image_utils.get_mean_image(input_image), 90)
+    with ImageClient(target, max_in_flight=2) as client:
+        results = [client.submit(input_image, mean=True, rotate=90) for _ in range(6)]
+        for result in results:
+            assert np.array_equal(result.result(), expected_image)
+        # A message in, a message out.
+        image_pb = client.submit(image_utils.convert_image_to_proto(input_image), rotate=90).result()
+        assert isinstance(image_pb, NLImage)
+        invalid_image = NLImage(width=2, height=2, data=b"\x00")
+        with pytest.raises(image_utils.NLGRPCException):
+            client.submit(invalid_image, mean=True).result()
+        with pytest.raises(ValueError):
+            client.submit(input_image, rotate=360)
+    assert service.max_running <= 2
+
+
+def test_image_client_round_robin():
+    servers = [_start_server() for _ in range(2)]
+    input_image = cv2.imread(input_image_path)
+    try:
+        with ImageClient(
+            [target for _, target, _ in servers],
+            channels_per_target=2,
+            policy="round_robin",
+            keepalive_seconds=20,
+            window_bytes=1 << 20,
+        ) as client:
+            client.wait_until_ready(timeout=10)
+            for _ in range(8):
+                client.submit(input_image, mean=True).result()
+    finally:
+        for server, _, _ in servers:
+            server.stop(None)
+    assert [service.calls for _, _, service in servers] == [4, 4]
+
+
+def test_image_client_leaves_out_a_server_that_is_down(server):
+    target, service = server
+    input_image = cv2.imread(input_image_path)
+    with ImageClient([target, "localhost:1"], health_check_seconds=0.1) as client:
+        deadline = time.time() + 10
+        while client.balancer.stats()[1]["serving"] and time.time() < deadline:
+            time.sleep(0.05)
+        for _ in range(8):
+            client.submit(input_image, mean=True).result()
+    assert service.calls == 8
+
+
+def test_image_client_process_files(server, tmp_path):
+    target, _ = server
+    input_paths, output_paths = _copy_input_images(tmp_path, 4)
+    with ImageClient(target, max_in_flight=2) as client:
+        results = list(client.process_files(input_paths, output_paths, mean=True, read_ahead=2))
+
+    assert [input_path for input_path, _ in results] == input_paths
+    assert [error is None for _, error in results] == [True, False, True, True, True]
+    expected_image = image_utils.get_mean_image(cv2.imread(input_image_path))
+    for output_path in output_paths[:1] + output_paths[2:]:
+        assert np.array_equal(cv2.imread(output_path), expected_image)
+
+
+def test_async_image_client(server, tmp_path):
+    target, service = server
+    input_image = cv2.imread(input_image_path)
+    expected_image = image_utils.get_rotated_image(input_image, 180)
+    input_paths, output_paths = _copy_input_images(tmp_path, 4)
+
+    async def _run() -> tuple:
+        async with AsyncImageClient(target, max_in_flight=2) as client:
+            images = await asyncio.gather(*[client.process(input_image, rotate=180) for _ in range(6)])
+            results = [
+                result
+                async for result in client.process_files(input_paths, output_paths, rotate=180, encoded=True)
+            ]
+        return images, results
+
+    images, results = asyncio.run(_run())
+    assert all(np.array_equal(image, expected_image) for image in images)
+    assert service.max_running <= 2
+    assert [input_path for input_path, _ in results] == input_paths
+    assert [error is None for _, error in results] == [True, False, True, True, True]
+    assert np.array_equal(cv2.imread(output_paths[0]), expected_image)
+
+
+def test_image_client_process_files_errors(server, tmp_path):
+    target, _ = server
+    input_paths, output_paths = _copy_input_images(tmp_path, 2)
+
+    def _failing_paths():
+        yield input_paths[0]
+        raise OSError("The listing failed")
+
+    with ImageClient(target) as client:
+        with pytest.raises(ValueError):
+            next(client.process_files(input_paths, output_paths[:-1], mean=True))
+        results = client.process_files(_failing_paths(), output_paths, mean=True)
+        assert next(results) == (input_paths[0], None)
+        with pytest.raises(OSError):
+            next(results)
+
+    async def _run() -> None:
+        async with AsyncImageClient(target) as client:
+            results = client.process_files(_failing_paths(), iter(output_paths), mean=True)
+            assert await results.__anext__() == (input_paths[0], None)
+            with pytest.raises(OSError):
+                await results.__anext__()
+
+    asyncio.run(_run())
@@ -1,6 +1,7 @@
 import numpy as np
 import cv2
 import os
+import pytest
 
 from image_manipulation import __version__
 from image_manipulation import image_utils 
@@ -25,11 +26,16 @@ def test_image_manipulations():
     assert np.allclose(mean_image, expected_mean), "The mean function is broken on the mock image"
     rotated_image = image_utils.get_rotated_image(input_image, 90)
     expected_rotated_image = np.array(
-        [[ 0,  7, 11],
-         [ 0,  8, 12],
-         [ 0,  9, 13]], dtype=np.uint8
+        [[15, 13,  9],
+         [14, 12,  8],
+         [13, 11,  7]], dtype=np.uint8
+    )
+    assert np.array_equal(rotated_image, expected_rotated_image)
+    assert np.array_equal(image_utils.get_rotated_image(input_image, 0), input_image)
+    assert np.array_equal(image_utils.get_rotated_image(input_image, 180), input_image[::-1, ::-1])
+    assert np.array_equal(
+        image_utils.get_rotated_image(input_image, 270), expected_rotated_image[::-1, ::-1]
     )
-    assert np.allclose(rotated_image, expected_rotated_image)
 
     # Now let's try the operations on a real image.
     input_image_path = os.path.join(dir_path, "testing_data/image.png")
@@ -39,7 +45,7 @@ def test_image_manipulations():
     assert np.allclose(mean_image, expected_mean_image, atol=3.0), "Averaging function is broken"
     rotated_image = image_utils.get_rotated_image(input_image, 90)
     expected_rotated_image = cv2.imread(os.path.join(dir_path, "testing_data/rotated_image.png"))
-    assert np.allclose(rotated_image, expected_rotated_image), "Rotation function is broken"
+    assert np.array_equal(rotated_image, expected_rotated_image), "Rotation function is broken"
 
 
 def test_convert_image_to_pb_and_back():
@@ -55,3 +61,121 @@ def test_convert_image_to_pb_and_back():
     image_pb = image_utils.convert_image_to_proto(gray_image)
     recovered_image = image_utils.convert_proto_to_image(image_pb)
     assert np.allclose(recovered_image, gray_image, atol=0.0), "Image has been changed."
+
+    # Strided views, e.g. rotations, are serialised row-wise.
+    rotated_image = image_utils.get_rotated_image(input_image, 90)
+    image_pb = image_utils.convert_image_to_proto(rotated_image)
+    recovered_image = image_utils.convert_proto_to_image(image_pb)
+    assert np.array_equal(recovered_image, rotated_image), "Image has been changed."
+
+
+def test_mean_filter_channels_are_independent():
+    image_utils.warm_up_kernels()
+    input_image = np.random.RandomState(0).randint(0, 256, (31, 17, 3)).astype(np.uint8)
+    mean_image = image_utils.get_mean_image(input_image)
+    for depth in range(3):
+        expected_channel = image_utils.get_mean_image(input_image[:, :, depth])
+        assert np.array_equal(mean_image[:, :, depth], expected_channel), "Channels are mixed up"
+
+
+def _reference_mean_image(input_image, kernel_size):
+    """Straightforward clipped-window mean used to check the fast kernel."""
+    radius = kernel_size // 2
+    rows, columns = input_image.shape[:2]
+    expected = np.empty_like(input_image)
+    for i in range(rows):
+        for j in range(columns):
+            window = input_image[
+                max(i - radius, 0):i + radius + 1, max(j - radius, 0):j + radius + 1
+            ].astype(np.int64)
+            expected[i, j] = window.sum(axis=(0, 1)) // (window.shape[0] * window.shape[1])
+    return expected
+
+
+def test_mean_filter_kernel_sizes():
+    random_state = np.random.RandomState(1)
+    for shape in [(1, 1), (2, 9), (9, 2, 3), (12, 15), (12, 15, 3)]:
+        input_image = random_state.randint(0, 256, shape).astype(np.uint8)
+        for kernel_size in [1, 3, 5, 7]:
+            mean_image = image_utils.get_mean_image(input_image, kernel_size=kernel_size)
+            assert np.array_equal(mean_image, _reference_mean_image(input_image, kernel_size)), \
+                f"Mean filter is broken for {shape} with a kernel of {kernel_size}"
+
+    with pytest.raises(ValueError):
+        image_utils.get_mean_image(input_image, kernel_size=4)
+
+
+def test_mean_filter_reads_proto_view_into_preallocated_output():
+    input_image = np.random.RandomState(2).randint(0, 256, (20, 30, 3)).astype(np.uint8)
+    read_only_image = image_utils.convert_proto_to_image(image_utils.convert_image_to_proto(input_image))
+    assert not read_only_image.flags.writeable
+
+    output_image = np.empty_like(input_image)
+    mean_image = image_utils.get_mean_image(read_only_image, out=output_image)
+    assert mean_image is output_image
+    assert np.array_equal(mean_image, image_utils.get_mean_image(input_image))
+
+    with pytest.raises(ValueError):
+        image_utils.get_mean_image(read_only_image, out=np.empty((20, 30), dtype=np.uint8))
+
+
+def test_mean_filter_batch():
+    random_state = np.random.RandomState(3)
+    for shape in [(5, 1, 1), (4, 12, 15), (4, 12, 15, 3)]:
+        input_images = random_state.randint(0, 256, shape).astype(np.uint8)
+        mean_images = image_utils.get_mean_image_batch(input_images)
+        # No pixel leaks from one image of the stack to the next.
+        for input_image, mean_image in zip(input_images, mean_images):
+            assert np.array_equal(mean_image, image_utils.get_mean_image(input_image))
+
+    with pytest.raises(ValueError):
+        image_utils.get_mean_image_batch(input_images, out=np.empty(shape[1:], dtype=np.uint8))
+
+
+def test_encoded_images():
+    input_image_path = os.path.join(dir_path, "testing_data/image.png")
+    input_image = cv2.imread(input_image_path)
+    # The bytes of the file on disk can be sent as they are.
+    with open(input_image_path, "rb") as input_file:
+        image_pb = image_utils.NLImage(
+            data=input_file.read(), encoding=image_utils.get_encoding_from_path(input_image_path)
+        )
+    assert np.array_equal(image_utils.convert_proto_to_image(image_pb), input_image)
+
+    gray_image = cv2.cvtColor(input_image, cv2.COLOR_BGR2GRAY)
+    for image in [input_image, gray_image]:
+        for extension in ["image.png", "image.webp"]:
+            image_pb = image_utils.convert_image_to_proto(
+                image, encoding=image_utils.get_encoding_from_path(extension)
+            )
+            assert (image_pb.width, image_pb.height) == (image.shape[1], image.shape[0])
+            recovered_image = image_utils.convert_proto_to_image(image_pb)
+            assert np.array_equal(recovered_image, image), f"{extension} isn't lossless."
+        image_pb = image_utils.convert_image_to_proto(image, encoding=image_utils.NLImage.JPEG)
+        assert np.allclose(image_utils.convert_proto_to_image(image_pb), image, atol=40)
+
+    with pytest.raises(ValueError):
+        image_utils.get_encoding_from_path("image.tiff")
+    with pytest.raises(ValueError):
+        image_utils.convert_proto_to_image(
+            image_utils.NLImage(data=b"not an image", encoding=image_utils.NLImage.PNG)
+        )
+
+
+def test_strip_mean_filter():
+    random_state = np.random.RandomState(3)
+    for shape in [(1, 7), (23, 9), (40, 11, 3)]:
+        input_image = random_state.randint(0, 256, shape).astype(np.uint8)
+        for kernel_size in [3, 5]:
+            for strip_rows in [1, 2, 7, 100]:
+                strip_filter = image_utils.StripMeanFilter(kernel_size=kernel_size)
+                output_strips = []
+                for start in range(0, shape[0], strip_rows):
+                    strip = input_image[start:start + strip_rows]
+                    output_strips.append(
+                        strip_filter.push(strip, last=start + strip_rows >= shape[0])
+                    )
+                assert np.array_equal(
+                    np.concatenate(output_strips),
+                    image_utils.get_mean_image(input_image, kernel_size=kernel_size),
+                ), f"Strips of {strip_rows} rows of {shape} are filtered wrongly."
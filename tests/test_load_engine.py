@@ -0,0 +1,197 @@
+from concurrent import futures
+import os
+import shutil
+
+import cv2
+import grpc
+import numpy as np
+
+from image_manipulation import image_utils
+from image_manipulation.communication_utils import ImageService
+from image_manipulation.image_pb2_grpc import add_NLImageServiceServicer_to_server
+from image_manipulation.load_engine import list_image_files, run_load
+
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+
+def test_run_load(tmp_path):
+    input_directory = tmp_path / "input"
+    output_directory = tmp_path / "output"
+    input_directory.mkdir()
+    output_directory.mkdir()
+    input_image_path = os.path.join(dir_path, "testing_data/image.png")
+    for index in range(5):
+        shutil.copy(input_image_path, input_directory / f"image_{index}.PNG")
+    (input_directory / "notes.txt").write_text("not an image")
+    (input_directory / "broken.png").write_text("not an image either")
+    assert len(list_image_files(str(input_directory), [".png", ".jpg"])) == 6
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    add_NLImageServiceServicer_to_server(ImageService(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        counts = run_load(
+            input_directory=str(input_directory),
+            output_directory=str(output_directory),
+            target=f"localhost:{port}",
+            mean=True,
+            rotate=90,
+            extensions=[".png", ".jpg"],
+            workers=2,
+            window=2,
+        )
+    finally:
+        server.stop(None)
+
+    assert counts == {"written": 5, "failed": 1}
+    input_image = cv2.imread(input_image_path)
+    expected_image = image_utils.get_rotated_image(image_utils.get_mean_image(input_image), 90)
+    for index in range(5):
+        output_image = cv2.imread(str(output_directory / f"manipulated_image_{index}.PNG"))
+        assert np.array_equal(output_image, expected_image)
+
+
+class _CountingService(ImageService):
+    """Counts the images it answers on streams."""
+
+    def __init__(self):
+        super().__init__()
+        self.images = 0
+
+    def StreamProcess(self, request_iterator, context):
+        for response in super().StreamProcess(request_iterator, context):
+            self.images += 1
+            yield response
+
+
+def test_run_load_cache(tmp_path):
+    input_directory = tmp_path / "input"
+    output_directory = tmp_path / "output"
+    cache_directory = str(tmp_path / "cache")
+    input_directory.mkdir()
+    output_directory.mkdir()
+    input_image_path = os.path.join(dir_path, "testing_data/image.png")
+    # Three copies of the same image, and one that differs.
+    for index in range(3):
+        shutil.copy(input_image_path, input_directory / f"image_{index}.png")
+    changed_image = cv2.imread(input_image_path)
+    changed_image[0, 0] = 255 - changed_image[0, 0]
+    cv2.imwrite(str(input_directory / "changed.png"), changed_image)
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    service = _CountingService()
+    add_NLImageServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        run = lambda: run_load(
+            input_directory=str(input_directory),
+            output_directory=str(output_directory),
+            target=f"localhost:{port}",
+            mean=True,
+            rotate=90,
+            extensions=[".png"],
+            workers=2,
+            window=2,
+            cache_directory=cache_directory,
+        )
+        assert run() == {"written": 4, "failed": 0}
+        assert service.images == 2
+        # Nothing changed, nothing is sent.
+        assert run() == {"written": 4, "failed": 0}
+        assert service.images == 2
+
+        # The workers spill every response, and the directory is trimmed to its budget after.
+        run_load(
+            input_directory=str(input_directory),
+            output_directory=str(tmp_path),
+            target=f"localhost:{port}",
+            mean=False,
+            rotate=90,
+            extensions=[".png"],
+            workers=2,
+            window=2,
+            cache_directory=cache_directory,
+            cache_directory_megabytes=0,
+        )
+        assert service.images == 4
+        assert os.listdir(cache_directory) == []
+    finally:
+        server.stop(None)
+
+    input_image = cv2.imread(input_image_path)
+    expected_image = image_utils.get_rotated_image(image_utils.get_mean_image(input_image), 90)
+    for index in range(3):
+        output_image = cv2.imread(str(output_directory / f"manipulated_image_{index}.png"))
+        assert np.array_equal(output_image, expected_image)
+    expected_image = image_utils.get_rotated_image(image_utils.get_mean_image(changed_image), 90)
+    assert np.array_equal(cv2.imread(str(output_directory / "manipulated_changed.png")), expected_image)
+
+
+def test_run_load_write_failures(tmp_path):
+    input_directory = tmp_path / "input"
+    input_directory.mkdir()
+    input_image_path = os.path.join(dir_path, "testing_data/image.png")
+    for index in range(5):
+        shutil.copy(input_image_path, input_directory / f"image_{index}.png")
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    add_NLImageServiceServicer_to_server(ImageService(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        # The output directory is missing, so none of the files can be opened.
+        counts = run_load(
+            input_directory=str(input_directory),
+            output_directory=str(tmp_path / "missing"),
+            target=f"localhost:{port}",
+            mean=False,
+            rotate=90,
+            extensions=[".png"],
+            workers=2,
+            window=1,
+            encoded=True,
+        )
+    finally:
+        server.stop(None)
+
+    assert counts == {"written": 0, "failed": 5}
+
+
+def test_run_load_cache_failures(tmp_path):
+    input_directory = tmp_path / "input"
+    output_directory = tmp_path / "output"
+    cache_directory = str(tmp_path / "cache")
+    input_directory.mkdir()
+    output_directory.mkdir()
+    input_image_path = os.path.join(dir_path, "testing_data/image.png")
+    for index in range(2):
+        shutil.copy(input_image_path, input_directory / f"image_{index}.png")
+        (input_directory / f"broken_{index}.png").write_text("not an image")
+    # Left by an earlier run, it isn't the result of this one.
+    (output_directory / "manipulated_broken_0.png").write_text("stale")
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    add_NLImageServiceServicer_to_server(ImageService(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    try:
+        run = lambda output_directory: run_load(
+            input_directory=str(input_directory),
+            output_directory=str(output_directory),
+            target=f"localhost:{port}",
+            mean=True,
+            rotate=90,
+            extensions=[".png"],
+            workers=2,
+            window=2,
+            cache_directory=cache_directory,
+        )
+        assert run(output_directory) == {"written": 2, "failed": 2}
+        assert not os.path.exists(output_directory / "manipulated_broken_1.png")
+        # The responses come from the cache, and the files can't be opened.
+        assert run(tmp_path / "missing") == {"written": 0, "failed": 4}
+    finally:
+        server.stop(None)
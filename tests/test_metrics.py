@@ -0,0 +1,106 @@
+from concurrent import futures
+import os
+import urllib.request
+
+import cv2
+import grpc
+
+from image_manipulation import metrics
+from image_manipulation.communication_utils import ImageService, run_one_request_on_channel
+from image_manipulation.image_pb2_grpc import add_NLImageServiceServicer_to_server
+from image_manipulation.image_utils import convert_image_to_proto
+
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+
+def _sample(snapshot: dict, name: str, *labels):
+    for sample_labels, value in snapshot[name]["samples"]:
+        if sample_labels == list(labels):
+            return value
+    return None
+
+
+def test_metrics_snapshot_and_render():
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter("calls_total", "Calls.", ["method"]))
+    gauge = registry.register(metrics.Gauge("depth", "Depth.", ["queue"]))
+    histogram = registry.register(metrics.Histogram("seconds", "Seconds.", buckets=[0.1, 1.0]))
+    counter.inc(method="Process")
+    counter.inc(2, method="Process")
+    gauge.set(3, queue="a")
+    gauge.set_function(lambda: 7, queue="b")
+    for value in [0.05, 0.1, 0.5, 5.0]:
+        histogram.observe(value)
+
+    snapshot = registry.snapshot()
+    assert _sample(snapshot, "calls_total", "Process") == 3
+    assert (_sample(snapshot, "depth", "a"), _sample(snapshot, "depth", "b")) == (3, 7)
+    assert _sample(snapshot, "seconds") == {"counts": [2, 1, 1], "sum": 5.65}
+
+    merged = metrics.merge_snapshots([snapshot, snapshot])
+    assert _sample(merged, "calls_total", "Process") == 6
+    assert _sample(merged, "seconds") == {"counts": [4, 2, 2], "sum": 11.3}
+
+    lines = metrics.render(snapshot).splitlines()
+    assert "# TYPE calls_total counter" in lines
+    assert 'calls_total{method="Process"} 3.0' in lines
+    # The buckets are cumulative.
+    assert 'seconds_bucket{le="0.1"} 2' in lines
+    assert 'seconds_bucket{le="1.0"} 3' in lines
+    assert 'seconds_bucket{le="+Inf"} 4' in lines
+    assert "seconds_count 4" in lines
+
+
+def test_server_metrics():
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=2), interceptors=(metrics.MetricsInterceptor(),)
+    )
+    add_NLImageServiceServicer_to_server(ImageService(), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    before = metrics.REGISTRY.snapshot()
+    try:
+        input_image = cv2.imread(os.path.join(dir_path, "testing_data/image.png"))
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            run_one_request_on_channel(mean=True, rotate=0, channel=channel, input_image=input_image)
+    finally:
+        server.stop(None)
+    after = metrics.REGISTRY.snapshot()
+
+    def _count(snapshot, name, *labels):
+        # The number of observations of a histogram.
+        value = _sample(snapshot, name, *labels) or 0
+        return sum(value["counts"]) if isinstance(value, dict) else value
+
+    def _difference(name, *labels):
+        return _count(after, name, *labels) - _count(before, name, *labels)
+
+    assert _difference("image_service_rpc_duration_seconds", "MeanFilter") == 1
+    for stage in ["decode", "compute", "encode"]:
+        assert _difference("image_service_stage_duration_seconds", stage) == 1
+    assert _difference("image_service_received_bytes_total", "MeanFilter") == (
+        convert_image_to_proto(input_image).ByteSize()
+    )
+    assert _difference("image_service_sent_bytes_total", "MeanFilter") > input_image.nbytes
+    assert _sample(after, "image_service_rpcs_in_flight", "MeanFilter") == 0
+
+
+def test_metrics_server():
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter("calls_total", "Calls.", ["method"]))
+    counter.inc(method="Process")
+    worker_servers = [metrics.start_metrics_server("localhost", 0, collect=registry.snapshot) for _ in range(2)]
+    urls = [f"http://localhost:{worker_server.server_address[1]}/metrics.json" for worker_server in worker_servers]
+    # A process that isn't up is left out.
+    urls.append("http://localhost:1/metrics.json")
+    aggregator = metrics.start_metrics_server("localhost", 0, collect=lambda: metrics.collect_from(urls))
+    try:
+        with urllib.request.urlopen(f"http://localhost:{aggregator.server_address[1]}/metrics") as response:
+            assert response.headers["Content-Type"] == metrics.TEXT_CONTENT_TYPE
+            lines = response.read().decode("utf-8").splitlines()
+        assert 'calls_total{method="Process"} 2.0' in lines
+    finally:
+        for metrics_server in worker_servers + [aggregator]:
+            metrics_server.shutdown()
+            metrics_server.server_close()
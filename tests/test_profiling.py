@@ -0,0 +1,53 @@
+import os
+import signal
+import threading
+import time
+
+from image_manipulation import profiling
+
+
+def _busy_function(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler():
+    stop = threading.Event()
+    busy_thread = threading.Thread(target=_busy_function, args=(stop,))
+    busy_thread.start()
+    idle_thread = threading.Thread(target=stop.wait)
+    idle_thread.start()
+    profiler = profiling.SamplingProfiler(interval=0.001)
+    profiler.start()
+    time.sleep(0.2)
+    counts = profiler.stop()
+    stop.set()
+    busy_thread.join()
+    idle_thread.join()
+
+    assert profiler.samples > 0
+    busy_stacks = [stack for stack in counts if stack.endswith("_busy_function (test_profiling.py:9)")]
+    assert busy_stacks
+    # The outermost frame comes first.
+    assert busy_stacks[0].startswith("_bootstrap (threading.py")
+    # The thread waiting, like the sampler itself, isn't counted.
+    assert not [stack for stack in counts if "wait (threading.py" in stack or "_run (profiling.py" in stack]
+
+
+def test_profile_on_signal(tmpdir):
+    directory = str(tmpdir)
+    previous_handler = signal.getsignal(profiling.PROFILE_SIGNAL)
+    try:
+        profiling.install_profile_signal_handler(directory, seconds=0.1)
+        os.kill(os.getpid(), profiling.PROFILE_SIGNAL)
+        deadline = time.time() + 5
+        while not os.listdir(directory) and time.time() < deadline:
+            time.sleep(0.05)
+        # Let the capture finish writing.
+        time.sleep(0.2)
+    finally:
+        signal.signal(profiling.PROFILE_SIGNAL, previous_handler)
+    filenames = os.listdir(directory)
+    assert len(filenames) == 1
+    assert filenames[0].startswith(f"profile_{os.getpid()}_")
+    assert filenames[0].endswith(".collapsed")